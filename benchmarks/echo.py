@@ -0,0 +1,53 @@
+"""
+Loopback echo server and client shared by the benchmarks
+"""
+
+import asyncio
+import time
+
+from wizmsg import Server
+from wizmsg.network import FrameDecoder
+
+
+class EchoServer(Server):
+    def handle_message(self, session, message):
+        session.send(message)
+
+
+async def _read(reader: asyncio.StreamReader, size: int) -> bytes:
+    data = await reader.read(size)
+    if not data:
+        raise ConnectionError("server closed the connection")
+
+    return data
+
+
+async def echo_client(port: int, raw: bytes, frames: int, window: int) -> list[float]:
+    """
+    Keeps window frames in flight; returns the round trip time of each one
+    """
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    decoder = FrameDecoder()
+
+    # session offer
+    while not decoder.feed(await _read(reader, 4096)):
+        pass
+
+    sent_at: list[float] = []
+    latencies: list[float] = []
+    while len(latencies) < frames:
+        while len(sent_at) < frames and len(sent_at) - len(latencies) < window:
+            writer.write(raw)
+            sent_at.append(time.perf_counter())
+
+        data = await _read(reader, 65536)
+
+        now = time.perf_counter()
+        for _ in decoder.feed(data):
+            # echoes come back in order
+            latencies.append(now - sent_at[len(latencies)])
+
+    writer.close()
+    await writer.wait_closed()
+
+    return latencies
@@ -0,0 +1,85 @@
+"""
+Loopback echo throughput on each available event loop
+
+python benchmarks/loop_throughput.py --clients 8 --frames 20000
+"""
+
+import argparse
+import asyncio
+import time
+
+from loguru import logger
+
+import wizmsg
+from wizmsg.network import MessageData
+
+from echo import EchoServer, echo_client
+
+PROTOCOL = """<?xml version="1.0" ?>
+<BenchMessages>
+  <_ProtocolInfo>
+    <RECORD>
+      <ServiceID TYPE="UBYT">1</ServiceID>
+      <ProtocolType TYPE="STR">BENCH</ProtocolType>
+      <ProtocolVersion TYPE="INT">1</ProtocolVersion>
+      <ProtocolDescription TYPE="STR">benchmark messages</ProtocolDescription>
+    </RECORD>
+  </_ProtocolInfo>
+  <MSG_PING>
+    <RECORD>
+      <_MsgName TYPE="STR" NOXFER="TRUE">MSG_PING</_MsgName>
+      <_MsgDescription TYPE="STR" NOXFER="TRUE">ping</_MsgDescription>
+      <_MsgOrder TYPE="UBYT" NOXFER="TRUE">1</_MsgOrder>
+      <Sequence TYPE="UINT"></Sequence>
+      <Payload TYPE="STR"></Payload>
+    </RECORD>
+  </MSG_PING>
+</BenchMessages>
+"""
+
+
+async def _run(clients: int, frames: int, window: int) -> float:
+    server = EchoServer("127.0.0.1", 0)
+    server.message_processor.load_protocol_from_string(PROTOCOL)
+    await server.start()
+
+    port = server.server.sockets[0].getsockname()[1]
+    raw = server.message_processor.prepare_frame(
+        MessageData(1, 1, "MSG_PING", {"Sequence": 1, "Payload": "x" * 64})
+    )
+
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(echo_client(port, raw, frames, window) for _ in range(clients))
+    )
+    elapsed = time.perf_counter() - start
+
+    await server.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--frames", type=int, default=20_000, help="per client")
+    parser.add_argument("--window", type=int, default=64, help="frames in flight")
+    args = parser.parse_args()
+
+    logger.remove()
+
+    loops = {"asyncio": False}
+    if wizmsg.uvloop_available():
+        loops["uvloop"] = True
+    else:
+        print("uvloop isn't installed; only measuring asyncio")
+
+    total = args.clients * args.frames
+    for name, use_uvloop in loops.items():
+        elapsed = wizmsg.run(
+            _run(args.clients, args.frames, args.window), use_uvloop=use_uvloop
+        )
+        print(f"{name:>8}: {total / elapsed:>10,.0f} frames/s ({elapsed:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
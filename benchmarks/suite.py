@@ -0,0 +1,396 @@
+"""
+Benchmarks for the codec, protocol loading and server hot paths
+
+python benchmarks/suite.py --output results.json
+python benchmarks/suite.py --filter frame --quick
+python benchmarks/suite.py --filter capture --capture traffic.wzcap --protocols messages
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable
+
+from loguru import logger
+
+import wizmsg
+from wizmsg import ByteInterface, ByteView, CaptureReader, ProtocolDefinition
+from wizmsg.capture import replay
+from wizmsg.network import FrameDecoder, MessageData, Processor
+
+from echo import EchoServer, echo_client
+
+PROTOCOL = """<?xml version="1.0" ?>
+<BenchMessages>
+  <_ProtocolInfo>
+    <RECORD>
+      <ServiceID TYPE="UBYT">1</ServiceID>
+      <ProtocolType TYPE="STR">BENCH</ProtocolType>
+      <ProtocolVersion TYPE="INT">1</ProtocolVersion>
+      <ProtocolDescription TYPE="STR">benchmark messages</ProtocolDescription>
+    </RECORD>
+  </_ProtocolInfo>
+  <MSG_SMALL>
+    <RECORD>
+      <_MsgName TYPE="STR" NOXFER="TRUE">MSG_SMALL</_MsgName>
+      <_MsgDescription TYPE="STR" NOXFER="TRUE">fixed width fields</_MsgDescription>
+      <_MsgOrder TYPE="UBYT" NOXFER="TRUE">1</_MsgOrder>
+      <GlobalID TYPE="GID"></GlobalID>
+      <ZoneID TYPE="UINT"></ZoneID>
+      <Slot TYPE="UBYT"></Slot>
+      <Flags TYPE="USHRT"></Flags>
+      <X TYPE="FLT"></X>
+      <Y TYPE="FLT"></Y>
+      <Z TYPE="FLT"></Z>
+    </RECORD>
+  </MSG_SMALL>
+  <MSG_STRINGS>
+    <RECORD>
+      <_MsgName TYPE="STR" NOXFER="TRUE">MSG_STRINGS</_MsgName>
+      <_MsgDescription TYPE="STR" NOXFER="TRUE">string heavy</_MsgDescription>
+      <_MsgOrder TYPE="UBYT" NOXFER="TRUE">2</_MsgOrder>
+      <Name TYPE="STR"></Name>
+      <Title TYPE="WSTR"></Title>
+      <Zone TYPE="STR"></Zone>
+      <Chat TYPE="WSTR"></Chat>
+      <Level TYPE="UBYT"></Level>
+    </RECORD>
+  </MSG_STRINGS>
+  <MSG_LARGE>
+    <RECORD>
+      <_MsgName TYPE="STR" NOXFER="TRUE">MSG_LARGE</_MsgName>
+      <_MsgDescription TYPE="STR" NOXFER="TRUE">over LARGE_DATA_MAGIC</_MsgDescription>
+      <_MsgOrder TYPE="UBYT" NOXFER="TRUE">3</_MsgOrder>
+      <GlobalID TYPE="GID"></GlobalID>
+      <Blob TYPE="STR"></Blob>
+    </RECORD>
+  </MSG_LARGE>
+</BenchMessages>
+"""
+
+MESSAGES = {
+    "small": MessageData(
+        1,
+        1,
+        "MSG_SMALL",
+        {
+            "GlobalID": 0x1122334455667788,
+            "ZoneID": 1234,
+            "Slot": 3,
+            "Flags": 0x0102,
+            "X": 1.5,
+            "Y": -2.5,
+            "Z": 100.0,
+        },
+    ),
+    "strings": MessageData(
+        1,
+        2,
+        "MSG_STRINGS",
+        {
+            "Name": "Edgar Allan Poe",
+            "Title": "Grandmaster Conjurer",
+            "Zone": "WizardCity/WC_Ravenwood",
+            "Chat": "hello " * 40,
+            "Level": 150,
+        },
+    ),
+    "large": MessageData(
+        1,
+        3,
+        "MSG_LARGE",
+        {"GlobalID": 1, "Blob": "x" * 40_000},
+    ),
+}
+
+
+class Suite:
+    def __init__(self, *, repeat: int, min_time: float, name_filter: str | None):
+        self.repeat = repeat
+        self.min_time = min_time
+        self.name_filter = name_filter
+        self.results: list[dict] = []
+
+    def wanted(self, name: str) -> bool:
+        return self.name_filter is None or self.name_filter in name
+
+    def bench(self, name: str, func: Callable[[], object]):
+        """
+        Time func, recording seconds per call
+        """
+        if not self.wanted(name):
+            return
+
+        timer = timeit.Timer(func)
+
+        # pick a loop count that runs for about min_time
+        number = 1
+        while (elapsed := timer.timeit(number)) < self.min_time:
+            number *= 10 if elapsed < self.min_time / 10 else 2
+
+        per_call = [timer.timeit(number) / number for _ in range(self.repeat)]
+
+        self.record(
+            name,
+            "seconds_per_call",
+            {
+                "best": min(per_call),
+                "median": statistics.median(per_call),
+                "calls": number,
+            },
+        )
+
+    def record(self, name: str, unit: str, stats: dict):
+        self.results.append({"name": name, "unit": unit, **stats})
+
+        summary = ", ".join(
+            f"{key}={value:.3g}" if isinstance(value, float) else f"{key}={value}"
+            for key, value in stats.items()
+        )
+        print(f"{name:<40} {summary}")
+
+
+def bench_byte_interface(suite: Suite):
+    data = ByteInterface()
+    data.write_unsigned4(0xDEADBEEF)
+    data.write_string(b"Edgar Allan Poe")
+    data.write_wide_string("Grandmaster Conjurer")
+    raw = data.getvalue()
+
+    def _read():
+        interface = ByteInterface(raw)
+        interface.unsigned4()
+        interface.string()
+        interface.wide_string()
+
+    def _read_view():
+        view = ByteView(raw)
+        view.unsigned4()
+        view.string()
+        view.wide_string()
+
+    def _write():
+        interface = ByteInterface()
+        interface.write_unsigned4(0xDEADBEEF)
+        interface.write_string(b"Edgar Allan Poe")
+        interface.write_wide_string("Grandmaster Conjurer")
+
+    suite.bench("byte_interface.read", _read)
+    suite.bench("byte_view.read", _read_view)
+    suite.bench("byte_interface.write", _write)
+
+
+def bench_frames(suite: Suite):
+    processor = Processor()
+    processor.load_protocol_from_string(PROTOCOL)
+
+    for kind, message in MESSAGES.items():
+        raw = processor.prepare_frame(message)
+        buffer = bytearray(len(raw))
+
+        suite.bench(
+            f"process_frame.{kind}", lambda raw=raw: processor.process_frame(raw)
+        )
+        suite.bench(
+            f"process_frame.{kind}.lazy",
+            lambda raw=raw: processor.process_frame(raw, lazy=True),
+        )
+        suite.bench(
+            f"prepare_frame.{kind}",
+            lambda message=message: processor.prepare_frame(message),
+        )
+        suite.bench(
+            f"prepare_frame_into.{kind}",
+            lambda message=message, buffer=buffer: processor.prepare_frame_into(
+                message, buffer
+            ),
+        )
+
+    stream = b"".join(
+        processor.prepare_frame(MESSAGES[kind]) for kind in ("small", "strings") * 500
+    )
+    suite.bench("process_frames.1000", lambda: processor.process_frames(stream))
+
+
+def synthetic_protocol(messages: int, parameters: int) -> str:
+    types = ("UBYT", "USHRT", "UINT", "GID", "FLT", "STR", "WSTR")
+
+    records = []
+    for order in range(1, messages + 1):
+        fields = "\n".join(
+            f'      <Field{index} TYPE="{types[index % len(types)]}"></Field{index}>'
+            for index in range(parameters)
+        )
+        records.append(f"""  <MSG_SYNTHETIC_{order}>
+    <RECORD>
+      <_MsgName TYPE="STR" NOXFER="TRUE">MSG_SYNTHETIC_{order}</_MsgName>
+      <_MsgDescription TYPE="STR" NOXFER="TRUE">synthetic</_MsgDescription>
+{fields}
+    </RECORD>
+  </MSG_SYNTHETIC_{order}>""")
+
+    body = "\n".join(records)
+    return f"""<?xml version="1.0" ?>
+<SyntheticMessages>
+  <_ProtocolInfo>
+    <RECORD>
+      <ServiceID TYPE="UBYT">9</ServiceID>
+      <ProtocolType TYPE="STR">SYNTHETIC</ProtocolType>
+      <ProtocolVersion TYPE="INT">1</ProtocolVersion>
+      <ProtocolDescription TYPE="STR">synthetic messages</ProtocolDescription>
+    </RECORD>
+  </_ProtocolInfo>
+{body}
+</SyntheticMessages>
+"""
+
+
+def bench_protocol_loading(suite: Suite):
+    with tempfile.TemporaryDirectory() as directory:
+        protocol_path = Path(directory) / "SyntheticMessages.xml"
+        # order ids are a single byte
+        protocol_path.write_text(synthetic_protocol(250, 40))
+
+        suite.bench(
+            "from_xml_file.250x40",
+            lambda: ProtocolDefinition.from_xml_file(protocol_path),
+        )
+        suite.bench(
+            "load_protocol.250x40", lambda: Processor().load_protocol(protocol_path)
+        )
+
+        cache = wizmsg.ProtocolCache(Path(directory) / "cache")
+        cache.load(protocol_path)
+        suite.bench("protocol_cache.load.250x40", lambda: cache.load(protocol_path))
+
+
+async def _serve(clients: int, frames: int, window: int) -> tuple[float, list[float]]:
+    server = EchoServer("127.0.0.1", 0)
+    server.message_processor.load_protocol_from_string(PROTOCOL)
+    await server.start()
+
+    port = server.server.sockets[0].getsockname()[1]
+    raw = server.message_processor.prepare_frame(MESSAGES["small"])
+
+    try:
+        start = time.perf_counter()
+        results = await asyncio.gather(
+            *(echo_client(port, raw, frames, window) for _ in range(clients))
+        )
+        elapsed = time.perf_counter() - start
+    finally:
+        await server.close()
+
+    return elapsed, [latency for latencies in results for latency in latencies]
+
+
+def bench_server(suite: Suite, *, clients: int, frames: int, use_uvloop: bool):
+    loop_name = "uvloop" if use_uvloop else "asyncio"
+
+    for window in (1, 32):
+        name = f"server.{loop_name}.c{clients}.w{window}"
+        if not suite.wanted(name):
+            continue
+
+        elapsed, latencies = wizmsg.run(
+            _serve(clients, frames, window), use_uvloop=use_uvloop
+        )
+        percentiles = statistics.quantiles(latencies, n=100)
+
+        suite.record(
+            name,
+            "frames_per_second",
+            {
+                "frames_per_second": len(latencies) / elapsed,
+                "latency_p50": percentiles[49],
+                "latency_p99": percentiles[98],
+                "latency_max": max(latencies),
+            },
+        )
+
+
+def bench_capture(suite: Suite, capture_path: Path, protocol_directory: Path):
+    processor = Processor()
+    processor.load_protocols_from_directory(protocol_directory)
+
+    with CaptureReader(capture_path) as capture:
+        frames = sum(1 for _ in capture)
+
+        def _replay():
+            for _ in replay(capture, processor):
+                pass
+
+        suite.bench(f"capture.replay.{frames}", _replay)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", type=Path, help="write results as json here")
+    parser.add_argument("--filter", help="only run benchmarks containing this")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2)
+    parser.add_argument("--clients", type=int, default=64)
+    parser.add_argument("--frames", type=int, default=1000, help="per client")
+    parser.add_argument(
+        "--quick", action="store_true", help="fewer repeats and server frames"
+    )
+    parser.add_argument("--capture", type=Path, help="also time replaying this")
+    parser.add_argument(
+        "--protocols", type=Path, help="protocol directory for --capture"
+    )
+    args = parser.parse_args()
+
+    if args.quick:
+        args.repeat = 2
+        args.min_time = 0.05
+        args.frames = 100
+
+    # benchmark the codec, not the log sink
+    logger.remove()
+
+    suite = Suite(repeat=args.repeat, min_time=args.min_time, name_filter=args.filter)
+
+    bench_byte_interface(suite)
+    bench_frames(suite)
+    bench_protocol_loading(suite)
+
+    if args.capture is not None:
+        if args.protocols is None:
+            parser.error("--capture needs --protocols")
+
+        bench_capture(suite, args.capture, args.protocols)
+
+    loops = [False] + ([True] if wizmsg.uvloop_available() else [])
+    for use_uvloop in loops:
+        bench_server(
+            suite, clients=args.clients, frames=args.frames, use_uvloop=use_uvloop
+        )
+
+    if args.output is not None:
+        args.output.write_text(
+            json.dumps(
+                {
+                    "wizmsg": wizmsg.__version__,
+                    "python": sys.version,
+                    "implementation": platform.python_implementation(),
+                    "platform": platform.platform(),
+                    "machine": platform.machine(),
+                    "timestamp": datetime.now(timezone.utc).isoformat(),
+                    "results": suite.results,
+                },
+                indent=2,
+            )
+        )
+        print(f"wrote {len(suite.results)} results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
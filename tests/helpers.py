@@ -0,0 +1,136 @@
+"""
+Protocols, messages and a loopback server shared by the tests
+"""
+
+import asyncio
+
+from wizmsg import Server
+from wizmsg.network import FrameDecoder, MessageData, Processor
+
+TEST_PROTOCOL = """<?xml version="1.0" ?>
+<TestProtocol>
+  <_ProtocolInfo>
+    <RECORD>
+      <ServiceID TYPE="UBYT">1</ServiceID>
+      <ProtocolType TYPE="STR">TEST</ProtocolType>
+      <ProtocolVersion TYPE="INT">1</ProtocolVersion>
+      <ProtocolDescription TYPE="STR">Testing wizmsg</ProtocolDescription>
+    </RECORD>
+  </_ProtocolInfo>
+
+  <MSG_PERSON>
+    <RECORD>
+      <_MsgName TYPE="STR" NOXFER="TRUE">MSG_PERSON</_MsgName>
+      <_MsgDescription TYPE="STR" NOXFER="TRUE">:dead:</_MsgDescription>
+      <_MsgHandler TYPE="STR" NOXFER="TRUE">crate::person_handler</_MsgHandler>
+      <Name TYPE="STR"></Name>
+      <Age TYPE="UBYT"></Age>
+    </RECORD>
+  </MSG_PERSON>
+</TestProtocol>
+"""
+
+
+MIXED_PROTOCOL = """<?xml version="1.0" ?>
+<MixedProtocol>
+  <_ProtocolInfo>
+    <RECORD>
+      <ServiceID TYPE="UBYT">2</ServiceID>
+      <ProtocolType TYPE="STR">MIXED</ProtocolType>
+      <ProtocolVersion TYPE="INT">1</ProtocolVersion>
+      <ProtocolDescription TYPE="STR">Every parameter type</ProtocolDescription>
+    </RECORD>
+  </_ProtocolInfo>
+
+  <MSG_EVERYTHING>
+    <RECORD>
+      <_MsgName TYPE="STR" NOXFER="TRUE">MSG_EVERYTHING</_MsgName>
+      <_MsgDescription TYPE="STR" NOXFER="TRUE">all of them</_MsgDescription>
+      <GlobalID TYPE="GID"></GlobalID>
+      <Small TYPE="BYT"></Small>
+      <Short TYPE="SHRT"></Short>
+      <Zone TYPE="STR"></Zone>
+      <Count TYPE="UINT"></Count>
+      <Speed TYPE="FLT"></Speed>
+      <Chat TYPE="WSTR"></Chat>
+      <Ratio TYPE="DBL"></Ratio>
+      <Flag TYPE="UBYT"></Flag>
+    </RECORD>
+  </MSG_EVERYTHING>
+</MixedProtocol>
+"""
+
+MIXED_MESSAGE = MessageData(
+    2,
+    1,
+    "MSG_EVERYTHING",
+    {
+        "GlobalID": 0xFFFF_FFFF_FFFF_FFFF,
+        "Small": -5,
+        "Short": -300,
+        "Zone": "WizardCity/WC_Hub",
+        "Count": 70000,
+        "Speed": 1.5,
+        "Chat": "hello ✨",
+        "Ratio": 0.25,
+        "Flag": 255,
+    },
+)
+
+
+def make_processor() -> Processor:
+    """
+    A Processor with TEST_PROTOCOL loaded
+    """
+    processor = Processor()
+    processor.load_protocol_from_string(TEST_PROTOCOL)
+    return processor
+
+
+PERSON = MessageData(1, 1, "MSG_PERSON", {"Name": "Edgar Allan Poe", "Age": 40})
+
+
+class EchoServer(Server):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.message_processor.load_protocol_from_string(TEST_PROTOCOL)
+
+    def handle_message(self, session, message):
+        session.send(message)
+
+
+class RawClient:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.processor = make_processor()
+        self.decoder = FrameDecoder()
+        self.frames = []
+
+    @classmethod
+    async def connect(cls, server: Server) -> "RawClient":
+        port = server.server.sockets[0].getsockname()[1]
+        return cls(*await asyncio.open_connection("127.0.0.1", port))
+
+    def send(self, frame):
+        self.writer.write(self.processor.prepare_frame(frame))
+
+    async def receive(self):
+        while not self.frames:
+            data = await self.reader.read(4096)
+            assert data, "connection closed"
+            self.frames += self.decoder.feed(data)
+
+        return self.processor.process_frame(self.frames.pop(0))
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+async def wait_until(predicate, timeout: float = 2):
+    async def _wait():
+        while not predicate():
+            await asyncio.sleep(0.01)
+
+    await asyncio.wait_for(_wait(), timeout)
@@ -1,7 +1,10 @@
+import struct
+
+import pytest
 from hypothesis import given
-from hypothesis.strategies import booleans, floats, integers
+from hypothesis.strategies import booleans, floats, integers, text
 
-from wizmsg import ByteInterface
+from wizmsg import ByteInterface, ByteView
 
 
 @given(booleans())
@@ -113,3 +116,43 @@ def test_signed8(test_value):
     interface.seek(0)
 
     assert interface.signed8() == test_value
+
+
+@given(text())
+def test_wide_string(test_value):
+    interface = ByteInterface()
+
+    interface.write_wide_string(test_value)
+    interface.seek(0)
+
+    assert interface.wide_string() == test_value
+
+
+@given(integers(0, 0xFFFF), integers(-0x7FFFFFFF - 1, 0x7FFFFFFF), text())
+def test_byte_view(unsigned2, signed4, string):
+    interface = ByteInterface()
+
+    interface.write_unsigned2(unsigned2)
+    interface.write_signed4(signed4)
+    interface.write_string(string.encode())
+
+    view = ByteView(interface.getbuffer())
+
+    assert view.unsigned2() == unsigned2
+    assert view.signed4() == signed4
+    assert bytes(view.string()) == string.encode()
+    assert view.remaining() == 0
+
+
+def test_byte_view_truncated():
+    view = ByteView(b"\x01\x02\x03")
+    view.unsigned2()
+
+    with pytest.raises(ValueError, match="2 bytes at offset 2 with only 1 left"):
+        view.unsigned2()
+
+    with pytest.raises(ValueError, match="at offset 2"):
+        view.read_struct(struct.Struct("<I"))
+
+    # a failed read doesn't move the cursor
+    assert view.unsigned1() == 3
@@ -0,0 +1,159 @@
+import asyncio
+import multiprocessing
+
+import pytest
+
+from tests.helpers import (
+    PERSON,
+    EchoServer,
+    RawClient,
+    make_processor,
+    wait_until,
+)
+from wizmsg import CaptureReader, CaptureWriter
+from wizmsg.capture import INVALID, RECEIVED, SENT, replay, replay_to_server
+from wizmsg.network.controls import SessionOffer
+
+
+def test_capture_round_trip(tmp_path):
+    path = tmp_path / "traffic.wzcap"
+    raw = make_processor().prepare_frame(PERSON)
+
+    with CaptureWriter(path) as capture:
+        capture.write(raw, session_id=1, direction=RECEIVED, timestamp=10.0)
+
+    # reopening appends
+    with CaptureWriter(path) as capture:
+        capture.write(raw, session_id=2, direction=SENT, timestamp=11.0)
+
+    with CaptureReader(path) as capture:
+        frames = [
+            (captured.timestamp, captured.session_id, captured.direction)
+            for captured in capture
+        ]
+        assert frames == [(10.0, 1, RECEIVED), (11.0, 2, SENT)]
+
+        assert list(replay(capture, make_processor())) == [PERSON]
+        assert list(replay(capture, make_processor(), direction=SENT)) == [PERSON]
+
+        lazy = list(replay(capture, make_processor(), lazy=True))
+
+    # closing the capture doesn't invalidate lazy messages
+    assert lazy == [PERSON]
+
+    # a record cut off mid write is skipped
+    path.write_bytes(path.read_bytes()[:-3])
+    with CaptureReader(path) as capture:
+        assert len(list(capture)) == 1
+
+    (tmp_path / "empty").write_bytes(b"")
+    with pytest.raises(ValueError):
+        CaptureReader(tmp_path / "empty")
+
+
+def test_capture_server(tmp_path):
+    path = tmp_path / "traffic.wzcap"
+
+    async def _record():
+        with CaptureWriter(path) as capture:
+            server = EchoServer("127.0.0.1", 0, capture=capture)
+            await server.start()
+
+            client = await RawClient.connect(server)
+            await client.receive()
+
+            for _ in range(3):
+                client.send(PERSON)
+                assert await client.receive() == PERSON
+
+            await client.close()
+            await server.close()
+
+    asyncio.run(_record())
+
+    with CaptureReader(path) as capture:
+        directions = [captured.direction for captured in capture]
+        assert directions == [SENT] + [RECEIVED, SENT] * 3
+
+        offer = next(replay(capture, make_processor(), direction=SENT))
+        assert isinstance(offer, SessionOffer)
+
+    class CountingServer(EchoServer):
+        received = 0
+
+        def handle_message(self, session, message):
+            assert message == PERSON
+            self.received += 1
+
+    async def _replay():
+        server = CountingServer("127.0.0.1", 0)
+        await server.start()
+        port = server.server.sockets[0].getsockname()[1]
+
+        with CaptureReader(path) as capture:
+            sent = await replay_to_server(capture, "127.0.0.1", port, speed=100)
+
+        assert sent == 3
+        await wait_until(lambda: server.received == 3)
+        await server.close()
+
+    asyncio.run(_replay())
+
+
+def _write_records(capture: CaptureWriter, worker: int):
+    for size in range(1, 200):
+        capture.write(bytes([worker]) * size * 50, session_id=worker, direction=SENT)
+
+
+@pytest.mark.skipif(
+    "fork" not in multiprocessing.get_all_start_methods(), reason="fork not supported"
+)
+def test_capture_shared_by_forked_workers(tmp_path):
+    path = tmp_path / "traffic.wzcap"
+    context = multiprocessing.get_context("fork")
+
+    with CaptureWriter(path) as capture:
+        workers = [
+            context.Process(target=_write_records, args=(capture, worker))
+            for worker in range(4)
+        ]
+        for worker in workers:
+            worker.start()
+
+        for worker in workers:
+            worker.join()
+            assert worker.exitcode == 0
+
+    with CaptureReader(path) as capture:
+        records = 0
+        for captured in capture:
+            # interleaved records would mix bytes from different workers
+            assert captured.raw == bytes([captured.session_id]) * len(captured.raw)
+            captured.raw.release()
+            records += 1
+
+    assert records == 4 * 199
+
+
+def test_capture_invalid_data(tmp_path):
+    path = tmp_path / "traffic.wzcap"
+
+    async def _record():
+        with CaptureWriter(path) as capture:
+            server = EchoServer("127.0.0.1", 0, capture=capture)
+            await server.start()
+
+            client = await RawClient.connect(server)
+            await client.receive()
+
+            client.writer.write(b"not a frame")
+            assert await client.reader.read() == b""
+
+            await client.close()
+            await server.close()
+
+    asyncio.run(_record())
+
+    with CaptureReader(path) as capture:
+        captured = [(frame.direction, bytes(frame.raw)) for frame in capture]
+        assert captured[-1] == (INVALID, b"not a frame")
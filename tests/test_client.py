@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+
+from tests.helpers import PERSON, EchoServer, make_processor, wait_until
+from wizmsg import Client, ClientPool, Metrics
+from wizmsg.network.controls import SessionAccept
+
+
+class AcceptRecordingServer(EchoServer):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.accepts = []
+
+    def handle_control(self, session, control):
+        if isinstance(control, SessionAccept):
+            self.accepts.append(control)
+
+
+def test_client():
+    async def _test():
+        server = AcceptRecordingServer(
+            "127.0.0.1", 0, heartbeat_interval=0.05, heartbeat_timeout=0.05
+        )
+        await server.start()
+        port = server.server.sockets[0].getsockname()[1]
+
+        client = await Client.connect("127.0.0.1", port, processor=make_processor())
+        assert list(server.sessions) == [client.session_id]
+
+        await wait_until(lambda: server.accepts)
+        assert server.accepts[0].session_id == client.session_id
+
+        client.send(PERSON)
+        assert await client.receive(timeout=2) == PERSON
+
+        # keep alives are answered so the session outlives several timeouts
+        await asyncio.sleep(0.3)
+        assert client.alive
+        assert list(server.sessions) == [client.session_id]
+
+        client.close()
+        await client.wait_closed()
+        await wait_until(lambda: not server.sessions)
+
+        with pytest.raises(ConnectionError):
+            await client.receive()
+
+        await server.close()
+
+    asyncio.run(_test())
+
+
+def test_client_server_closes():
+    async def _test():
+        server = EchoServer("127.0.0.1", 0)
+        await server.start()
+        port = server.server.sockets[0].getsockname()[1]
+
+        client = await Client.connect(
+            "127.0.0.1", port, processor=make_processor(), message_records=True
+        )
+        client.send(PERSON)
+        record = await client.receive(timeout=2)
+        assert record._message_data() == PERSON
+
+        receiving = asyncio.ensure_future(client.receive())
+        await asyncio.sleep(0)
+        await server.close()
+
+        with pytest.raises(ConnectionError):
+            await receiving
+
+    asyncio.run(_test())
+
+
+def test_client_pool():
+    async def _test():
+        server = EchoServer("127.0.0.1", 0)
+        await server.start()
+        port = server.server.sockets[0].getsockname()[1]
+
+        processor = make_processor()
+        processor.metrics = Metrics()
+
+        async with ClientPool(
+            "127.0.0.1", port, processor=processor, connect_concurrency=10
+        ) as pool:
+            await pool.connect(50)
+            assert len(pool) == 50
+            assert len(server.sessions) == 50
+            assert len({client.session_id for client in pool}) == 50
+
+            assert pool.broadcast(PERSON) == 50
+            assert processor.metrics.frames_sent[1, "MSG_PERSON"] == 50
+            for client in pool:
+                assert await client.receive(timeout=2) == PERSON
+
+        await wait_until(lambda: not server.sessions)
+        await server.close()
+
+    asyncio.run(_test())
+
+
+def test_client_pool_connect_failure():
+    async def _test():
+        server = EchoServer("127.0.0.1", 0)
+        await server.start()
+        port = server.server.sockets[0].getsockname()[1]
+        await server.close()
+
+        pool = ClientPool("127.0.0.1", port, processor=make_processor())
+        with pytest.raises(OSError):
+            await pool.connect(3)
+
+        assert len(pool) == 0
+
+    asyncio.run(_test())
@@ -0,0 +1,70 @@
+import pytest
+
+from tests.helpers import MIXED_MESSAGE, MIXED_PROTOCOL, PERSON, TEST_PROTOCOL
+from wizmsg import CaptureWriter
+from wizmsg.capture import RECEIVED, SENT
+from wizmsg.columnar import column_format, decode_capture, read_table
+from wizmsg.network import MessageData, Processor
+from wizmsg.network.controls import KeepAlive
+
+
+def test_column_format():
+    assert column_format("GID") == "Q"
+    assert column_format("WSTR") == "string"
+
+    with pytest.raises(ValueError):
+        column_format("NOPE")
+
+
+@pytest.mark.parametrize("workers", [None, 2])
+def test_decode_capture(tmp_path, workers):
+    processor = Processor()
+    processor.load_protocol_from_string(TEST_PROTOCOL)
+    processor.load_protocol_from_string(MIXED_PROTOCOL)
+
+    people = [
+        MessageData(1, 1, "MSG_PERSON", {"Name": f"person {index}", "Age": index})
+        for index in range(50)
+    ]
+
+    capture_path = tmp_path / "traffic.wzcap"
+    with CaptureWriter(capture_path) as capture:
+        for index, person in enumerate(people):
+            capture.write(
+                processor.prepare_frame(person),
+                session_id=index % 3,
+                direction=RECEIVED,
+                timestamp=float(index),
+            )
+            capture.write(
+                processor.prepare_frame(MIXED_MESSAGE), session_id=1, direction=RECEIVED
+            )
+
+        # skipped: wrong direction, control, undecodable
+        capture.write(processor.prepare_frame(PERSON), session_id=1, direction=SENT)
+        capture.write(
+            processor.prepare_frame(
+                KeepAlive(session_id=1, milliseconds=0, session_minutes=0, opcode=3)
+            ),
+            session_id=1,
+            direction=RECEIVED,
+        )
+        capture.write(b"\x0d\xf0\x00", session_id=1, direction=RECEIVED)
+
+    output = tmp_path / "tables"
+    summary = decode_capture(
+        capture_path, processor, output, workers=workers, chunk_size=512
+    )
+
+    assert summary.tables == {"1-MSG_PERSON": 50, "2-MSG_EVERYTHING": 50}
+    assert summary.errors == 1
+
+    people_table = read_table(output / "1-MSG_PERSON")
+    assert people_table["Name"] == [person.parameters["Name"] for person in people]
+    assert list(people_table["Age"]) == list(range(50))
+    assert list(people_table["_session_id"]) == [index % 3 for index in range(50)]
+    assert list(people_table["_timestamp"]) == [float(index) for index in range(50)]
+
+    mixed_table = read_table(output / "2-MSG_EVERYTHING")
+    for name, value in MIXED_MESSAGE.parameters.items():
+        assert list(mixed_table[name]) == [value] * 50
@@ -0,0 +1,76 @@
+import pytest
+from hypothesis import given
+from hypothesis.strategies import binary, integers, lists
+
+from wizmsg import DATA_START_MAGIC, LARGE_DATA_MAGIC, ByteInterface
+from wizmsg.network import FrameDecoder, frame_length
+
+
+def make_frame(body: bytes) -> bytes:
+    buffer = ByteInterface()
+    buffer.write_unsigned2(DATA_START_MAGIC)
+
+    size = len(body) + 4
+    if size >= LARGE_DATA_MAGIC:
+        buffer.write_unsigned2(LARGE_DATA_MAGIC)
+        buffer.write_unsigned4(size)
+    else:
+        buffer.write_unsigned2(size)
+
+    buffer.write(b"\x00" * 4)
+    buffer.write(body)
+    return buffer.getvalue()
+
+
+def test_frame_length():
+    frame = make_frame(b"abc")
+
+    assert frame_length(frame) == len(frame)
+    assert frame_length(frame[:3]) is None
+
+
+def test_large_frame_length():
+    frame = make_frame(b"\x01" * LARGE_DATA_MAGIC)
+
+    assert frame_length(frame) == len(frame)
+    assert frame_length(frame[:6]) is None
+
+
+def test_magic_mismatch():
+    with pytest.raises(ValueError):
+        FrameDecoder().feed(b"\x00\x00\x05\x00")
+
+
+@given(lists(binary(max_size=64), max_size=8), lists(integers(1, 32), min_size=1))
+def test_decoder_chunking(bodies, chunk_sizes):
+    frames = [make_frame(body) for body in bodies]
+    stream = b"".join(frames)
+
+    decoder = FrameDecoder()
+    decoded = []
+
+    offset = 0
+    chunk_index = 0
+    while offset < len(stream):
+        chunk_size = chunk_sizes[chunk_index % len(chunk_sizes)]
+        decoded += decoder.feed(stream[offset : offset + chunk_size])
+        offset += chunk_size
+        chunk_index += 1
+
+    assert decoded == frames
+    assert decoder.buffered == 0
+
+
+def test_decoder_large_frame():
+    frame = make_frame(b"\x01" * LARGE_DATA_MAGIC)
+    decoder = FrameDecoder()
+
+    assert decoder.feed(frame[:7]) == []
+    assert decoder.feed(frame[7:] + frame) == [frame, frame]
+
+
+def test_decoder_max_frame_size():
+    decoder = FrameDecoder(max_frame_size=16)
+
+    with pytest.raises(ValueError):
+        decoder.feed(make_frame(b"\x00" * 32))
@@ -0,0 +1,117 @@
+import asyncio
+
+import pytest
+
+from tests.helpers import (
+    MIXED_MESSAGE,
+    MIXED_PROTOCOL,
+    PERSON,
+    TEST_PROTOCOL,
+    RawClient,
+    wait_until,
+)
+from wizmsg import Server
+from wizmsg.network import HandlerRegistry, Processor, dispatch_key
+
+
+def test_registry_resolution():
+    processor = Processor()
+    handlers = processor.handlers
+
+    @handlers.on_msg_handler("crate::person_handler")
+    def by_msg_handler(session, message):
+        pass
+
+    # registered before the protocol is loaded
+    assert handlers.table == {}
+
+    processor.load_protocol_from_string(TEST_PROTOCOL)
+    assert handlers.table == {dispatch_key(1, 1): by_msg_handler}
+    assert handlers.lookup(PERSON) is by_msg_handler
+
+    # names win over _MsgHandler, and a service's own over any service's
+    @handlers.on("MSG_PERSON")
+    def by_name(session, message):
+        pass
+
+    assert handlers.get(1, 1) is by_name
+
+    @handlers.on("MSG_PERSON", service_id=1)
+    def by_service(session, message):
+        pass
+
+    handlers.add(by_name, name="MSG_PERSON", service_id=2)
+    assert handlers.get(1, 1) is by_service
+
+    assert handlers.lookup(MIXED_MESSAGE) is None
+    processor.load_protocol_from_string(MIXED_PROTOCOL)
+    assert handlers.lookup(MIXED_MESSAGE) is None
+
+    # records are looked up by their class's ids
+    assert (
+        handlers.lookup(
+            processor.process_frame(processor.prepare_frame(PERSON), as_record=True)
+        )
+        is by_service
+    )
+
+
+def test_registry_indexed_protocols(tmp_path):
+    (tmp_path / "TestMessages.xml").write_text(TEST_PROTOCOL)
+
+    processor = Processor()
+    processor.index_protocols_from_directory(tmp_path)
+    processor.handlers.add(print, name="MSG_PERSON")
+
+    assert processor.handlers.table == {}
+    processor.get_protocol(1)
+    assert processor.handlers.get(1, 1) is print
+
+
+def test_registry_add_arguments():
+    handlers = HandlerRegistry()
+
+    with pytest.raises(ValueError):
+        handlers.add(print)
+
+    with pytest.raises(ValueError):
+        handlers.add(print, name="MSG_PERSON", msg_handler="crate::person_handler")
+
+    with pytest.raises(ValueError):
+        handlers.add(print, msg_handler="crate::person_handler", service_id=1)
+
+
+def test_server_dispatch():
+    async def _test():
+        server = Server("127.0.0.1", 0)
+        server.message_processor.load_protocol_from_string(TEST_PROTOCOL)
+
+        handled = []
+
+        @server.handlers.on("MSG_PERSON")
+        async def person(session, message):
+            await asyncio.sleep(0)
+            handled.append(message)
+            session.send(message)
+
+            if len(handled) == 2:
+                raise RuntimeError("logged, not fatal")
+
+        await server.start()
+
+        client = await RawClient.connect(server)
+        await client.receive()
+
+        client.send(PERSON)
+        assert await client.receive() == PERSON
+
+        client.send(PERSON)
+        assert await client.receive() == PERSON
+        await wait_until(lambda: not server._handler_tasks)
+
+        await client.close()
+        await server.close()
+
+        assert handled == [PERSON, PERSON]
+
+    asyncio.run(_test())
@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+from tests.helpers import PERSON, TEST_PROTOCOL, EchoServer, make_processor
+from wizmsg.loadgen import build_message, message_mix, run_load
+
+
+def test_message_mix():
+    processor = make_processor()
+
+    ((message, weight),) = message_mix(processor, string_size=4)
+    assert weight == 1.0
+    assert message.name == PERSON.name
+    assert message.parameters == {"Name": "xxxx", "Age": 1}
+    # built messages encode
+    processor.prepare_frame(message)
+
+    ((message, weight),) = message_mix(processor, ["MSG_PERSON=2.5"])
+    assert weight == 2.5
+
+    with pytest.raises(ValueError):
+        message_mix(processor, ["MSG_MISSING"])
+
+
+def test_message_mix_same_name():
+    processor = make_processor()
+    processor.load_protocol_from_string(
+        TEST_PROTOCOL.replace(">1</ServiceID>", ">3</ServiceID>")
+    )
+
+    mix = message_mix(processor)
+    assert [(message.service_id, message.name) for message, _ in mix] == [
+        (1, "MSG_PERSON"),
+        (3, "MSG_PERSON"),
+    ]
+
+    with pytest.raises(ValueError, match="Services 1, 3 all define MSG_PERSON"):
+        message_mix(processor, ["MSG_PERSON"])
+
+    ((message, weight),) = message_mix(processor, ["3:MSG_PERSON=2"])
+    assert (message.service_id, weight) == (3, 2.0)
+
+
+@pytest.mark.parametrize("rate", [None, 2000])
+def test_run_load(rate):
+    async def _test():
+        server = EchoServer("127.0.0.1", 0)
+        server.message_processor.load_protocol_from_string(TEST_PROTOCOL)
+        await server.start()
+        port = server.server.sockets[0].getsockname()[1]
+
+        processor = make_processor()
+        mix = [(build_message(1, processor.get_protocol(1).messages[1].definition), 1)]
+
+        try:
+            report = await run_load(
+                "127.0.0.1", port, processor, mix, clients=4, duration=0.3, rate=rate
+            )
+        finally:
+            await server.close()
+
+        assert report.clients == 4
+        assert report.sent > 0
+        # every frame is echoed and the drain waits for them
+        assert report.received == report.sent
+        # plus the session offers
+        assert report.bytes_received > report.bytes_sent
+
+        stats = report.messages[1, "MSG_PERSON"]
+        assert len(stats.latencies) == stats.sent
+        assert 0 < stats.percentile(0.5) <= stats.percentile(0.999)
+
+        summary = report.summary()
+        (message,) = summary["messages"]
+        assert (message["service_id"], message["message"]) == (1, "MSG_PERSON")
+        assert message["latency_p99"] is not None
+        if rate is not None:
+            # within a tick of the target
+            assert summary["frames_per_second"] == pytest.approx(rate, rel=0.2)
+
+    asyncio.run(_test())
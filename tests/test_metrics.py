@@ -0,0 +1,134 @@
+import asyncio
+
+import pytest
+
+from tests.helpers import PERSON, TEST_PROTOCOL, EchoServer, RawClient
+from wizmsg import Metrics
+from wizmsg.metrics import Histogram
+from wizmsg.network import MessageData, Processor
+from wizmsg.network.controls import KeepAlive
+
+KEEP_ALIVE = KeepAlive(session_id=1, milliseconds=2, session_minutes=3, opcode=3)
+
+
+def test_histogram():
+    histogram = Histogram((1.0, 2.0))
+    for value in (0.5, 1.0, 1.5, 3.0):
+        histogram.observe(value)
+
+    assert histogram.count == 4
+    assert histogram.sum == 6.0
+    assert histogram.cumulative() == [(1.0, 2), (2.0, 3), (float("inf"), 4)]
+
+
+def test_processor_metrics():
+    metrics = Metrics()
+    processor = Processor(metrics=metrics)
+    processor.load_protocol_from_string(TEST_PROTOCOL)
+
+    raw = processor.prepare_frame(PERSON)
+    control = processor.prepare_frame(KEEP_ALIVE)
+
+    processor.process_frame(raw)
+    processor.process_frame(control)
+    frames, _ = processor.process_frames(raw + raw + control)
+    assert len(frames) == 3
+
+    key = (1, "MSG_PERSON")
+    assert metrics.frames_sent[key] == 1
+    assert metrics.bytes_sent[key] == len(raw)
+    assert metrics.controls_sent[3] == 1
+
+    assert metrics.frames_received[key] == 3
+    assert metrics.bytes_received[key] == 3 * len(raw)
+    assert metrics.controls_received[3] == 2
+    assert metrics.decode_seconds[key].count == 3
+    assert metrics.encode_seconds[key].count == 1
+
+    with pytest.raises(ValueError):
+        processor.process_frame(raw.replace(b"\x01\x01", b"\x07\x01", 1))
+
+    with pytest.raises(RuntimeError):
+        processor.prepare_frame(MessageData(1, 9, "MSG_MISSING", {}))
+
+    assert metrics.errors == {("decode", "ValeError"): 1, ("encode", "RuntimeError"): 1}
+
+    snapshot = metrics.snapshot()
+    assert snapshot["frames_received"] == [
+        {"service_id": 1, "message": "MSG_PERSON", "value": 3}
+    ]
+
+    metrics.reset()
+    assert metrics.snapshot()["frames_received"] == []
+
+
+def test_prometheus():
+    metrics = Metrics(latency_buckets=(0.001,))
+    metrics.message_received(1, 'MSG_"QUOTED"', 10, 0.0005)
+    metrics.control_received(3)
+    metrics.gauge("wizmsg_sessions", lambda: 2)
+
+    text = metrics.to_prometheus()
+
+    assert (
+        'wizmsg_frames_received_total{service_id="1",message="MSG_\\"QUOTED\\""} 1'
+        in text
+    )
+    assert 'wizmsg_controls_received_total{opcode="3"} 1' in text
+    assert (
+        'wizmsg_decode_seconds_bucket{service_id="1",message="MSG_\\"QUOTED\\"",le="+Inf"} 1'
+        in text
+    )
+    assert "wizmsg_sessions 2" in text
+
+
+def test_serve_metrics():
+    async def _test():
+        server = EchoServer("127.0.0.1", 0, metrics=Metrics())
+        await server.start()
+        await server.serve_metrics(port=0)
+
+        client = await RawClient.connect(server)
+        await client.receive()
+        client.send(PERSON)
+        assert await client.receive() == PERSON
+
+        port = server.metrics_server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        response = (await reader.read()).decode()
+        writer.close()
+
+        assert response.startswith("HTTP/1.1 200 OK")
+        assert (
+            'wizmsg_frames_received_total{service_id="1",message="MSG_PERSON"} 1'
+            in response
+        )
+        assert "wizmsg_sessions 1" in response
+
+        await client.close()
+        await server.close()
+
+    asyncio.run(_test())
+
+
+def test_framing_errors_counted():
+    async def _test():
+        metrics = Metrics()
+        server = EchoServer("127.0.0.1", 0, metrics=metrics, max_frame_size=64)
+        await server.start()
+
+        for data in (b"not a frame", b"\x0d\xf0\xff\x00"):
+            client = await RawClient.connect(server)
+            await client.receive()
+
+            # bad magic, then a frame over max_frame_size
+            client.writer.write(data)
+            assert await client.reader.read() == b""
+            await client.close()
+
+        await server.close()
+
+        assert metrics.errors == {("decode", "ValueError"): 2}
+
+    asyncio.run(_test())
@@ -0,0 +1,260 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pytest
+
+from tests.helpers import (
+    MIXED_MESSAGE,
+    MIXED_PROTOCOL,
+    TEST_PROTOCOL,
+    RawClient,
+    wait_until,
+)
+from wizmsg import Metrics, Server
+from wizmsg.network import MessageData, Processor, TraceHook
+from wizmsg.network.controls import KeepAlive, KeepAliveResponse
+
+
+def _slow_echo(message):
+    # later messages finish first unless replies are kept in order
+    time.sleep((10 - message.parameters["Age"]) * 0.005)
+    return message
+
+
+def _slow_echo_record(record):
+    time.sleep((4 - record.Age) * 0.005)
+    return record
+
+
+def _person(age: int) -> MessageData:
+    return MessageData(1, 1, "MSG_PERSON", {"Name": "Poe", "Age": age})
+
+
+async def _exchange(server: Server, count: int = 10) -> list:
+    server.message_processor.load_protocol_from_string(TEST_PROTOCOL)
+    await server.start()
+
+    client = await RawClient.connect(server)
+    await client.receive()
+
+    for age in range(count):
+        client.send(_person(age))
+
+    replies = [await asyncio.wait_for(client.receive(), 5) for _ in range(count)]
+
+    await client.close()
+    await server.close()
+
+    return replies
+
+
+@pytest.mark.parametrize("max_in_flight", [64, 2])
+def test_offloaded_handlers_keep_order(max_in_flight):
+    async def _test():
+        with ThreadPoolExecutor(4) as executor:
+            server = Server(
+                "127.0.0.1", 0, executor=executor, max_in_flight=max_in_flight
+            )
+            server.handlers.add(_slow_echo, name="MSG_PERSON", offload=True)
+
+            assert await _exchange(server) == [_person(age) for age in range(10)]
+
+    asyncio.run(_test())
+
+
+def test_inline_handlers_wait_for_offloaded():
+    async def _test():
+        server = Server("127.0.0.1", 0)
+
+        @server.handlers.on("MSG_PERSON")
+        def person(session, message):
+            # only the first is offloaded; the rest queue behind it
+            if message.parameters["Age"] == 0:
+                session.offload(_slow_echo, message)
+            else:
+                session.send(message)
+
+        assert await _exchange(server) == [_person(age) for age in range(10)]
+
+    asyncio.run(_test())
+
+
+def test_offloaded_decode():
+    async def _test():
+        server = Server("127.0.0.1", 0, offload_frame_size=0)
+        server.handlers.add(
+            lambda session, message: session.send(message), name="MSG_PERSON"
+        )
+
+        assert await _exchange(server) == [_person(age) for age in range(10)]
+
+    asyncio.run(_test())
+
+
+def test_process_pool():
+    async def _test():
+        server = Server("127.0.0.1", 0, offload_frame_size=0, message_records=True)
+        server.message_processor.load_protocol_from_string(TEST_PROTOCOL)
+        server.handlers.add(_slow_echo_record, name="MSG_PERSON", offload=True)
+
+        with server.process_pool(2) as executor:
+            server.executor = executor
+            assert await _exchange(server, 4) == [_person(age) for age in range(4)]
+
+    asyncio.run(_test())
+
+
+def test_foreign_process_pool():
+    with ProcessPoolExecutor(1) as executor:
+        with pytest.raises(ValueError, match="Server.process_pool"):
+            Server("127.0.0.1", 0, executor=executor, offload_frame_size=0)
+
+        # only decoding needs the protocols
+        Server("127.0.0.1", 0, executor=executor)
+
+        server = Server("127.0.0.1", 0, offload_frame_size=0)
+        server.executor = executor
+        with pytest.raises(ValueError, match="Server.process_pool"):
+            server.decode_in_executor(b"")
+
+
+def test_concurrent_indexed_loads(tmp_path):
+    (tmp_path / "MixedMessages.xml").write_text(MIXED_PROTOCOL)
+
+    processor = Processor()
+    processor.load_protocol_from_string(MIXED_PROTOCOL)
+    raw = processor.prepare_frame(MIXED_MESSAGE)
+
+    processor = Processor()
+    processor.index_protocols_from_directory(tmp_path)
+
+    barrier = threading.Barrier(8)
+
+    def _decode():
+        barrier.wait()
+        return [processor.decode_frame(raw)[0] for _ in range(5)]
+
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(lambda _: _decode(), range(8)))
+
+    assert results == [[MIXED_MESSAGE] * 5] * 8
+
+
+class ThreadRecordingHook(TraceHook):
+    def __init__(self):
+        self.threads = set()
+
+    def frame_received(self, raw, frame):
+        self.threads.add(threading.get_ident())
+
+
+def test_thread_pool_decodes_observed_on_loop(tmp_path):
+    (tmp_path / "TestMessages.xml").write_text(TEST_PROTOCOL)
+
+    async def _test():
+        metrics = Metrics()
+        hook = ThreadRecordingHook()
+
+        with ThreadPoolExecutor(8) as executor:
+            server = Server(
+                "127.0.0.1",
+                0,
+                executor=executor,
+                offload_frame_size=0,
+                metrics=metrics,
+            )
+            # loaded by whichever decode gets there first
+            server.message_processor.index_protocols_from_directory(tmp_path)
+            server.message_processor.add_trace_hook(hook)
+            server.handlers.add(
+                lambda session, message: session.send(message), name="MSG_PERSON"
+            )
+            await server.start()
+
+            client = await RawClient.connect(server)
+            await client.receive()
+
+            # one write so every decode is submitted at once
+            client.writer.write(
+                b"".join(
+                    client.processor.prepare_frame(_person(age)) for age in range(40)
+                )
+            )
+            replies = [await asyncio.wait_for(client.receive(), 5) for _ in range(40)]
+
+            await client.close()
+            await server.close()
+
+        assert replies == [_person(age) for age in range(40)]
+        assert metrics.frames_received[1, "MSG_PERSON"] == 40
+        assert metrics.errors == {}
+        assert hook.threads == {threading.get_ident()}
+
+    asyncio.run(_test())
+
+
+def test_in_flight_bounded_within_a_read():
+    async def _test():
+        release = threading.Event()
+
+        def _blocked_echo(message):
+            release.wait(5)
+            return message
+
+        with ThreadPoolExecutor(4) as executor:
+            server = Server("127.0.0.1", 0, executor=executor, max_in_flight=3)
+            server.message_processor.load_protocol_from_string(TEST_PROTOCOL)
+            server.handlers.add(_blocked_echo, name="MSG_PERSON", offload=True)
+            await server.start()
+
+            client = await RawClient.connect(server)
+            await client.receive()
+            (session,) = server.sessions.values()
+
+            # every frame arrives in one read
+            client.writer.write(
+                b"".join(
+                    client.processor.prepare_frame(_person(age)) for age in range(20)
+                )
+            )
+            await wait_until(lambda: session._held)
+
+            assert len(session._ordered) == 3
+            assert len(session._held) == 17
+            assert session.reading_paused
+
+            release.set()
+            replies = [await asyncio.wait_for(client.receive(), 5) for _ in range(20)]
+            assert replies == [_person(age) for age in range(20)]
+            assert not session.reading_paused
+
+            await client.close()
+            await server.close()
+
+    asyncio.run(_test())
+
+
+def test_controls_wait_for_offloaded_work():
+    async def _test():
+        server = Server("127.0.0.1", 0)
+        server.handlers.add(_slow_echo, name="MSG_PERSON", offload=True)
+        server.message_processor.load_protocol_from_string(TEST_PROTOCOL)
+        await server.start()
+
+        client = await RawClient.connect(server)
+        await client.receive()
+
+        client.send(_person(0))
+        client.send(
+            KeepAlive(session_id=0, milliseconds=0, session_minutes=0, opcode=3)
+        )
+
+        assert await client.receive() == _person(0)
+        assert isinstance(await client.receive(), KeepAliveResponse)
+
+        await client.close()
+        await server.close()
+
+    asyncio.run(_test())
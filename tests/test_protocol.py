@@ -1,28 +1,14 @@
-from wizmsg import ProtocolDefinition
-from wizmsg.network import MessageData, Processor
+import pickle
+from mmap import ACCESS_READ, mmap
+from xml.etree import ElementTree
 
-TEST_PROTOCOL = """<?xml version="1.0" ?>
-<TestProtocol>
-  <_ProtocolInfo>
-    <RECORD>
-      <ServiceID TYPE="UBYT">1</ServiceID>
-      <ProtocolType TYPE="STR">TEST</ProtocolType>
-      <ProtocolVersion TYPE="INT">1</ProtocolVersion>
-      <ProtocolDescription TYPE="STR">Testing wizmsg</ProtocolDescription>
-    </RECORD>
-  </_ProtocolInfo>
+import pytest
 
-  <MSG_PERSON>
-    <RECORD>
-      <_MsgName TYPE="STR" NOXFER="TRUE">MSG_PERSON</_MsgName>
-      <_MsgDescription TYPE="STR" NOXFER="TRUE">:dead:</_MsgDescription>
-      <_MsgHandler TYPE="STR" NOXFER="TRUE">crate::person_handler</_MsgHandler>
-      <Name TYPE="STR"></Name>
-      <Age TYPE="UBYT"></Age>
-    </RECORD>
-  </MSG_PERSON>
-</TestProtocol>
-"""
+from tests.helpers import MIXED_MESSAGE, MIXED_PROTOCOL, TEST_PROTOCOL
+from wizmsg import ByteInterface, ProtocolCache, ProtocolDefinition
+from wizmsg.network import LazyParameters, MessageData, MessageRecord, Processor
+from wizmsg.network.controls import KeepAlive, SessionOffer
+from wizmsg.network.protocol import record_class
 
 
 def test_load_protocol_from_string():
@@ -38,6 +24,7 @@ def test_load_protocol_from_string():
 
     assert test_message.description == ":dead:"
     assert test_message.name == "MSG_PERSON"
+    assert test_message.handler == "crate::person_handler"
 
     assert test_message.parameters.get("Name") is not None
     assert test_message.parameters.get("Age") is not None
@@ -55,7 +42,404 @@ def test_processing():
     message = MessageData(1, 1, "MSG_PERSON", {"Name": "Edgar Allan Poe", "Age": 40})
 
     raw = processor.prepare_frame(message)
-    assert raw == b'\r\xf0\x1b\x00\x00\x00\x00\x00\x01\x01\x12\x00\x0f\x00Edgar Allan Poe(\x00'
+    assert (
+        raw
+        == b"\r\xf0\x1b\x00\x00\x00\x00\x00\x01\x01\x12\x00\x0f\x00Edgar Allan Poe(\x00"
+    )
 
     message2 = processor.process_frame(raw)
     assert message == message2
+
+
+def test_processing_mixed_types():
+    processor = Processor()
+    processor.load_protocol_from_string(MIXED_PROTOCOL)
+
+    raw = processor.prepare_frame(MIXED_MESSAGE)
+    assert processor.process_frame(raw) == MIXED_MESSAGE
+
+
+def test_codec_fuses_fixed_width_runs():
+    processor = Processor()
+    protocol = processor.load_protocol_from_string(MIXED_PROTOCOL)
+
+    codec = protocol.messages[1].codec
+    assert [names for _, _, names in codec.steps] == [
+        ("GlobalID", "Small", "Short"),
+        ("Zone",),
+        ("Count", "Speed"),
+        ("Chat",),
+        ("Ratio", "Flag"),
+    ]
+
+
+def test_prepare_missing_parameter():
+    processor = Processor()
+    processor.load_protocol_from_string(TEST_PROTOCOL)
+
+    message = MessageData(1, 1, "MSG_PERSON", {"Name": "Edgar Allan Poe"})
+
+    with pytest.raises(ValueError):
+        processor.prepare_frame(message)
+
+
+def test_process_frame_from_view():
+    processor = Processor()
+    processor.load_protocol_from_string(MIXED_PROTOCOL)
+
+    raw = processor.prepare_frame(MIXED_MESSAGE)
+    buffer = bytearray(b"\x00" * 3 + raw + b"\x00" * 3)
+
+    assert processor.process_frame(memoryview(buffer)[3:-3]) == MIXED_MESSAGE
+
+
+def test_control_processing():
+    processor = Processor()
+
+    offer = SessionOffer(
+        session_id=7,
+        timestamp=1_700_000_000,
+        milliseconds=123,
+        crypto_flags=0,
+        crypto_key_slot=0,
+        crypto_key_mask=0,
+        crypto_challenge=b"",
+        crypto_nonce=0,
+        crypto_signature=bytes(256),
+        opcode=0,
+    )
+
+    assert processor.process_frame(processor.prepare_frame(offer)) == offer
+
+
+def test_lazy_processing():
+    processor = Processor()
+    processor.load_protocol_from_string(MIXED_PROTOCOL)
+
+    raw = processor.prepare_frame(MIXED_MESSAGE)
+    message = processor.process_frame(raw, lazy=True)
+
+    assert isinstance(message.parameters, LazyParameters)
+    assert message.parameters["Ratio"] == 0.25
+    assert message.parameters["Chat"] == "hello ✨"
+    assert message.parameters["GlobalID"] == 0xFFFF_FFFF_FFFF_FFFF
+    assert message == MIXED_MESSAGE
+
+    # lazy messages can be sent back out as is
+    assert processor.prepare_frame(message) == raw
+
+
+def test_lazy_processing_truncated():
+    processor = Processor()
+    processor.load_protocol_from_string(TEST_PROTOCOL)
+
+    raw = bytearray(
+        processor.prepare_frame(
+            MessageData(1, 1, "MSG_PERSON", {"Name": "Edgar Allan Poe", "Age": 40})
+        )
+    )
+    # claim the name is longer than the message
+    raw[12] = 0xFF
+
+    message = processor.process_frame(raw, lazy=True)
+
+    with pytest.raises(ValueError):
+        message.parameters["Name"]
+
+
+def test_process_frames():
+    processor = Processor()
+    processor.load_protocol_from_string(TEST_PROTOCOL)
+    processor.load_protocol_from_string(MIXED_PROTOCOL)
+
+    person = MessageData(1, 1, "MSG_PERSON", {"Name": "Edgar Allan Poe", "Age": 40})
+    keep_alive = KeepAlive(session_id=1, milliseconds=2, session_minutes=3, opcode=3)
+    expected = [person, MIXED_MESSAGE, keep_alive, person]
+
+    raw = b"".join(processor.prepare_frame(frame) for frame in expected)
+    partial = processor.prepare_frame(person)[:10]
+
+    frames, consumed = processor.process_frames(raw + partial)
+
+    assert frames == expected
+    assert consumed == len(raw)
+
+
+def test_process_frames_lazy_mmap(tmp_path):
+    processor = Processor()
+    processor.load_protocol_from_string(TEST_PROTOCOL)
+
+    person = MessageData(1, 1, "MSG_PERSON", {"Name": "Edgar Allan Poe", "Age": 40})
+    capture_path = tmp_path / "frames"
+    capture_path.write_bytes(processor.prepare_frame(person) * 3)
+
+    with open(capture_path, "rb") as fp, mmap(
+        fp.fileno(), 0, access=ACCESS_READ
+    ) as data:
+        frames, _ = processor.process_frames(data, lazy=True)
+
+    # the map closed with the lazy frames still alive
+    assert [frame.parameters["Name"] for frame in frames] == ["Edgar Allan Poe"] * 3
+    assert [frame.parameters["Age"] for frame in frames] == [40] * 3
+
+
+def test_process_frames_lazy_carry_over():
+    processor = Processor()
+    processor.load_protocol_from_string(TEST_PROTOCOL)
+
+    person = MessageData(1, 1, "MSG_PERSON", {"Name": "Edgar Allan Poe", "Age": 40})
+    raw = processor.prepare_frame(person)
+    buffer = bytearray(raw * 2 + raw[:5])
+
+    frames, consumed = processor.process_frames(buffer, lazy=True)
+    # the lazy frames don't pin the buffer
+    del buffer[:consumed]
+
+    assert buffer == raw[:5]
+    assert frames == [person, person]
+
+
+def test_protocol_cache(tmp_path):
+    protocol_path = tmp_path / "TestMessages.xml"
+    protocol_path.write_text(TEST_PROTOCOL)
+
+    cache = ProtocolCache(tmp_path / "cache")
+    definition = cache.load(protocol_path)
+
+    assert definition == ProtocolDefinition.from_string(TEST_PROTOCOL)
+    assert len(list(cache.directory.iterdir())) == 1
+
+    # served from the cache entry
+    assert cache.load(protocol_path) == definition
+
+    protocol_path.write_text(TEST_PROTOCOL.replace("Testing wizmsg", "Changed"))
+
+    assert cache.load(protocol_path).description == "Changed"
+    assert len(list(cache.directory.iterdir())) == 1
+
+
+def test_protocol_cache_same_file_names(tmp_path):
+    first = tmp_path / "first" / "TestMessages.xml"
+    second = tmp_path / "second" / "TestMessages.xml"
+    for protocol_path, description in ((first, "First"), (second, "Second")):
+        protocol_path.parent.mkdir()
+        protocol_path.write_text(TEST_PROTOCOL.replace("Testing wizmsg", description))
+
+    cache = ProtocolCache(tmp_path / "cache")
+    cache.load(first)
+    cache.load(second)
+
+    # neither evicts the other
+    entries = sorted(cache.directory.iterdir())
+    assert len(entries) == 2
+
+    assert cache.load(first).description == "First"
+    assert cache.load(second).description == "Second"
+    assert sorted(cache.directory.iterdir()) == entries
+
+
+@pytest.mark.parametrize("workers", [None, 2])
+def test_load_protocols_from_directory(tmp_path, workers):
+    (tmp_path / "TestMessages.xml").write_text(TEST_PROTOCOL)
+    (tmp_path / "MixedMessages.xml").write_text(MIXED_PROTOCOL)
+
+    processor = Processor()
+    protocols = processor.load_protocols_from_directory(tmp_path, workers=workers)
+
+    assert [protocol.definition.service_id for protocol in protocols] == [2, 1]
+    assert processor.protocols[1].definition == ProtocolDefinition.from_string(
+        TEST_PROTOCOL
+    )
+
+
+def test_load_protocols_duplicate_service_id(tmp_path):
+    (tmp_path / "TestMessages.xml").write_text(TEST_PROTOCOL)
+    (tmp_path / "OtherMessages.xml").write_text(TEST_PROTOCOL)
+
+    processor = Processor()
+
+    with pytest.raises(ValueError, match="both define service id 1"):
+        processor.load_protocols_from_directory(tmp_path)
+
+    assert processor.protocols == {}
+
+
+def test_index_protocols_from_directory(tmp_path):
+    (tmp_path / "TestMessages.xml").write_text(TEST_PROTOCOL)
+    (tmp_path / "MixedMessages.xml").write_text(MIXED_PROTOCOL)
+
+    processor = Processor()
+    processor.load_protocol_from_string(MIXED_PROTOCOL)
+    raw = processor.prepare_frame(MIXED_MESSAGE)
+
+    processor = Processor()
+    index = processor.index_protocols_from_directory(tmp_path)
+
+    assert index == {
+        1: tmp_path / "TestMessages.xml",
+        2: tmp_path / "MixedMessages.xml",
+    }
+    assert processor.protocols == {}
+
+    assert processor.process_frame(raw) == MIXED_MESSAGE
+    assert list(processor.protocols) == [2]
+
+
+def test_index_protocols_retry_failed_load(tmp_path):
+    protocol_path = tmp_path / "TestMessages.xml"
+    protocol_path.write_text(TEST_PROTOCOL)
+
+    processor = Processor()
+    processor.index_protocols_from_directory(tmp_path)
+
+    # broken after indexing, i.e. mid deploy
+    protocol_path.write_text(TEST_PROTOCOL[: len(TEST_PROTOCOL) // 2])
+    with pytest.raises(ElementTree.ParseError):
+        processor.get_protocol(1)
+
+    assert processor.protocol_index == {1: protocol_path}
+
+    protocol_path.write_text(TEST_PROTOCOL)
+    assert processor.get_protocol(1) is processor.protocols[1]
+    assert processor.protocol_index == {}
+
+
+ORDERED_PROTOCOL = """<?xml version="1.0" ?>
+<OrderedProtocol>
+  <_ProtocolInfo>
+    <RECORD>
+      <ServiceID TYPE="UBYT">3</ServiceID>
+      <ProtocolType TYPE="STR">ORDERED</ProtocolType>
+      <ProtocolVersion TYPE="INT">1</ProtocolVersion>
+      <ProtocolDescription TYPE="STR">Explicit message order</ProtocolDescription>
+    </RECORD>
+  </_ProtocolInfo>
+
+  <MSG_B>
+    <RECORD>
+      <_MsgDescription TYPE="STR" NOXFER="TRUE">second</_MsgDescription>
+      <_MsgOrder TYPE="UBYT" NOXFER="TRUE">2</_MsgOrder>
+      <GlobalID></GlobalID>
+      <Typo TPYE="INT"></Typo>
+    </RECORD>
+  </MSG_B>
+  <MSG_A>
+    <RECORD>
+      <_MsgDescription TYPE="STR" NOXFER="TRUE">first</_MsgDescription>
+      <_MsgOrder TYPE="UBYT" NOXFER="TRUE">1</_MsgOrder>
+      <Short TYP="STR"></Short>
+    </RECORD>
+  </MSG_A>
+  <MSG_B>
+    <RECORD>
+      <_MsgDescription TYPE="STR" NOXFER="TRUE">duplicate</_MsgDescription>
+    </RECORD>
+  </MSG_B>
+</OrderedProtocol>
+"""
+
+
+def test_load_protocol_message_order():
+    protocol = ProtocolDefinition.from_string(ORDERED_PROTOCOL)
+
+    assert list(protocol.messages) == [1, 2, "MSG_B", "MSG_A"]
+    assert protocol.messages[1].name == "MSG_A"
+    assert protocol.messages[2] is protocol.messages["MSG_B"]
+    assert protocol.messages[2].description == "second"
+
+    parameters = protocol.messages[2].parameters
+    assert parameters["GlobalID"].type == "GID"
+    assert parameters["Typo"].type == "INT"
+    assert protocol.messages[1].parameters["Short"].type == "STR"
+
+
+def test_prepare_frame_into():
+    processor = Processor()
+    processor.load_protocol_from_string(TEST_PROTOCOL)
+    processor.load_protocol_from_string(MIXED_PROTOCOL)
+
+    person = MessageData(1, 1, "MSG_PERSON", {"Name": "Edgar Allan Poe", "Age": 40})
+    keep_alive = KeepAlive(session_id=1, milliseconds=2, session_minutes=3, opcode=3)
+
+    buffer = bytearray(b"\xff" * 16)
+    offset = 5
+    for frame in (person, MIXED_MESSAGE, keep_alive):
+        offset += processor.prepare_frame_into(frame, buffer, offset)
+
+    assert buffer[:5] == b"\xff" * 5
+    assert offset == len(buffer)
+
+    frames, consumed = processor.process_frames(memoryview(buffer)[5:])
+    assert frames == [person, MIXED_MESSAGE, keep_alive]
+
+
+def test_prepare_large_frame():
+    processor = Processor()
+    processor.load_protocol_from_string(TEST_PROTOCOL)
+
+    message = MessageData(1, 1, "MSG_PERSON", {"Name": "a" * 40_000, "Age": 40})
+
+    raw = processor.prepare_frame(message)
+    assert raw[2:4] == b"\x00\x80"
+    assert processor.process_frame(raw) == message
+
+
+def test_prepare_protocol_data():
+    processor = Processor()
+    protocol = processor.load_protocol_from_string(TEST_PROTOCOL)
+
+    message = MessageData(1, 1, "MSG_PERSON", {"Name": "Edgar Allan Poe", "Age": 40})
+
+    buffer = ByteInterface()
+    written = protocol.prepare_protocol_data(buffer, message)
+
+    assert buffer.getvalue() == processor.prepare_frame(message)[8:]
+    assert written == len(buffer.getvalue())
+
+
+def test_message_records():
+    processor = Processor()
+    processor.load_protocol_from_string(MIXED_PROTOCOL)
+    raw = processor.prepare_frame(MIXED_MESSAGE)
+
+    record = processor.process_frame(raw, as_record=True)
+
+    assert isinstance(record, MessageRecord)
+    assert type(record).__name__ == "MSG_EVERYTHING"
+    assert (record._service_id, record._order_id) == (2, 1)
+    assert record.Zone == "WizardCity/WC_Hub"
+    assert record.Ratio == 0.25
+    assert type(record).__annotations__["Count"] is int
+    assert record._message_data() == MIXED_MESSAGE
+
+    # records encode the same as MessageData and survive pickling
+    assert processor.prepare_frame(record) == raw
+    assert pickle.loads(pickle.dumps(record)) == record
+
+    frames, _ = processor.process_frames(raw * 2, as_record=True)
+    assert frames == [record, record]
+    assert type(frames[0]) is type(record)
+
+    with pytest.raises(ValueError):
+        processor.process_frame(raw, lazy=True, as_record=True)
+
+    other = Processor()
+    other.load_protocol_from_string(
+        MIXED_PROTOCOL.replace('<Flag TYPE="UBYT">', '<Flag TYPE="USHRT">')
+    )
+    with pytest.raises(ValueError):
+        other.prepare_frame(record)
+
+
+def test_record_renamed_fields():
+    record_type = record_class(
+        1, 1, "MSG_ODD", (("class", "UBYT"), ("_hidden", "STR"), ("Fine", "INT"))
+    )
+
+    record = record_type(1, "two", 3)
+    assert record.Fine == 3
+    assert record._message_data().parameters == {
+        "class": 1,
+        "_hidden": "two",
+        "Fine": 3,
+    }
@@ -0,0 +1,313 @@
+import asyncio
+import multiprocessing
+import signal
+import socket
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+import wizmsg
+from tests.helpers import (
+    PERSON,
+    TEST_PROTOCOL,
+    EchoServer,
+    RawClient,
+    make_processor,
+    wait_until,
+)
+from wizmsg import Server
+from wizmsg.network import FrameDecoder, MessageData, Processor
+from wizmsg.network.controls import KeepAlive, KeepAliveResponse, SessionOffer
+
+
+def test_session_lifecycle():
+    async def _test():
+        server = EchoServer("127.0.0.1", 0)
+        await server.start()
+
+        client = await RawClient.connect(server)
+
+        offer = await client.receive()
+        assert isinstance(offer, SessionOffer)
+        assert list(server.sessions) == [offer.session_id]
+
+        # frames split across writes and coalesced into one
+        raw = client.processor.prepare_frame(PERSON)
+        client.writer.write(raw[:5])
+        await client.writer.drain()
+        client.writer.write(raw[5:] + raw)
+
+        assert await client.receive() == PERSON
+        assert await client.receive() == PERSON
+
+        client.send(
+            KeepAlive(session_id=0, milliseconds=0, session_minutes=0, opcode=3)
+        )
+        assert isinstance(await client.receive(), KeepAliveResponse)
+
+        await client.close()
+        await wait_until(lambda: not server.sessions)
+
+        await server.close()
+
+    asyncio.run(_test())
+
+
+def test_heartbeat_timeout():
+    async def _test():
+        server = EchoServer(
+            "127.0.0.1", 0, heartbeat_interval=0.05, heartbeat_timeout=0.05
+        )
+        await server.start()
+
+        client = await RawClient.connect(server)
+        await client.receive()
+
+        keep_alive = await client.receive()
+        assert type(keep_alive) is KeepAlive
+
+        # not answering gets the session closed
+        await wait_until(lambda: not server.sessions)
+        assert await client.reader.read() == b""
+
+        await server.close()
+
+    asyncio.run(_test())
+
+
+def test_heartbeat_skips_busy_sessions():
+    async def _test():
+        server = EchoServer(
+            "127.0.0.1", 0, heartbeat_interval=0.1, heartbeat_timeout=0.05
+        )
+        await server.start()
+
+        client = await RawClient.connect(server)
+        await client.receive()
+
+        # keep alives are never answered, only regular traffic is sent
+        for _ in range(15):
+            client.send(PERSON)
+            assert await client.receive() == PERSON
+            await asyncio.sleep(0.02)
+
+        assert len(server.sessions) == 1
+
+        # going quiet gets a keep alive, then the session closed
+        assert type(await client.receive()) is KeepAlive
+        await wait_until(lambda: not server.sessions)
+
+        await server.close()
+
+    asyncio.run(_test())
+
+
+def test_server_close():
+    async def _test():
+        server = EchoServer("127.0.0.1", 0)
+        await server.start()
+
+        clients = [await RawClient.connect(server) for _ in range(5)]
+        for client in clients:
+            await client.receive()
+
+        assert sorted(server.sessions) == [1, 2, 3, 4, 5]
+
+        await server.close()
+        await wait_until(lambda: not server.sessions)
+
+    asyncio.run(_test())
+
+
+def test_heartbeat_answered():
+    async def _test():
+        server = EchoServer(
+            "127.0.0.1", 0, heartbeat_interval=0.05, heartbeat_timeout=0.05
+        )
+        await server.start()
+
+        client = await RawClient.connect(server)
+        await client.receive()
+
+        for _ in range(4):
+            keep_alive = await client.receive()
+            assert type(keep_alive) is KeepAlive
+
+            client.send(
+                KeepAliveResponse(
+                    session_id=keep_alive.session_id,
+                    milliseconds=keep_alive.milliseconds,
+                    session_minutes=keep_alive.session_minutes,
+                    opcode=4,
+                )
+            )
+
+        assert len(server.sessions) == 1
+        assert len(server.heartbeat) == 1
+
+        await server.close()
+
+    asyncio.run(_test())
+
+
+run_workers_supported = pytest.mark.skipif(
+    not hasattr(socket, "SO_REUSEPORT")
+    or "fork" not in multiprocessing.get_all_start_methods(),
+    reason="SO_REUSEPORT or fork not supported",
+)
+
+
+@run_workers_supported
+def test_run_workers():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+
+    script = f"""
+import sys
+sys.path.insert(0, {str(Path(__file__).parents[1])!r})
+
+from tests.helpers import EchoServer
+
+EchoServer("127.0.0.1", {port}).run_workers(2)
+"""
+    supervisor = subprocess.Popen([sys.executable, "-c", script])
+
+    async def _connect() -> RawClient:
+        for _ in range(100):
+            try:
+                return RawClient(*await asyncio.open_connection("127.0.0.1", port))
+            except OSError:
+                await asyncio.sleep(0.05)
+
+        raise TimeoutError("workers never started listening")
+
+    async def _test():
+        clients = [await _connect() for _ in range(8)]
+
+        for client in clients:
+            assert isinstance(await client.receive(), SessionOffer)
+
+            client.send(PERSON)
+            assert await client.receive() == PERSON
+
+            await client.close()
+
+    try:
+        asyncio.run(_test())
+    finally:
+        supervisor.send_signal(signal.SIGTERM)
+        assert supervisor.wait(timeout=15) == 0
+
+
+@run_workers_supported
+def test_run_workers_clean_exit():
+    script = f"""
+import sys
+sys.path.insert(0, {str(Path(__file__).parents[1])!r})
+
+from tests.helpers import EchoServer
+
+class QuittingServer(EchoServer):
+    async def _run_worker(self):
+        pass
+
+QuittingServer("127.0.0.1", 0).run_workers(2, restart_delay=0)
+"""
+    # returns instead of restarting workers that exit with 0
+    assert subprocess.run([sys.executable, "-c", script], timeout=15).returncode == 0
+
+
+@pytest.mark.parametrize(
+    "use_uvloop",
+    [
+        False,
+        pytest.param(
+            True,
+            marks=pytest.mark.skipif(
+                not wizmsg.uvloop_available(), reason="uvloop not installed"
+            ),
+        ),
+    ],
+)
+def test_event_loops(use_uvloop):
+    async def _test():
+        server = EchoServer("127.0.0.1", 0)
+        await server.start()
+
+        client = await RawClient.connect(server)
+        assert isinstance(await client.receive(), SessionOffer)
+
+        client.send(PERSON)
+        assert await client.receive() == PERSON
+
+        await client.close()
+        await server.close()
+
+        return type(asyncio.get_running_loop()).__module__
+
+    loop_module = wizmsg.run(_test(), use_uvloop=use_uvloop)
+    assert loop_module.startswith("uvloop") == use_uvloop
+
+
+def test_uvloop_missing(monkeypatch):
+    # a None entry makes the import fail
+    monkeypatch.setitem(sys.modules, "uvloop", None)
+
+    assert not wizmsg.uvloop_available()
+    assert isinstance(wizmsg.new_event_loop(), asyncio.BaseEventLoop)
+
+    with pytest.raises(RuntimeError):
+        wizmsg.new_event_loop(use_uvloop=True)
+
+
+def test_broadcast():
+    async def _test():
+        metrics = wizmsg.Metrics()
+        server = EchoServer("127.0.0.1", 0, metrics=metrics)
+        await server.start()
+
+        clients = [await RawClient.connect(server) for _ in range(3)]
+        for client in clients:
+            await client.receive()
+
+        await wait_until(lambda: len(server.sessions) == 3)
+        first, second, third = server.sessions.values()
+
+        server.join("zone", first)
+        server.join("zone", second)
+        assert server.broadcast(PERSON, "zone", exclude=first) == 1
+        assert server.broadcast(PERSON) == 3
+        # counted once per session written to, encoded once per broadcast
+        assert metrics.frames_sent[1, "MSG_PERSON"] == 4
+        size = len(make_processor().prepare_frame(PERSON))
+        assert metrics.bytes_sent[1, "MSG_PERSON"] == 4 * size
+        assert metrics.encode_seconds[1, "MSG_PERSON"].count == 2
+
+        # backed up sessions are skipped, written to or closed
+        third.writing_paused = True
+        assert server.broadcast(PERSON, [first, third]) == 1
+        assert server.broadcast(PERSON, [third], paused=wizmsg.server.SEND_PAUSED) == 1
+        assert server.broadcast(PERSON, [third], paused=wizmsg.server.CLOSE_PAUSED) == 0
+        assert not third.alive
+
+        with pytest.raises(ValueError):
+            server.broadcast(PERSON, paused="wait")
+
+        by_session = dict(zip((first, second, third), clients))
+        received = {first: 2, second: 2, third: 2}
+        for session, count in received.items():
+            for _ in range(count):
+                assert await by_session[session].receive() == PERSON
+
+        await clients[1].close()
+        await wait_until(lambda: len(server.sessions) == 1)
+        assert server.groups == {"zone": {first}}
+        assert second.groups == set()
+
+        await clients[0].close()
+        await server.close()
+
+    asyncio.run(_test())
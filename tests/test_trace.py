@@ -0,0 +1,85 @@
+from loguru import logger
+
+from tests.helpers import PERSON, TEST_PROTOCOL
+from wizmsg.network import HexDumpHook, Processor, TraceHook
+from wizmsg.network.controls import KeepAlive
+
+KEEP_ALIVE = KeepAlive(session_id=1, milliseconds=2, session_minutes=3, opcode=3)
+
+
+class RecordingHook(TraceHook):
+    trace_parameters = True
+
+    def __init__(self):
+        self.events = []
+
+    def frame_received(self, raw, frame):
+        self.events.append(("received", bytes(raw), frame))
+
+    def frame_sent(self, raw, frame):
+        self.events.append(("sent", bytes(raw), frame))
+
+    def parameter(self, message, name, value, raw, offset):
+        self.events.append(("parameter", name, value, bytes(raw), offset))
+
+
+def test_trace_hook():
+    processor = Processor()
+    processor.load_protocol_from_string(TEST_PROTOCOL)
+
+    hook = RecordingHook()
+    processor.add_trace_hook(hook)
+
+    raw = processor.prepare_frame(PERSON)
+    assert processor.process_frame(raw) == PERSON
+
+    name = b"\x0f\x00Edgar Allan Poe"
+    parameters = [
+        ("parameter", "Name", "Edgar Allan Poe", name, 12),
+        ("parameter", "Age", 40, b"\x28", 12 + len(name)),
+    ]
+    assert hook.events == [
+        ("sent", raw, PERSON),
+        *parameters,
+        ("received", raw, PERSON),
+        *parameters,
+    ]
+
+    hook.events.clear()
+    control = processor.prepare_frame(KEEP_ALIVE)
+    frames, _ = processor.process_frames(control + raw, lazy=True)
+
+    assert [event[0] for event in hook.events] == [
+        "sent",
+        "received",
+        "received",
+        "parameter",
+        "parameter",
+    ]
+    assert hook.events[2] == ("received", raw, frames[1])
+
+    processor.remove_trace_hook(hook)
+    hook.events.clear()
+    processor.process_frame(raw)
+    assert hook.events == []
+
+
+def test_hex_dump_hook():
+    processor = Processor()
+    processor.load_protocol_from_string(TEST_PROTOCOL)
+    raw = processor.prepare_frame(PERSON)
+
+    messages = []
+    sink = logger.add(messages.append, level="DEBUG", format="{message}")
+    try:
+        # decoding logs nothing without a hook
+        processor.process_frame(raw)
+        assert messages == []
+
+        processor.add_trace_hook(HexDumpHook())
+        processor.process_frame(raw)
+    finally:
+        logger.remove(sink)
+
+    assert messages[0].startswith(f"received MSG_PERSON ({len(raw)} bytes) 0d f0")
+    assert messages[2].strip() == "Age@29=40 28"
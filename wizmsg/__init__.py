@@ -1,9 +1,23 @@
+import importlib.metadata
+
+try:
+    __version__ = importlib.metadata.version("wizmsg")
+except importlib.metadata.PackageNotFoundError:
+    # a checkout that isn't installed; pyproject.toml has the real version
+    __version__ = "0+unknown"
+
 from .byte_interface import ByteInterface
+from .byte_view import ByteView
+from .capture import CapturedFrame, CaptureReader, CaptureWriter
 from .constants import *
+from .event_loop import new_event_loop, run, uvloop_available
+from .metrics import Metrics
 from .protocol_definition import (
     MessageDefinition,
     MessageDefinitionParameter,
     ProtocolDefinition,
 )
+from .protocol_cache import ProtocolCache
+from .client import Client, ClientPool
 from .server import Server
 from .session import Session
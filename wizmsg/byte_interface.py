@@ -20,6 +20,9 @@ class ByteInterface(BytesIO):
         assert not isinstance(result, tuple)
         return result
 
+    def read_struct(self, layout: struct.Struct) -> tuple[typing.Any, ...]:
+        return layout.unpack(self.read(layout.size))
+
     def write_format_string(self, format_string: str, data: UnpackedData) -> int:
         """
         returns the number of bytes written
@@ -47,7 +50,8 @@ class ByteInterface(BytesIO):
         written = 0
 
         wide_string_encoded = wide_string.encode("utf-16-le")
-        written += self.write_unsigned2(len(wide_string_encoded))
+        # length is in code units
+        written += self.write_unsigned2(len(wide_string_encoded) // 2)
         written += self.write(wide_string_encoded)
 
         return written
@@ -0,0 +1,133 @@
+import struct
+import typing
+
+from wizmsg.byte_interface import UnpackedData
+
+Buffer: typing.TypeAlias = bytes | bytearray | memoryview
+
+_BOOL = struct.Struct("?")
+_FLOAT = struct.Struct("<f")
+_DOUBLE = struct.Struct("<d")
+_UNSIGNED1 = struct.Struct("<B")
+_SIGNED1 = struct.Struct("<b")
+_UNSIGNED2 = struct.Struct("<H")
+_SIGNED2 = struct.Struct("<h")
+_UNSIGNED4 = struct.Struct("<I")
+_SIGNED4 = struct.Struct("<i")
+_UNSIGNED8 = struct.Struct("<Q")
+_SIGNED8 = struct.Struct("<q")
+
+
+class ByteView:
+    """
+    Read only cursor over an existing buffer with the same read methods as
+    ByteInterface; reads use struct.unpack_from and strings are returned as
+    memoryview slices so nothing is copied until the caller materializes it
+    """
+
+    __slots__ = ("_view", "_offset")
+
+    def __init__(self, buffer: Buffer, offset: int = 0):
+        self._view = memoryview(buffer)
+        self._offset = offset
+
+    def tell(self) -> int:
+        return self._offset
+
+    def seek(self, position: int, whence: int = 0) -> int:
+        if whence == 1:
+            position += self._offset
+        elif whence == 2:
+            position += len(self._view)
+
+        self._offset = position
+        return position
+
+    def getbuffer(self) -> memoryview:
+        return self._view
+
+    def remaining(self) -> int:
+        return len(self._view) - self._offset
+
+    def _check(self, size: int):
+        if self._offset + size > len(self._view):
+            raise ValueError(
+                f"Tried to read {size} bytes at offset {self._offset} with only "
+                f"{len(self._view) - self._offset} left"
+            )
+
+    def read_view(self, size: int) -> memoryview:
+        self._check(size)
+
+        start = self._offset
+        self._offset = start + size
+        return self._view[start : self._offset]
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0:
+            size = len(self._view) - self._offset
+
+        return self.read_view(size).tobytes()
+
+    def read_struct(self, layout: struct.Struct) -> tuple[typing.Any, ...]:
+        self._check(layout.size)
+
+        unpacked = layout.unpack_from(self._view, self._offset)
+        self._offset += layout.size
+        return unpacked
+
+    def read_format_string(self, format_string: str) -> UnpackedData:
+        unpacked = self.read_struct(struct.Struct(format_string))
+
+        if len(unpacked) == 1:
+            return unpacked[0]
+
+        return unpacked
+
+    def _read_single(self, layout: struct.Struct) -> typing.Any:
+        self._check(layout.size)
+
+        result = layout.unpack_from(self._view, self._offset)[0]
+        self._offset += layout.size
+        return result
+
+    def string(self) -> memoryview:
+        length = self.unsigned2()
+        return self.read_view(length)
+
+    def wide_string(self) -> str:
+        length = self.unsigned2() * 2
+        return str(self.read_view(length), "utf-16-le")
+
+    def bool(self) -> bool:
+        return self._read_single(_BOOL)
+
+    def float(self) -> float:
+        return self._read_single(_FLOAT)
+
+    def double(self) -> "float":
+        return self._read_single(_DOUBLE)
+
+    def unsigned1(self) -> int:
+        return self._read_single(_UNSIGNED1)
+
+    def signed1(self) -> int:
+        return self._read_single(_SIGNED1)
+
+    def unsigned2(self) -> int:
+        return self._read_single(_UNSIGNED2)
+
+    def signed2(self) -> int:
+        return self._read_single(_SIGNED2)
+
+    def unsigned4(self) -> int:
+        return self._read_single(_UNSIGNED4)
+
+    def signed4(self) -> int:
+        return self._read_single(_SIGNED4)
+
+    def unsigned8(self) -> int:
+        return self._read_single(_UNSIGNED8)
+
+    def signed8(self) -> int:
+        return self._read_single(_SIGNED8)
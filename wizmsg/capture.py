@@ -0,0 +1,318 @@
+import asyncio
+import mmap
+import os
+import struct
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Iterator
+
+if TYPE_CHECKING:
+    from wizmsg.network import Processor
+
+
+CAPTURE_MAGIC = b"WZMSGCAP"
+CAPTURE_VERSION = 1
+
+# magic, version
+CAPTURE_HEADER = struct.Struct("<8sH")
+# unix timestamp, session id, direction, frame length
+RECORD_HEADER = struct.Struct("<dHBI")
+
+# directions, from the server's side
+RECEIVED = 0
+SENT = 1
+# received bytes that couldn't be split into frames; the session was closed for them
+INVALID = 2
+
+
+@dataclass
+class CapturedFrame:
+    timestamp: float
+    session_id: int
+    direction: int
+    # view into the capture; only valid until the reader is closed
+    raw: memoryview
+
+
+class CaptureWriter:
+    """
+    Appends raw frames to a capture file
+
+    every record goes to the file in a single append, so a writer inherited by
+    forked server workers (see Server.run_workers) can be shared without their
+    records interleaving
+
+    with CaptureWriter("traffic.wzcap") as capture:
+        server = Server("0.0.0.0", 12000, capture=capture)
+        ...
+    """
+
+    def __init__(self, path: str | Path):
+        if isinstance(path, str):
+            path = Path(path)
+
+        self.path = path
+        # without O_BINARY windows would turn every 0x0A in a frame into CRLF
+        flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, "O_BINARY", 0)
+        self._fd = os.open(path, flags, 0o644)
+
+        if os.fstat(self._fd).st_size == 0:
+            os.write(self._fd, CAPTURE_HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION))
+        else:
+            with open(path, "rb") as fp:
+                _check_header(fp.read(CAPTURE_HEADER.size), path)
+
+    def __enter__(self) -> "CaptureWriter":
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def write(
+        self,
+        raw: bytes | bytearray | memoryview,
+        *,
+        session_id: int,
+        direction: int,
+        timestamp: float | None = None,
+    ):
+        if timestamp is None:
+            timestamp = time.time()
+
+        record = RECORD_HEADER.pack(timestamp, session_id, direction, len(raw)) + raw
+
+        written = os.write(self._fd, record)
+        # regular files only come up short when the disk is full
+        while written < len(record):
+            written += os.write(self._fd, record[written:])
+
+    def flush(self):
+        """
+        Records aren't buffered; kept so writers can be used like files
+        """
+        pass
+
+    def close(self):
+        if self._fd != -1:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def _check_header(header: bytes, path: Path):
+    if len(header) < CAPTURE_HEADER.size:
+        raise ValueError(f"{path} is too short to be a capture")
+
+    magic, version = CAPTURE_HEADER.unpack_from(header)
+    if magic != CAPTURE_MAGIC:
+        raise ValueError(f"{path} is not a capture")
+
+    if version != CAPTURE_VERSION:
+        raise ValueError(
+            f"{path} is capture version {version}, expected {CAPTURE_VERSION}"
+        )
+
+
+class CaptureReader:
+    """
+    Memory maps a capture and iterates its frames without copying them
+
+    with CaptureReader("traffic.wzcap") as capture:
+        for captured in capture:
+            processor.process_frame(captured.raw)
+    """
+
+    def __init__(self, path: str | Path):
+        if isinstance(path, str):
+            path = Path(path)
+
+        self.path = path
+
+        with open(path, "rb") as fp:
+            # mmap refuses empty files
+            _check_header(fp.read(CAPTURE_HEADER.size), path)
+            self._mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self._view = memoryview(self._mmap)
+
+    def __enter__(self) -> "CaptureReader":
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def __iter__(self) -> Iterator[CapturedFrame]:
+        for _, captured in self.records():
+            yield captured
+
+    def records(
+        self, start: int | None = None, end: int | None = None
+    ) -> Iterator[tuple[int, CapturedFrame]]:
+        """
+        (offset, frame) for every record starting in [start, end); start must be
+        a record boundary. A record cut off by the end of the file is skipped
+        """
+        view = self._view
+        offset = CAPTURE_HEADER.size if start is None else start
+        end = len(view) if end is None else end
+
+        while offset < end and offset + RECORD_HEADER.size <= len(view):
+            timestamp, session_id, direction, length = RECORD_HEADER.unpack_from(
+                view, offset
+            )
+            frame_start = offset + RECORD_HEADER.size
+            frame_end = frame_start + length
+
+            # the recorder was probably killed mid write
+            if frame_end > len(view):
+                return
+
+            yield offset, CapturedFrame(
+                timestamp, session_id, direction, view[frame_start:frame_end]
+            )
+            offset = frame_end
+
+    def split(self, chunk_size: int) -> list[tuple[int, int]]:
+        """
+        Record aligned (start, end) ranges of about chunk_size bytes covering the
+        whole capture, to pass to records
+        """
+        view = self._view
+        chunks = []
+
+        start = offset = CAPTURE_HEADER.size
+        while offset + RECORD_HEADER.size <= len(view):
+            length = RECORD_HEADER.unpack_from(view, offset)[3]
+            offset += RECORD_HEADER.size + length
+
+            if offset - start >= chunk_size:
+                chunks.append((start, offset))
+                start = offset
+
+        if start < len(view):
+            chunks.append((start, len(view)))
+
+        return chunks
+
+    def close(self):
+        """
+        Every CapturedFrame.raw must be released or dropped before this
+        """
+        self._view.release()
+        self._mmap.close()
+
+
+def replay(
+    capture: CaptureReader,
+    processor: "Processor",
+    *,
+    speed: float | None = None,
+    direction: int = RECEIVED,
+    lazy: bool = False,
+) -> Iterator[Any]:
+    """
+    Decode the captured frames going in direction, yielding each one
+
+    speed: None replays as fast as possible, 1 at the captured pace, 10 ten
+    times faster
+
+    lazy: lazy messages decode from a copy of the frame, so the capture can be
+    closed while they're still around
+    """
+    first_timestamp = None
+    start = time.monotonic()
+
+    for captured in capture:
+        if captured.direction != direction:
+            continue
+
+        if speed is not None:
+            if first_timestamp is None:
+                first_timestamp = captured.timestamp
+
+            delay = (captured.timestamp - first_timestamp) / speed
+            remaining = start + delay - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+
+        raw = captured.raw
+        if lazy:
+            # a view would pin the reader's mmap for as long as the message lives
+            raw = bytes(raw)
+            captured.raw.release()
+
+        yield processor.process_frame(raw, lazy=lazy)
+
+
+async def replay_to_server(
+    capture: CaptureReader,
+    host: str,
+    port: int,
+    *,
+    speed: float | None = None,
+) -> int:
+    """
+    Send the frames each captured session received to a live server, one
+    connection per captured session; returns the number of frames sent
+
+    speed: see replay
+    """
+    loop = asyncio.get_running_loop()
+
+    # captured session id: connection
+    connections: dict[int, tuple[asyncio.StreamReader, asyncio.StreamWriter]] = {}
+    drains: list[asyncio.Task] = []
+
+    async def _drain_responses(reader: asyncio.StreamReader):
+        # responses aren't checked, only read so the server doesn't stall on them
+        while await reader.read(65536):
+            pass
+
+    first_timestamp = None
+    start = loop.time()
+    sent = 0
+
+    try:
+        for captured in capture:
+            if captured.direction != RECEIVED:
+                continue
+
+            if speed is not None:
+                if first_timestamp is None:
+                    first_timestamp = captured.timestamp
+
+                delay = (captured.timestamp - first_timestamp) / speed
+                remaining = start + delay - loop.time()
+                if remaining > 0:
+                    await asyncio.sleep(remaining)
+
+            connection = connections.get(captured.session_id)
+            if connection is None:
+                connection = await asyncio.open_connection(host, port)
+                connections[captured.session_id] = connection
+                drains.append(loop.create_task(_drain_responses(connection[0])))
+
+            writer = connection[1]
+            # copied; the transport may hold on to what it's given
+            writer.write(bytes(captured.raw))
+            sent += 1
+
+            # pace ourselves against the server's reads
+            await writer.drain()
+
+    finally:
+        for _, writer in connections.values():
+            writer.close()
+
+        for _, writer in connections.values():
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+        for drain in drains:
+            drain.cancel()
+
+        await asyncio.gather(*drains, return_exceptions=True)
+
+    return sent
@@ -1,6 +1,361 @@
-# how is a client different from a server?
-# - heartbeat interval
+import asyncio
+import time
+from collections import deque
+from typing import Union
 
+from loguru import logger
 
-class Client:
-    pass
+from wizmsg.network import FrameDecoder, Processor
+from wizmsg.network.controls import (
+    Control,
+    KeepAlive,
+    KeepAliveResponse,
+    SessionAccept,
+    SessionOffer,
+)
+from wizmsg.network.protocol import MessageData, MessageRecord
+
+
+class Client(asyncio.Protocol):
+    """
+    One client session; answers keep alives itself and queues received messages
+    for receive, override handle_message to handle them as they arrive instead
+
+    client = await Client.connect("127.0.0.1", 12000, processor=processor)
+    client.send(message)
+    reply = await client.receive()
+    """
+
+    # bot fleets hold thousands of these
+    __slots__ = (
+        "processor",
+        "message_records",
+        "transport",
+        "decoder",
+        "session_id",
+        "alive",
+        "writing_paused",
+        "messages",
+        "_handshake",
+        "_receive_waiter",
+        "_closed",
+    )
+
+    def __init__(
+        self,
+        processor: Processor,
+        *,
+        max_frame_size: int | None = None,
+        message_records: bool = False,
+    ):
+        """
+        processor: shared between clients; only needs the protocols loaded
+        message_records: receive MessageRecord tuples instead of MessageData
+        """
+        loop = asyncio.get_running_loop()
+
+        self.processor = processor
+        self.message_records = message_records
+
+        self.transport: asyncio.Transport | None = None
+        self.decoder = FrameDecoder(max_frame_size=max_frame_size)
+
+        # set once the server's session offer arrives
+        self.session_id: int | None = None
+        self.alive = False
+        self.writing_paused = False
+
+        self.messages: deque[MessageData | MessageRecord] = deque()
+
+        self._handshake: asyncio.Future = loop.create_future()
+        self._receive_waiter: asyncio.Future | None = None
+        self._closed: asyncio.Future = loop.create_future()
+
+    def __repr__(self) -> str:
+        return f"<Client session_id={self.session_id} alive={self.alive}>"
+
+    @classmethod
+    async def connect(
+        cls,
+        host: str,
+        port: int,
+        *,
+        processor: Processor,
+        timeout: float | None = 10,
+        **kwargs,
+    ) -> "Client":
+        """
+        Connect and wait for the session handshake to finish
+        """
+        loop = asyncio.get_running_loop()
+
+        _, client = await loop.create_connection(
+            lambda: cls(processor, **kwargs), host, port
+        )
+
+        try:
+            await asyncio.wait_for(asyncio.shield(client._handshake), timeout)
+        except BaseException:
+            client.close()
+            raise
+
+        return client
+
+    # asyncio.Protocol callbacks
+
+    def connection_made(self, transport: asyncio.Transport):
+        self.transport = transport
+        self.alive = True
+
+    def data_received(self, data: bytes):
+        try:
+            frames = self.decoder.feed(data)
+        except ValueError as exc:
+            logger.warning(f"closing {self}: {exc}")
+            self.close()
+            return
+
+        for raw in frames:
+            if not self.alive:
+                return
+
+            try:
+                frame = self.processor.process_frame(
+                    raw, as_record=self.message_records
+                )
+            except Exception:
+                logger.exception(f"failed to process frame for {self}")
+                continue
+
+            if isinstance(frame, Control):
+                self.dispatch_control(frame)
+            else:
+                try:
+                    self.handle_message(frame)
+                except Exception:
+                    logger.exception(f"message handler failed for {self}")
+
+    def pause_writing(self):
+        self.writing_paused = True
+
+    def resume_writing(self):
+        self.writing_paused = False
+
+    def connection_lost(self, exc: Exception | None):
+        self.alive = False
+
+        error = ConnectionError(f"{self} connection lost")
+        if not self._handshake.done():
+            self._handshake.set_exception(error)
+            # nobody may be waiting on it anymore
+            self._handshake.exception()
+
+        self._wake_receiver(error)
+
+        if not self._closed.done():
+            self._closed.set_result(None)
+
+    # session
+
+    def dispatch_control(self, control: Control):
+        if type(control) is SessionOffer:
+            self.session_id = control.session_id
+            self.send(self.make_session_accept())
+
+            if not self._handshake.done():
+                self._handshake.set_result(control)
+
+        # servers send KeepAlive and expect a KeepAliveResponse back
+        elif type(control) is KeepAlive:
+            self.send(
+                KeepAliveResponse(
+                    session_id=control.session_id,
+                    milliseconds=control.milliseconds,
+                    session_minutes=control.session_minutes,
+                    opcode=KeepAliveResponse.opcode,
+                )
+            )
+
+        self.handle_control(control)
+
+    def handle_control(self, control: Control):
+        """
+        Called for every control after the client has handled it itself
+        """
+        pass
+
+    def handle_message(self, message: MessageData | MessageRecord):
+        """
+        Called for every message received; queues it for receive by default
+        """
+        self.messages.append(message)
+        self._wake_receiver()
+
+    def _wake_receiver(self, error: Exception | None = None):
+        waiter = self._receive_waiter
+        if waiter is None or waiter.done():
+            return
+
+        if error is None:
+            waiter.set_result(None)
+        else:
+            waiter.set_exception(error)
+
+    # https://kronos-project.github.io/grimoire/internals/protocol/sessions.html#session-accept
+    def make_session_accept(self) -> SessionAccept:
+        now = time.time()
+
+        return SessionAccept(
+            timestamp=int(now),
+            milliseconds=int(now * 1000) % 1000,
+            session_id=self.session_id,
+            unknown=0,
+            fnv=0,
+            challenge_answer=0,
+            echo=0,
+            timestamp2=0,
+            key=bytes(16),
+            nonce=bytes(16),
+            opcode=SessionAccept.opcode,
+        )
+
+    def send(self, frame: Union[Control, MessageData, MessageRecord]):
+        self.send_raw(self.processor.prepare_frame(frame))
+
+    def send_raw(self, raw: bytes):
+        """
+        Send an already prepared frame
+        """
+        if not self.alive:
+            raise ConnectionError(f"{self} is closed")
+
+        self.transport.write(raw)
+
+    async def receive(
+        self, *, timeout: float | None = None
+    ) -> MessageData | MessageRecord:
+        """
+        Next queued message; only works while handle_message isn't overridden
+        """
+        while not self.messages:
+            if not self.alive:
+                raise ConnectionError(f"{self} is closed")
+
+            self._receive_waiter = asyncio.get_running_loop().create_future()
+            try:
+                await asyncio.wait_for(self._receive_waiter, timeout)
+            finally:
+                self._receive_waiter = None
+
+        return self.messages.popleft()
+
+    def close(self):
+        self.alive = False
+
+        if self.transport is not None:
+            self.transport.close()
+
+    async def wait_closed(self):
+        await asyncio.shield(self._closed)
+
+
+class ClientPool:
+    """
+    Many clients on one event loop sharing a processor
+
+    async with ClientPool("127.0.0.1", 12000, processor=processor) as pool:
+        await pool.connect(5000)
+        pool.broadcast(message)
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        *,
+        processor: Processor,
+        client_class: type[Client] = Client,
+        connect_concurrency: int = 100,
+        **client_kwargs,
+    ):
+        """
+        connect_concurrency: most handshakes in flight at once while connecting
+        client_kwargs: passed to every client
+        """
+        self.host = host
+        self.port = port
+        self.processor = processor
+        self.client_class = client_class
+        self.connect_concurrency = connect_concurrency
+        self.client_kwargs = client_kwargs
+
+        self.clients: list[Client] = []
+
+    async def __aenter__(self) -> "ClientPool":
+        return self
+
+    async def __aexit__(self, *_):
+        await self.close()
+
+    def __len__(self) -> int:
+        return len(self.clients)
+
+    def __iter__(self):
+        return iter(self.clients)
+
+    async def connect(self, count: int, *, timeout: float | None = 10) -> list[Client]:
+        """
+        Open count more clients; if any fail the ones that connected are closed
+        and the error is raised
+        """
+        semaphore = asyncio.Semaphore(self.connect_concurrency)
+
+        async def _connect() -> Client:
+            async with semaphore:
+                return await self.client_class.connect(
+                    self.host,
+                    self.port,
+                    processor=self.processor,
+                    timeout=timeout,
+                    **self.client_kwargs,
+                )
+
+        results = await asyncio.gather(
+            *(_connect() for _ in range(count)), return_exceptions=True
+        )
+
+        clients = [result for result in results if isinstance(result, Client)]
+        errors = [result for result in results if not isinstance(result, Client)]
+
+        if errors:
+            for client in clients:
+                client.close()
+
+            raise errors[0]
+
+        self.clients += clients
+        return clients
+
+    def broadcast(self, frame: Union[Control, MessageData, MessageRecord]) -> int:
+        """
+        Send frame from every live client, encoding it once; returns how many
+        clients it was sent from
+        """
+        raw, seconds = self.processor.encode_frame(frame)
+
+        sent = 0
+        for client in self.clients:
+            if client.alive:
+                client.send_raw(raw)
+                sent += 1
+
+        self.processor.frame_encoded(raw, frame, seconds, sent)
+
+        return sent
+
+    async def close(self):
+        for client in self.clients:
+            client.close()
+
+        await asyncio.gather(*(client.wait_closed() for client in self.clients))
+        self.clients.clear()
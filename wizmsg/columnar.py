@@ -0,0 +1,421 @@
+"""
+Decode a capture into one table per message type with a file per column
+
+python -m wizmsg.columnar traffic.wzcap --protocols messages --output tables
+"""
+
+import argparse
+import json
+import os
+import sys
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from itertools import repeat
+from pathlib import Path
+from typing import Any, BinaryIO, Iterable
+
+from loguru import logger
+
+from wizmsg import WIZ_TYPE_CONVERSION_TABLE, CaptureReader, ProtocolDefinition
+from wizmsg.capture import RECEIVED, SENT
+from wizmsg.network import Processor
+from wizmsg.network.codec import FIXED_WIDTH_FORMATS, decode_string
+from wizmsg.network.controls import Control
+
+SCHEMA_FILE = "schema.json"
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
+
+# column name: array typecode; recorded for every row
+CAPTURE_COLUMNS = {"_timestamp": "d", "_session_id": "H", "_direction": "B"}
+
+# numeric columns are written little endian whatever the host is
+_SWAP = sys.byteorder == "big"
+
+STRING = "string"
+
+
+def column_format(parameter_type: str) -> str:
+    """
+    Array typecode a parameter's column is stored as, or "string"
+    """
+    read_method = WIZ_TYPE_CONVERSION_TABLE.get(parameter_type)
+
+    if read_method in ("string", "wide_string"):
+        return STRING
+
+    fixed_format = FIXED_WIDTH_FORMATS.get(read_method)
+    if fixed_format is None:
+        raise ValueError(f"No column format for type {parameter_type}")
+
+    # array has no bool typecode
+    return "B" if fixed_format == "?" else fixed_format
+
+
+def _table_name(service_id: int, message_name: str) -> str:
+    return f"{service_id}-{message_name}"
+
+
+class _ChunkTable:
+    """
+    Rows of one message type decoded from one chunk
+    """
+
+    def __init__(self, formats: dict[str, str]):
+        self.formats = formats
+        self.rows = 0
+        # column: array, or list of encoded strings
+        self.columns: dict[str, Any] = {
+            name: [] if column_format == STRING else array(column_format)
+            for name, column_format in formats.items()
+        }
+
+    def append(self, values: Iterable[Any]):
+        """
+        values: one for each column in order
+        """
+        for column, value in zip(self.columns.values(), values):
+            if isinstance(value, str):
+                value = value.encode()
+
+            column.append(value)
+
+        self.rows += 1
+
+    def finish(self) -> dict[str, Any]:
+        """
+        Strings become (end offsets, joined data) so the chunk pickles compactly
+        """
+        finished = {}
+        for name, column in self.columns.items():
+            if self.formats[name] != STRING:
+                finished[name] = column
+                continue
+
+            ends = array("Q")
+            end = 0
+            for value in column:
+                end += len(value)
+                ends.append(end)
+
+            finished[name] = (ends, b"".join(column))
+
+        return finished
+
+
+# (service id, message name): (formats, rows, finished columns)
+_ChunkResult = dict[tuple[int, str], tuple[dict[str, str], int, dict[str, Any]]]
+
+
+def _decode_records(
+    processor: Processor,
+    capture_path: Path,
+    start: int,
+    end: int,
+    direction: int | None,
+) -> tuple[_ChunkResult, int]:
+    """
+    Returns the tables and the number of frames that failed to decode
+    """
+    tables: dict[tuple[int, str], _ChunkTable] = {}
+    errors = 0
+
+    with CaptureReader(capture_path) as capture:
+        for _, captured in capture.records(start, end):
+            if direction is not None and captured.direction != direction:
+                captured.raw.release()
+                continue
+
+            try:
+                frame = processor.process_frame(captured.raw, as_record=True)
+            except Exception:
+                errors += 1
+                continue
+            finally:
+                # strings are copied out so the capture can be closed
+                captured.raw.release()
+
+            if isinstance(frame, Control):
+                continue
+
+            key = (frame._service_id, frame._name)
+            table = tables.get(key)
+            if table is None:
+                formats = dict(CAPTURE_COLUMNS)
+                for name, parameter_type in frame._parameters:
+                    formats[name] = column_format(parameter_type)
+
+                table = tables[key] = _ChunkTable(formats)
+
+            table.append(
+                (captured.timestamp, captured.session_id, captured.direction, *frame)
+            )
+
+    return {
+        key: (table.formats, table.rows, table.finish())
+        for key, table in tables.items()
+    }, errors
+
+
+_worker_processor: Processor | None = None
+
+
+def _init_worker(protocol_definitions: list[ProtocolDefinition]):
+    global _worker_processor
+
+    _worker_processor = Processor()
+    for protocol_definition in protocol_definitions:
+        _worker_processor.add_protocol(protocol_definition)
+
+
+def _decode_chunk(
+    capture_path: Path, start: int, end: int, direction: int | None
+) -> tuple[_ChunkResult, int]:
+    return _decode_records(_worker_processor, capture_path, start, end, direction)
+
+
+class _TableWriter:
+    def __init__(self, directory: Path, service_id: int, message_name: str):
+        self.directory = directory
+        self.service_id = service_id
+        self.message_name = message_name
+
+        self.formats: dict[str, str] | None = None
+        self.rows = 0
+        # column: open files
+        self._files: dict[str, tuple[BinaryIO, ...]] = {}
+        # string column: bytes of data written so far
+        self._string_sizes: dict[str, int] = {}
+
+    def _open(self, formats: dict[str, str]):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.formats = formats
+
+        for name, column_format in formats.items():
+            if column_format == STRING:
+                self._files[name] = (
+                    open(self.directory / f"{name}.offsets", "wb"),
+                    open(self.directory / f"{name}.data", "wb"),
+                )
+                self._string_sizes[name] = 0
+            else:
+                self._files[name] = (open(self.directory / f"{name}.bin", "wb"),)
+
+    def write(self, formats: dict[str, str], rows: int, columns: dict[str, Any]):
+        if self.formats is None:
+            self._open(formats)
+
+        for name, column in columns.items():
+            files = self._files[name]
+
+            if self.formats[name] != STRING:
+                if _SWAP:
+                    column.byteswap()
+                column.tofile(files[0])
+                continue
+
+            ends, data = column
+            base = self._string_sizes[name]
+            if base:
+                ends = array("Q", (end + base for end in ends))
+            if _SWAP:
+                ends.byteswap()
+
+            ends.tofile(files[0])
+            files[1].write(data)
+            self._string_sizes[name] = base + len(data)
+
+        self.rows += rows
+
+    def close(self):
+        for files in self._files.values():
+            for fp in files:
+                fp.close()
+
+        if self.formats is not None:
+            (self.directory / SCHEMA_FILE).write_text(
+                json.dumps(
+                    {
+                        "service_id": self.service_id,
+                        "message": self.message_name,
+                        "rows": self.rows,
+                        "columns": self.formats,
+                    },
+                    indent=2,
+                )
+            )
+
+
+@dataclass
+class DecodeSummary:
+    # table name: rows
+    tables: dict[str, int] = field(default_factory=dict)
+    # frames that failed to decode
+    errors: int = 0
+
+
+def decode_capture(
+    capture_path: str | Path,
+    processor: Processor,
+    output_directory: str | Path,
+    *,
+    workers: int | None = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    direction: int | None = RECEIVED,
+) -> DecodeSummary:
+    """
+    Decode every message in a capture into output_directory/<service id>-<message name>/,
+    one file per column plus a schema.json; rows stay in capture order
+
+    numeric columns are little endian arrays of the typecode in the schema, string
+    columns are a .data file and a .offsets file of u8 end offsets into it
+
+    workers: decode chunks of the capture in a process pool of this size
+    direction: only decode frames going this way, None for both
+    """
+    if isinstance(capture_path, str):
+        capture_path = Path(capture_path)
+
+    if isinstance(output_directory, str):
+        output_directory = Path(output_directory)
+
+    with CaptureReader(capture_path) as capture:
+        chunks = capture.split(chunk_size)
+
+    starts = [start for start, _ in chunks]
+    ends = [end for _, end in chunks]
+
+    # table name: writer
+    writers: dict[str, _TableWriter] = {}
+    summary = DecodeSummary()
+
+    def _write(result: _ChunkResult):
+        for (service_id, message_name), (formats, rows, columns) in result.items():
+            table_name = _table_name(service_id, message_name)
+
+            writer = writers.get(table_name)
+            if writer is None:
+                writer = writers[table_name] = _TableWriter(
+                    output_directory / table_name, service_id, message_name
+                )
+
+            writer.write(formats, rows, columns)
+
+    try:
+        if workers is None:
+            for start, end in chunks:
+                result, errors = _decode_records(
+                    processor, capture_path, start, end, direction
+                )
+                _write(result)
+                summary.errors += errors
+
+        else:
+            # indexed protocols are loaded up front so every worker has them
+            for service_id in list(processor.protocol_index):
+                processor.get_protocol(service_id)
+
+            protocol_definitions = [
+                protocol.definition for protocol in processor.protocols.values()
+            ]
+
+            with ProcessPoolExecutor(
+                workers, initializer=_init_worker, initargs=(protocol_definitions,)
+            ) as executor:
+                for result, errors in executor.map(
+                    _decode_chunk,
+                    repeat(capture_path),
+                    starts,
+                    ends,
+                    repeat(direction),
+                ):
+                    _write(result)
+                    summary.errors += errors
+
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    summary.tables = {name: writer.rows for name, writer in sorted(writers.items())}
+    return summary
+
+
+def read_table(directory: str | Path) -> dict[str, Any]:
+    """
+    Loads a table written by decode_capture; column name: array or list of strings
+    """
+    if isinstance(directory, str):
+        directory = Path(directory)
+
+    schema = json.loads((directory / SCHEMA_FILE).read_text())
+
+    columns = {}
+    for name, column_format in schema["columns"].items():
+        if column_format != STRING:
+            column = array(column_format)
+            column.frombytes((directory / f"{name}.bin").read_bytes())
+            if _SWAP:
+                column.byteswap()
+
+            columns[name] = column
+            continue
+
+        ends = array("Q")
+        ends.frombytes((directory / f"{name}.offsets").read_bytes())
+        if _SWAP:
+            ends.byteswap()
+
+        data = memoryview((directory / f"{name}.data").read_bytes())
+
+        values = []
+        start = 0
+        for end in ends:
+            values.append(decode_string(data[start:end]))
+            start = end
+
+        columns[name] = values
+
+    return columns
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("capture", type=Path)
+    parser.add_argument("--protocols", type=Path, required=True)
+    parser.add_argument("--allowed-glob", default="*.xml")
+    parser.add_argument("--output", type=Path, required=True)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument(
+        "--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="bytes"
+    )
+    parser.add_argument(
+        "--direction",
+        choices=("received", "sent", "both"),
+        default="received",
+        help="from the server's side",
+    )
+    args = parser.parse_args()
+
+    processor = Processor()
+    processor.load_protocols_from_directory(
+        args.protocols, allowed_glob=args.allowed_glob
+    )
+
+    summary = decode_capture(
+        args.capture,
+        processor,
+        args.output,
+        workers=args.workers if args.workers > 1 else None,
+        chunk_size=args.chunk_size,
+        direction={"received": RECEIVED, "sent": SENT, "both": None}[args.direction],
+    )
+
+    for table_name, rows in summary.tables.items():
+        logger.info(f"{table_name}: {rows} rows")
+
+    if summary.errors:
+        logger.warning(f"{summary.errors} frames failed to decode")
+
+
+if __name__ == "__main__":
+    main()
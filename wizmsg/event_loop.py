@@ -0,0 +1,62 @@
+import asyncio
+import sys
+from typing import Any, Coroutine, TypeVar
+
+T = TypeVar("T")
+
+
+def uvloop_available() -> bool:
+    try:
+        import uvloop  # noqa: F401
+    except ImportError:
+        return False
+
+    return True
+
+
+def new_event_loop(*, use_uvloop: bool | None = None) -> asyncio.AbstractEventLoop:
+    """
+    use_uvloop: None uses uvloop if it's installed, True requires it and False
+    always uses the default asyncio loop
+    """
+    if use_uvloop is not False:
+        try:
+            import uvloop
+        except ImportError:
+            if use_uvloop:
+                raise RuntimeError("uvloop was requested but isn't installed")
+        else:
+            return uvloop.new_event_loop()
+
+    return asyncio.new_event_loop()
+
+
+def run(main: Coroutine[Any, Any, T], *, use_uvloop: bool | None = None) -> T:
+    """
+    asyncio.run on the loop from new_event_loop
+
+    wizmsg.run(server.run())
+    """
+    if sys.version_info >= (3, 11):
+        with asyncio.Runner(
+            loop_factory=lambda: new_event_loop(use_uvloop=use_uvloop)
+        ) as runner:
+            return runner.run(main)
+
+    # TODO: 3.11 drop this and always use asyncio.Runner
+    loop = new_event_loop(use_uvloop=use_uvloop)
+    try:
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(main)
+    finally:
+        try:
+            pending = asyncio.all_tasks(loop)
+            for task in pending:
+                task.cancel()
+
+            loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.run_until_complete(loop.shutdown_default_executor())
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
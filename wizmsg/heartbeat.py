@@ -0,0 +1,154 @@
+import asyncio
+import math
+from typing import TYPE_CHECKING
+
+from loguru import logger
+
+if TYPE_CHECKING:
+    from wizmsg import Session
+
+
+# https://kronos-project.github.io/grimoire/internals/protocol/sessions.html#heartbeat
+class HeartbeatScheduler:
+    """
+    Server wide keep alive timer; every session sits in the bucket for the tick
+    its next deadline falls in and a single timer callback works through the due
+    buckets each tick, so there's one timer no matter how many sessions there are
+
+    Sessions that haven't sent anything for interval seconds are sent a
+    KeepAlive and closed if nothing, a KeepAliveResponse or any other frame,
+    arrives within timeout seconds; busy sessions are never pinged
+    """
+
+    def __init__(self, interval: float = 60, timeout: float = 60, *, tick: float = 1):
+        self.interval = interval
+        self.timeout = timeout
+        self.tick = tick
+
+        # tick number: sessions due in that tick
+        self._buckets: dict[int, set["Session"]] = {}
+        # session: tick number it's bucketed under
+        self._scheduled: dict["Session", int] = {}
+        # session: when the unanswered keep alive was sent
+        self._awaiting: dict["Session", float] = {}
+
+        self._next_tick: int | None = None
+        self._timer: asyncio.TimerHandle | None = None
+
+    def __len__(self) -> int:
+        return len(self._scheduled)
+
+    def _tick_of(self, when: float) -> int:
+        return math.ceil(when / self.tick)
+
+    def _schedule(self, session: "Session", deadline: float):
+        tick = self._tick_of(deadline)
+
+        # buckets before the next tick have already been processed
+        if self._next_tick is not None and tick < self._next_tick:
+            tick = self._next_tick
+
+        current = self._scheduled.get(session)
+        if current == tick:
+            return
+
+        if current is not None:
+            self._buckets[current].discard(session)
+
+        self._buckets.setdefault(tick, set()).add(session)
+        self._scheduled[session] = tick
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+
+        self._next_tick = math.floor(loop.time() / self.tick)
+        self._timer = loop.call_later(self.tick, self._on_tick)
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def add(self, session: "Session"):
+        now = asyncio.get_running_loop().time()
+
+        session.last_seen = now
+        self._schedule(session, now + self.interval)
+
+    def remove(self, session: "Session"):
+        tick = self._scheduled.pop(session, None)
+        if tick is not None:
+            self._buckets[tick].discard(session)
+
+        self._awaiting.pop(session, None)
+
+    def touch(self, session: "Session"):
+        """
+        Record that a frame was received from session
+        """
+        session.last_seen = asyncio.get_running_loop().time()
+
+    def response_received(self, session: "Session"):
+        sent_at = self._awaiting.pop(session, None)
+        if sent_at is not None and session in self._scheduled:
+            self._schedule(session, sent_at + self.interval)
+
+    def _on_tick(self):
+        # a plain timer callback; no task or coroutine to resume every tick
+        loop = asyncio.get_running_loop()
+
+        try:
+            self.process(loop.time())
+        except Exception:
+            logger.exception("heartbeat tick failed")
+        finally:
+            self._timer = loop.call_later(self.tick, self._on_tick)
+
+    def process(self, now: float):
+        """
+        Handle every session whose deadline has passed
+        """
+        # deadlines round up to their tick so this never fires early
+        current_tick = math.floor(now / self.tick)
+
+        due: list["Session"] = []
+        while self._next_tick <= current_tick:
+            bucket = self._buckets.pop(self._next_tick, None)
+            if bucket:
+                due += bucket
+
+            self._next_tick += 1
+
+        for session in due:
+            del self._scheduled[session]
+
+            if not session.alive:
+                self._awaiting.pop(session, None)
+                continue
+
+            sent_at = self._awaiting.get(session)
+
+            # heard from since the last keep alive, or since it was last due
+            if session.last_seen > (
+                now - self.interval if sent_at is None else sent_at
+            ):
+                self._awaiting.pop(session, None)
+                self._schedule(session, session.last_seen + self.interval)
+                continue
+
+            if sent_at is not None:
+                logger.info(f"closing {session}: no keep alive response")
+                self.remove(session)
+                session.close()
+                continue
+
+            try:
+                session.send(session.make_keep_alive())
+            except Exception:
+                logger.exception(f"closing {session}: failed to send keep alive")
+                self.remove(session)
+                session.close()
+                continue
+
+            self._awaiting[session] = now
+            self._schedule(session, now + self.timeout)
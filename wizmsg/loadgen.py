@@ -0,0 +1,490 @@
+"""
+Load a wizmsg server with client sessions sending a mix of messages
+
+python -m wizmsg.loadgen --protocols messages --local --clients 200 --duration 10
+python -m wizmsg.loadgen 10.0.0.5 12000 --protocols messages --rate 50000 --message MSG_PING=3 --message 5:MSG_CHAT
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+import socket
+import statistics
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from time import perf_counter
+
+from loguru import logger
+
+from wizmsg import WIZ_TYPE_CONVERSION_TABLE, Client, ClientPool, MessageDefinition
+from wizmsg import event_loop
+from wizmsg.network import MessageData, MessageRecord, Processor
+from wizmsg.network.codec import FIXED_WIDTH_FORMATS
+from wizmsg.server import Server
+
+
+def build_message(
+    service_id: int, definition: MessageDefinition, *, string_size: int = 16
+) -> MessageData:
+    """
+    A message with placeholder values for every parameter
+    """
+    parameters = {}
+    for parameter in definition.parameters.values():
+        read_method = WIZ_TYPE_CONVERSION_TABLE.get(parameter.type)
+
+        if read_method in ("string", "wide_string"):
+            parameters[parameter.name] = "x" * string_size
+        elif read_method in ("float", "double"):
+            parameters[parameter.name] = 1.5
+        elif read_method == "bool":
+            parameters[parameter.name] = True
+        elif read_method in FIXED_WIDTH_FORMATS:
+            parameters[parameter.name] = 1
+        else:
+            raise ValueError(
+                f"Can't build {definition.name}: unsupported type {parameter.type}"
+            )
+
+    return MessageData(service_id, definition.order, definition.name, parameters)
+
+
+@dataclass
+class MessageStats:
+    sent: int = 0
+    bytes_sent: int = 0
+    received: int = 0
+    # seconds from sending to the matching reply
+    latencies: list[float] = field(default_factory=list)
+
+    def percentile(self, fraction: float) -> float | None:
+        if not self.latencies:
+            return None
+
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+@dataclass
+class LoadReport:
+    clients: int
+    seconds: float
+    bytes_received: int
+    # (service id, message name): stats
+    messages: dict[tuple[int, str], MessageStats]
+
+    @property
+    def sent(self) -> int:
+        return sum(stats.sent for stats in self.messages.values())
+
+    @property
+    def received(self) -> int:
+        return sum(stats.received for stats in self.messages.values())
+
+    @property
+    def bytes_sent(self) -> int:
+        return sum(stats.bytes_sent for stats in self.messages.values())
+
+    def summary(self) -> dict:
+        """
+        Plain totals and per message rates and latency percentiles
+        """
+        messages = []
+        for (service_id, name), stats in sorted(self.messages.items()):
+            messages.append(
+                {
+                    "service_id": service_id,
+                    "message": name,
+                    "sent": stats.sent,
+                    "received": stats.received,
+                    "frames_per_second": stats.sent / self.seconds,
+                    "bytes_per_second": stats.bytes_sent / self.seconds,
+                    "latency_p50": stats.percentile(0.5),
+                    "latency_p99": stats.percentile(0.99),
+                    "latency_p999": stats.percentile(0.999),
+                    "latency_mean": (
+                        statistics.fmean(stats.latencies) if stats.latencies else None
+                    ),
+                }
+            )
+
+        return {
+            "clients": self.clients,
+            "seconds": self.seconds,
+            "sent": self.sent,
+            "received": self.received,
+            "frames_per_second": self.sent / self.seconds,
+            "received_frames_per_second": self.received / self.seconds,
+            "bytes_per_second": self.bytes_sent / self.seconds,
+            "received_bytes_per_second": self.bytes_received / self.seconds,
+            "messages": messages,
+        }
+
+
+class _LoadClient(Client):
+    """
+    Pairs each reply with the oldest unanswered message this client sent
+    """
+
+    __slots__ = ("stats", "pending", "bytes_received", "ready")
+
+    def __init__(
+        self,
+        processor: Processor,
+        *,
+        stats: dict[tuple[int, str], MessageStats],
+        ready: asyncio.Event,
+        **kwargs,
+    ):
+        super().__init__(processor, **kwargs)
+
+        self.stats = stats
+        self.ready = ready
+        # (send time, (service id, message name)) waiting for a reply
+        self.pending: deque[tuple[float, tuple[int, str]]] = deque()
+        self.bytes_received = 0
+
+    def data_received(self, data: bytes):
+        self.bytes_received += len(data)
+        super().data_received(data)
+
+    def handle_message(self, message: MessageData | MessageRecord):
+        now = perf_counter()
+
+        if self.pending:
+            sent_at, key = self.pending.popleft()
+            stats = self.stats[key]
+            stats.received += 1
+            stats.latencies.append(now - sent_at)
+
+        self.ready.set()
+
+
+async def run_load(
+    host: str,
+    port: int,
+    processor: Processor,
+    messages: list[tuple[MessageData, float]],
+    *,
+    clients: int = 100,
+    duration: float = 10,
+    rate: float | None = None,
+    window: int = 8,
+    drain_timeout: float = 2,
+) -> LoadReport:
+    """
+    Send messages drawn from the weighted mix from every client for duration
+    seconds
+
+    rate: total frames per second across all clients; None sends as fast as
+    replies come back, keeping at most window unanswered frames per client
+
+    latency assumes the server answers every message in order, like an echo
+    server; without replies only send rates are meaningful (use rate then)
+    """
+    loop = asyncio.get_running_loop()
+
+    # encode every message once
+    prepared = [
+        ((message.service_id, message.name), processor.prepare_frame(message))
+        for message, _ in messages
+    ]
+    stats = {key: MessageStats() for key, _ in prepared}
+
+    # a shuffled sequence with the mix's proportions, cycled through when sending
+    sequence = random.Random(0).choices(
+        prepared, weights=[weight for _, weight in messages], k=1024
+    )
+
+    ready = asyncio.Event()
+    pool = ClientPool(
+        host,
+        port,
+        processor=processor,
+        client_class=_LoadClient,
+        stats=stats,
+        ready=ready,
+    )
+
+    def _send(client: _LoadClient, index: int):
+        key, raw = sequence[index % len(sequence)]
+        client.pending.append((perf_counter(), key))
+        client.send_raw(raw)
+
+        message_stats = stats[key]
+        message_stats.sent += 1
+        message_stats.bytes_sent += len(raw)
+
+    async with pool:
+        await pool.connect(clients)
+        load_clients: list[_LoadClient] = pool.clients
+
+        sent = 0
+        start = loop.time()
+        deadline = start + duration
+
+        while (now := loop.time()) < deadline:
+            live = [client for client in load_clients if client.alive]
+            if not live:
+                raise ConnectionError("every client was disconnected")
+
+            if rate is not None:
+                due = int((now - start) * rate) - sent
+                for index in range(due):
+                    client = live[(sent + index) % len(live)]
+                    if not client.writing_paused:
+                        _send(client, sent + index)
+
+                sent += due
+                await asyncio.sleep(0.005)
+                continue
+
+            for client in live:
+                while len(client.pending) < window and not client.writing_paused:
+                    _send(client, sent)
+                    sent += 1
+
+            ready.clear()
+            try:
+                await asyncio.wait_for(ready.wait(), deadline - now)
+            except asyncio.TimeoutError:
+                pass
+
+        seconds = loop.time() - start
+
+        # give the last replies a chance to arrive
+        drain_deadline = loop.time() + drain_timeout
+        while any(client.pending for client in load_clients if client.alive):
+            if loop.time() >= drain_deadline:
+                break
+
+            await asyncio.sleep(0.01)
+
+        bytes_received = sum(client.bytes_received for client in load_clients)
+
+    return LoadReport(clients, seconds, bytes_received, stats)
+
+
+class _EchoServer(Server):
+    def handle_message(self, session, message):
+        session.send(message)
+
+
+def _run_local_server(port: int, protocol_directory: Path, allowed_glob: str):
+    # console noise from the server would interleave with the report
+    logger.remove()
+
+    server = _EchoServer("127.0.0.1", port)
+    server.message_processor.load_protocols_from_directory(
+        protocol_directory, allowed_glob=allowed_glob
+    )
+    event_loop.run(server.run())
+
+
+def _free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+async def _wait_listening(host: str, port: int, timeout: float = 10):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+
+    while True:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+        except OSError:
+            if loop.time() >= deadline:
+                raise
+
+            await asyncio.sleep(0.05)
+        else:
+            writer.close()
+            return
+
+
+def _format_seconds(seconds: float | None) -> str:
+    if seconds is None:
+        return "-"
+
+    return f"{seconds * 1000:.3f}ms"
+
+
+def print_report(report: LoadReport):
+    summary = report.summary()
+
+    print(
+        f"{summary['clients']} clients for {summary['seconds']:.1f}s: "
+        f"sent {summary['frames_per_second']:,.0f} frames/s "
+        f"{summary['bytes_per_second'] / 1e6:,.2f} MB/s, "
+        f"received {summary['received_frames_per_second']:,.0f} frames/s "
+        f"{summary['received_bytes_per_second'] / 1e6:,.2f} MB/s"
+    )
+
+    print(
+        f"{'service':>7} {'message':<32} {'frames/s':>12} {'MB/s':>8} "
+        f"{'p50':>10} {'p99':>10} {'p999':>10}"
+    )
+    for message in summary["messages"]:
+        print(
+            f"{message['service_id']:>7} {message['message']:<32} "
+            f"{message['frames_per_second']:>12,.0f} "
+            f"{message['bytes_per_second'] / 1e6:>8,.2f} "
+            f"{_format_seconds(message['latency_p50']):>10} "
+            f"{_format_seconds(message['latency_p99']):>10} "
+            f"{_format_seconds(message['latency_p999']):>10}"
+        )
+
+
+def message_mix(
+    processor: Processor, requested: list[str] | None = None, string_size: int = 16
+) -> list[tuple[MessageData, float]]:
+    """
+    (message, weight) pairs from NAME or NAME=WEIGHT entries, or every loaded
+    message that can be built when requested is None; a name more than one
+    service defines needs its service id, i.e. 5:MSG_CHAT=2
+    """
+    # indexed protocols are loaded so their messages can be picked
+    for service_id in list(processor.protocol_index):
+        processor.get_protocol(service_id)
+
+    # (service id, message name): definition
+    definitions = {}
+    for service_id, protocol in processor.protocols.items():
+        for definition in protocol.definition.messages.values():
+            definitions[service_id, definition.name] = definition
+
+    if requested is None:
+        mix = []
+        for (service_id, _), definition in sorted(definitions.items()):
+            try:
+                message = build_message(service_id, definition, string_size=string_size)
+            except ValueError as exc:
+                logger.warning(f"skipping: {exc}")
+                continue
+
+            mix.append((message, 1.0))
+
+        return mix
+
+    mix = []
+    for entry in requested:
+        name, _, weight = entry.partition("=")
+        service, _, name = name.rpartition(":")
+
+        keys = [
+            key
+            for key in definitions
+            if key[1] == name and (not service or key[0] == int(service))
+        ]
+        if not keys:
+            raise ValueError(f"No loaded protocol defines {entry}")
+
+        if len(keys) > 1:
+            services = ", ".join(str(service_id) for service_id, _ in sorted(keys))
+            raise ValueError(
+                f"Services {services} all define {name}; pass SERVICE_ID:{name}"
+            )
+
+        ((service_id, _),) = keys
+        definition = definitions[service_id, name]
+        mix.append(
+            (
+                build_message(service_id, definition, string_size=string_size),
+                float(weight) if weight else 1.0,
+            )
+        )
+
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("host", nargs="?", default="127.0.0.1")
+    parser.add_argument("port", nargs="?", type=int)
+    parser.add_argument("--protocols", type=Path, required=True)
+    parser.add_argument("--allowed-glob", default="*.xml")
+    parser.add_argument(
+        "--local",
+        action="store_true",
+        help="start an echo server on loopback in another process and load that",
+    )
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=10, help="seconds")
+    parser.add_argument(
+        "--rate", type=float, help="total frames/s; default is as fast as replies"
+    )
+    parser.add_argument(
+        "--window", type=int, default=8, help="unanswered frames per client"
+    )
+    parser.add_argument(
+        "--message",
+        action="append",
+        help="[SERVICE_ID:]NAME[=WEIGHT]; repeat for a mix, default is every message",
+    )
+    parser.add_argument("--string-size", type=int, default=16)
+    parser.add_argument("--output", type=Path, help="write the report as json here")
+    parser.add_argument("--uvloop", action=argparse.BooleanOptionalAction)
+    args = parser.parse_args()
+
+    if not args.local and args.port is None:
+        parser.error("a port is needed unless --local is used")
+
+    processor = Processor()
+    processor.load_protocols_from_directory(
+        args.protocols, allowed_glob=args.allowed_glob
+    )
+
+    try:
+        mix = message_mix(processor, args.message, args.string_size)
+    except ValueError as exc:
+        parser.error(str(exc))
+
+    if not mix:
+        parser.error("no messages to send")
+
+    server_process = None
+    host, port = args.host, args.port
+    if args.local:
+        host, port = "127.0.0.1", _free_port()
+        server_process = multiprocessing.Process(
+            target=_run_local_server,
+            args=(port, args.protocols, args.allowed_glob),
+            daemon=True,
+        )
+        server_process.start()
+
+    async def _run() -> LoadReport:
+        if server_process is not None:
+            await _wait_listening(host, port)
+
+        return await run_load(
+            host,
+            port,
+            processor,
+            mix,
+            clients=args.clients,
+            duration=args.duration,
+            rate=args.rate,
+            window=args.window,
+        )
+
+    try:
+        report = event_loop.run(_run(), use_uvloop=args.uvloop)
+    finally:
+        if server_process is not None:
+            server_process.terminate()
+            server_process.join()
+
+    print_report(report)
+
+    if args.output is not None:
+        args.output.write_text(json.dumps(report.summary(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+import asyncio
+from bisect import bisect_left
+from collections import Counter
+from typing import Callable
+
+from loguru import logger
+
+# seconds; upper bounds of the latency histogram buckets
+DEFAULT_LATENCY_BUCKETS = (
+    0.000_005,
+    0.000_01,
+    0.000_025,
+    0.000_05,
+    0.000_1,
+    0.000_25,
+    0.000_5,
+    0.001,
+    0.002_5,
+    0.005,
+    0.01,
+    0.1,
+)
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        # one extra for values over the last bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self) -> list[tuple[float, int]]:
+        """
+        (upper bound, observations at or under it) pairs ending with +Inf
+        """
+        pairs = []
+        total = 0
+        for bound, count in zip((*self.buckets, float("inf")), self.counts):
+            total += count
+            pairs.append((bound, total))
+
+        return pairs
+
+
+class Metrics:
+    """
+    Counters and latency histograms for a processor and server; pass one to
+    Processor or Server to turn collection on, nothing is recorded without one
+
+    metrics = Metrics()
+    server = Server("0.0.0.0", 12000, metrics=metrics)
+    await server.serve_metrics(port=9100)
+    """
+
+    def __init__(self, *, latency_buckets: tuple[float, ...] = DEFAULT_LATENCY_BUCKETS):
+        self.latency_buckets = latency_buckets
+
+        # (service id, message name): count
+        self.frames_received: Counter[tuple[int, str]] = Counter()
+        self.bytes_received: Counter[tuple[int, str]] = Counter()
+        self.frames_sent: Counter[tuple[int, str]] = Counter()
+        self.bytes_sent: Counter[tuple[int, str]] = Counter()
+
+        # opcode: count
+        self.controls_received: Counter[int] = Counter()
+        self.controls_sent: Counter[int] = Counter()
+
+        # (decode or encode, exception name): count
+        self.errors: Counter[tuple[str, str]] = Counter()
+
+        # (service id, message name): seconds
+        self.decode_seconds: dict[tuple[int, str], Histogram] = {}
+        self.encode_seconds: dict[tuple[int, str], Histogram] = {}
+
+        # metric name: callback returning its current value
+        self.gauges: dict[str, Callable[[], float]] = {}
+
+    def _observe(
+        self,
+        histograms: dict[tuple[int, str], Histogram],
+        key: tuple[int, str],
+        seconds: float,
+    ):
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram(self.latency_buckets)
+
+        histogram.observe(seconds)
+
+    def message_received(self, service_id: int, name: str, size: int, seconds: float):
+        key = (service_id, name)
+        self.frames_received[key] += 1
+        self.bytes_received[key] += size
+        self._observe(self.decode_seconds, key, seconds)
+
+    def message_sent(
+        self, service_id: int, name: str, size: int, seconds: float, copies: int = 1
+    ):
+        """
+        copies: how many times the encoded frame was written, i.e. by a broadcast
+        """
+        key = (service_id, name)
+        self.frames_sent[key] += copies
+        self.bytes_sent[key] += size * copies
+        self._observe(self.encode_seconds, key, seconds)
+
+    def control_received(self, opcode: int):
+        self.controls_received[opcode] += 1
+
+    def control_sent(self, opcode: int, copies: int = 1):
+        self.controls_sent[opcode] += copies
+
+    def error(self, stage: str, exc: BaseException):
+        """
+        stage: "decode" or "encode"
+        """
+        self.errors[stage, type(exc).__name__] += 1
+
+    def gauge(self, name: str, callback: Callable[[], float]):
+        """
+        Export callback() as name every time metrics are read
+
+        metrics.gauge("wizmsg_sessions", lambda: len(server.sessions))
+        """
+        self.gauges[name] = callback
+
+    def reset(self):
+        for counter in (
+            self.frames_received,
+            self.bytes_received,
+            self.frames_sent,
+            self.bytes_sent,
+            self.controls_received,
+            self.controls_sent,
+            self.errors,
+        ):
+            counter.clear()
+
+        self.decode_seconds.clear()
+        self.encode_seconds.clear()
+
+    def snapshot(self) -> dict:
+        """
+        Plain copy of every metric, safe to json encode
+        """
+
+        def _messages(counter: Counter[tuple[int, str]]) -> list[dict]:
+            return [
+                {"service_id": service_id, "message": name, "value": value}
+                for (service_id, name), value in sorted(counter.items())
+            ]
+
+        def _histograms(histograms: dict[tuple[int, str], Histogram]) -> list[dict]:
+            return [
+                {
+                    "service_id": service_id,
+                    "message": name,
+                    "count": histogram.count,
+                    "sum": histogram.sum,
+                    "buckets": [
+                        [bound, count] for bound, count in histogram.cumulative()[:-1]
+                    ],
+                }
+                for (service_id, name), histogram in sorted(histograms.items())
+            ]
+
+        return {
+            "frames_received": _messages(self.frames_received),
+            "bytes_received": _messages(self.bytes_received),
+            "frames_sent": _messages(self.frames_sent),
+            "bytes_sent": _messages(self.bytes_sent),
+            "controls_received": dict(sorted(self.controls_received.items())),
+            "controls_sent": dict(sorted(self.controls_sent.items())),
+            "errors": [
+                {"stage": stage, "error": error, "value": value}
+                for (stage, error), value in sorted(self.errors.items())
+            ],
+            "decode_seconds": _histograms(self.decode_seconds),
+            "encode_seconds": _histograms(self.encode_seconds),
+            "gauges": {name: callback() for name, callback in self.gauges.items()},
+        }
+
+    def to_prometheus(self) -> str:
+        """
+        Every metric in the prometheus text exposition format
+        """
+        lines: list[str] = []
+
+        def _labels(**labels) -> str:
+            escaped = ",".join(
+                f'{key}="{_escape(str(value))}"' for key, value in labels.items()
+            )
+            return f"{{{escaped}}}" if escaped else ""
+
+        def _counter(name: str, help_text: str, samples: dict[str, int]):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in samples.items():
+                lines.append(f"{name}{labels} {value}")
+
+        def _messages(counter: Counter[tuple[int, str]]) -> dict[str, int]:
+            return {
+                _labels(service_id=service_id, message=name): value
+                for (service_id, name), value in sorted(counter.items())
+            }
+
+        def _histogram(
+            name: str,
+            help_text: str,
+            histograms: dict[tuple[int, str], Histogram],
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for (service_id, message), histogram in sorted(histograms.items()):
+                for bound, count in histogram.cumulative():
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    labels = _labels(service_id=service_id, message=message, le=le)
+                    lines.append(f"{name}_bucket{labels} {count}")
+
+                labels = _labels(service_id=service_id, message=message)
+                lines.append(f"{name}_sum{labels} {histogram.sum!r}")
+                lines.append(f"{name}_count{labels} {histogram.count}")
+
+        _counter(
+            "wizmsg_frames_received_total",
+            "Message frames decoded",
+            _messages(self.frames_received),
+        )
+        _counter(
+            "wizmsg_bytes_received_total",
+            "Bytes of message frames decoded",
+            _messages(self.bytes_received),
+        )
+        _counter(
+            "wizmsg_frames_sent_total",
+            "Message frames encoded",
+            _messages(self.frames_sent),
+        )
+        _counter(
+            "wizmsg_bytes_sent_total",
+            "Bytes of message frames encoded",
+            _messages(self.bytes_sent),
+        )
+        _counter(
+            "wizmsg_controls_received_total",
+            "Control frames decoded",
+            {
+                _labels(opcode=opcode): value
+                for opcode, value in sorted(self.controls_received.items())
+            },
+        )
+        _counter(
+            "wizmsg_controls_sent_total",
+            "Control frames encoded",
+            {
+                _labels(opcode=opcode): value
+                for opcode, value in sorted(self.controls_sent.items())
+            },
+        )
+        _counter(
+            "wizmsg_errors_total",
+            "Frames that failed to decode or encode",
+            {
+                _labels(stage=stage, error=error): value
+                for (stage, error), value in sorted(self.errors.items())
+            },
+        )
+        _histogram(
+            "wizmsg_decode_seconds",
+            "Time spent decoding message frames",
+            self.decode_seconds,
+        )
+        _histogram(
+            "wizmsg_encode_seconds",
+            "Time spent encoding message frames",
+            self.encode_seconds,
+        )
+
+        for name, callback in self.gauges.items():
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {callback()!r}")
+
+        return "\n".join(lines) + "\n"
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 9100) -> asyncio.Server:
+        """
+        Serve to_prometheus over http on every path; close the returned server
+        to stop
+        """
+        return await asyncio.start_server(self._handle_scrape, host, port)
+
+    async def _handle_scrape(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        try:
+            # only the request line and headers matter; scrapes have no body
+            await reader.readuntil(b"\r\n\r\n")
+
+            body = self.to_prometheus().encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                + f"Content-Length: {len(body)}\r\n".encode()
+                + b"Connection: close\r\n\r\n"
+                + body
+            )
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        except Exception:
+            logger.exception("failed to serve metrics")
+        finally:
+            writer.close()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -1,2 +1,5 @@
+from .framing import FrameDecoder, frame_length
+from .handlers import HandlerRegistry, OffloadedHandler, dispatch_key
 from .processor import Processor
-from .protocol import Message, MessageData, Protocol
+from .protocol import LazyParameters, Message, MessageData, MessageRecord, Protocol
+from .trace import HexDumpHook, TraceHook
@@ -0,0 +1,285 @@
+import struct
+from typing import TYPE_CHECKING, Any, Iterable, Mapping, Sequence
+
+from loguru import logger
+
+from wizmsg import WIZ_TYPE_CONVERSION_TABLE
+
+if TYPE_CHECKING:
+    from wizmsg import ByteInterface, ByteView, MessageDefinitionParameter
+
+
+# read method: struct format
+FIXED_WIDTH_FORMATS = {
+    "bool": "?",
+    "signed1": "b",
+    "unsigned1": "B",
+    "signed2": "h",
+    "unsigned2": "H",
+    "signed4": "i",
+    "unsigned4": "I",
+    "signed8": "q",
+    "unsigned8": "Q",
+    "float": "f",
+    "double": "d",
+}
+
+_STRING_LENGTH = struct.Struct("<H")
+
+# step kinds
+_FIXED = 0
+_STRING = 1
+_WIDE_STRING = 2
+_UNSUPPORTED = 3
+
+
+def decode_string(value: bytes | memoryview) -> str | bytes:
+    try:
+        return str(value, "utf-8")
+    except UnicodeDecodeError:
+        # TODO: return this as byte or something
+        logger.warning("ignoring string decoding failure; likely class data")
+        return bytes(value)
+
+
+class MessageCodec:
+    """
+    Message parameters compiled into steps; runs of consecutive fixed width
+    parameters are read and written with a single precompiled struct
+    """
+
+    def __init__(self, parameters: Iterable["MessageDefinitionParameter"]):
+        parameters = list(parameters)
+
+        self.names: tuple[str, ...] = tuple(parameter.name for parameter in parameters)
+
+        # (kind, struct or type name, parameter names)
+        steps: list[tuple[int, Any, tuple[str, ...]]] = []
+
+        run_format = ""
+        run_names: list[str] = []
+
+        def _end_run():
+            nonlocal run_format, run_names
+            if run_names:
+                steps.append(
+                    (_FIXED, struct.Struct("<" + run_format), tuple(run_names))
+                )
+                run_format = ""
+                run_names = []
+
+        for parameter in parameters:
+            read_method = WIZ_TYPE_CONVERSION_TABLE.get(parameter.type)
+            fixed_format = FIXED_WIDTH_FORMATS.get(read_method)
+
+            if fixed_format is not None:
+                run_format += fixed_format
+                run_names.append(parameter.name)
+                continue
+
+            _end_run()
+
+            if read_method == "string":
+                steps.append((_STRING, None, (parameter.name,)))
+            elif read_method == "wide_string":
+                steps.append((_WIDE_STRING, None, (parameter.name,)))
+            else:
+                # raised on use so one bad message doesn't prevent the protocol loading
+                steps.append((_UNSUPPORTED, parameter.type, (parameter.name,)))
+
+        _end_run()
+
+        self.steps = tuple(steps)
+
+        # param name: (step index, offset in step, single field struct for fixed width)
+        self.fields: dict[str, tuple[int, int, struct.Struct | None]] = {}
+        for step_index, (kind, layout, names) in enumerate(self.steps):
+            if kind != _FIXED:
+                self.fields[names[0]] = (step_index, 0, None)
+                continue
+
+            inner_offset = 0
+            for name, fixed_format in zip(names, layout.format[1:]):
+                field_layout = struct.Struct("<" + fixed_format)
+                self.fields[name] = (step_index, inner_offset, field_layout)
+                inner_offset += field_layout.size
+
+    def decode(self, data: "ByteInterface | ByteView") -> list[Any]:
+        """
+        Returns parameter values in definition order
+        """
+        values = []
+        for kind, layout, _ in self.steps:
+            if kind == _FIXED:
+                values += data.read_struct(layout)
+            elif kind == _STRING:
+                values.append(decode_string(data.string()))
+            elif kind == _WIDE_STRING:
+                values.append(data.wide_string())
+            else:
+                raise RuntimeError(f"Missing read method for type {layout}")
+
+        return values
+
+    def encode(self, data: "ByteInterface", parameters: Mapping[str, Any]) -> int:
+        """
+        returns the number of bytes written
+        """
+        if len(parameters) > len(self.names):
+            unexpected = set(parameters).difference(self.names)
+            raise ValueError(f"Unexpected parameters {unexpected}")
+
+        written = 0
+        try:
+            for kind, layout, names in self.steps:
+                if kind == _FIXED:
+                    written += data.write(
+                        layout.pack(*[parameters[name] for name in names])
+                    )
+                elif kind == _STRING:
+                    value = parameters[names[0]]
+                    if isinstance(value, str):
+                        value = value.encode()
+
+                    written += data.write_string(value)
+                elif kind == _WIDE_STRING:
+                    written += data.write_wide_string(parameters[names[0]])
+                else:
+                    raise RuntimeError(f"Missing write method for type {layout}")
+        except KeyError as exc:
+            raise ValueError(f"Missing parameter {exc.args[0]}") from None
+
+        return written
+
+    def encode_pieces(self, parameters: Mapping[str, Any]) -> tuple[int, list[Any]]:
+        """
+        Returns the encoded size and the pieces to pass to pack_pieces_into;
+        strings are encoded here so the size is known before anything is written
+        """
+        if len(parameters) > len(self.names):
+            unexpected = set(parameters).difference(self.names)
+            raise ValueError(f"Unexpected parameters {unexpected}")
+
+        try:
+            values = [parameters[name] for name in self.names]
+        except KeyError as exc:
+            raise ValueError(f"Missing parameter {exc.args[0]}") from None
+
+        return self.encode_values(values)
+
+    def encode_values(self, values: Sequence[Any]) -> tuple[int, list[Any]]:
+        """
+        encode_pieces for parameter values already in definition order
+        """
+        if len(values) != len(self.names):
+            raise ValueError(f"Expected {len(self.names)} values, got {len(values)}")
+
+        size = 0
+        pieces = []
+        index = 0
+        for kind, layout, names in self.steps:
+            if kind == _FIXED:
+                next_index = index + len(names)
+                pieces.append(values[index:next_index])
+                index = next_index
+                size += layout.size
+                continue
+
+            value = values[index]
+            index += 1
+
+            if kind == _STRING:
+                if isinstance(value, str):
+                    value = value.encode()
+            elif kind == _WIDE_STRING:
+                value = value.encode("utf-16-le")
+            else:
+                raise RuntimeError(f"Missing write method for type {layout}")
+
+            pieces.append(value)
+            size += _STRING_LENGTH.size + len(value)
+
+        return size, pieces
+
+    def pack_pieces_into(self, buffer: bytearray, offset: int, pieces: list[Any]):
+        """
+        Writes pieces from encode_pieces; buffer must already have room for them
+        """
+        for (kind, layout, _), piece in zip(self.steps, pieces):
+            if kind == _FIXED:
+                layout.pack_into(buffer, offset, *piece)
+                offset += layout.size
+                continue
+
+            length = len(piece)
+            # wide string lengths are in code units
+            _STRING_LENGTH.pack_into(
+                buffer, offset, length if kind == _STRING else length // 2
+            )
+            offset += _STRING_LENGTH.size
+
+            buffer[offset : offset + length] = piece
+            offset += length
+
+    def skip_step(self, view: memoryview, offset: int, step_index: int) -> int:
+        """
+        Returns the offset just past the step starting at offset
+        """
+        kind, layout, _ = self.steps[step_index]
+
+        if kind == _FIXED:
+            return offset + layout.size
+
+        elif kind == _STRING:
+            (length,) = _STRING_LENGTH.unpack_from(view, offset)
+            return offset + _STRING_LENGTH.size + length
+
+        elif kind == _WIDE_STRING:
+            (length,) = _STRING_LENGTH.unpack_from(view, offset)
+            return offset + _STRING_LENGTH.size + length * 2
+
+        raise RuntimeError(f"Missing read method for type {layout}")
+
+    def field_spans(self, view: memoryview) -> list[tuple[str, int, int]]:
+        """
+        (name, start, end) of each parameter's bytes in view, in definition order
+        """
+        spans = []
+        offset = 0
+        for step_index, (kind, _, names) in enumerate(self.steps):
+            end = self.skip_step(view, offset, step_index)
+
+            if kind == _FIXED:
+                for name in names:
+                    _, inner_offset, field_layout = self.fields[name]
+                    start = offset + inner_offset
+                    spans.append((name, start, start + field_layout.size))
+            else:
+                spans.append((names[0], offset, end))
+
+            offset = end
+
+        return spans
+
+    def decode_field(self, view: memoryview, step_offset: int, name: str) -> Any:
+        """
+        Decodes a single parameter given the offset its step starts at
+        """
+        step_index, inner_offset, field_layout = self.fields[name]
+
+        if field_layout is not None:
+            return field_layout.unpack_from(view, step_offset + inner_offset)[0]
+
+        kind = self.steps[step_index][0]
+        start = step_offset + _STRING_LENGTH.size
+        end = self.skip_step(view, step_offset, step_index)
+
+        if end > len(view):
+            raise ValueError(
+                f"String parameter {name} runs past the end of the message"
+            )
+
+        if kind == _STRING:
+            return decode_string(view[start:end])
+
+        return str(view[start:end], "utf-16-le")
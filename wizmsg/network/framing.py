@@ -0,0 +1,112 @@
+import struct
+
+from wizmsg import DATA_START_MAGIC, LARGE_DATA_MAGIC
+
+# magic, size
+FRAME_HEADER = struct.Struct("<HH")
+LARGE_FRAME_SIZE = struct.Struct("<I")
+# is control, control opcode, reserved
+FRAME_FLAGS = struct.Struct("<?BH")
+
+# how much to ask the transport for per read
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def frame_bounds(
+    buffer: bytes | bytearray | memoryview, offset: int = 0
+) -> tuple[int, int] | None:
+    """
+    Returns where the header of the frame starting at offset ends and where the
+    frame ends, or None if not enough of the header is buffered yet
+    """
+    available = len(buffer) - offset
+    if available < FRAME_HEADER.size:
+        return None
+
+    magic, size = FRAME_HEADER.unpack_from(buffer, offset)
+    if magic != DATA_START_MAGIC:
+        raise ValueError(f"Magic mismatch, expected: {DATA_START_MAGIC} got: {magic}")
+
+    header_end = offset + FRAME_HEADER.size
+
+    if size >= LARGE_DATA_MAGIC:
+        if available < FRAME_HEADER.size + LARGE_FRAME_SIZE.size:
+            return None
+
+        (size,) = LARGE_FRAME_SIZE.unpack_from(buffer, header_end)
+        header_end += LARGE_FRAME_SIZE.size
+
+    return header_end, header_end + size
+
+
+def frame_length(buffer: bytes | bytearray | memoryview, offset: int = 0) -> int | None:
+    """
+    Returns the full length of the frame starting at offset, header included,
+    or None if not enough of the header is buffered yet
+    """
+    bounds = frame_bounds(buffer, offset)
+    if bounds is None:
+        return None
+
+    return bounds[1] - offset
+
+
+class FrameDecoder:
+    """
+    Incremental frame splitter; feed it whatever the transport returned and
+    it returns every frame that is now complete, keeping partial data buffered
+
+    decoder = FrameDecoder()
+    for frame in decoder.feed(await reader.read(READ_CHUNK_SIZE)):
+        processor.process_frame(frame)
+    """
+
+    def __init__(self, *, max_frame_size: int | None = None):
+        self.max_frame_size = max_frame_size
+        self._buffer = bytearray()
+
+    @property
+    def buffered(self) -> int:
+        """
+        Number of bytes waiting on the rest of their frame
+        """
+        return len(self._buffer)
+
+    def feed(self, data: bytes | bytearray | memoryview) -> list[bytes]:
+        if self._buffer:
+            self._buffer += data
+            source = self._buffer
+        else:
+            # nothing pending so split straight out of data without buffering it
+            source = data
+
+        frames = []
+        offset = 0
+        with memoryview(source) as view:
+            while True:
+                length = frame_length(view, offset)
+                if length is None:
+                    break
+
+                if self.max_frame_size is not None and length > self.max_frame_size:
+                    raise ValueError(
+                        f"Frame of {length} bytes exceeds max size {self.max_frame_size}"
+                    )
+
+                end = offset + length
+                if end > len(view):
+                    break
+
+                frames.append(view[offset:end].tobytes())
+                offset = end
+
+            if source is not self._buffer:
+                # keep the incomplete tail for the next feed
+                self._buffer += view[offset:]
+                offset = 0
+
+        if offset:
+            # deleting from the front of a bytearray doesn't reallocate
+            del self._buffer[:offset]
+
+        return frames
@@ -0,0 +1,165 @@
+from typing import Any, Callable
+
+from wizmsg.network.protocol import MessageData, MessageRecord
+from wizmsg.protocol_definition import ProtocolDefinition
+
+Handler = Callable[..., Any]
+
+
+def dispatch_key(service_id: int, order_id: int) -> int:
+    """
+    Index of a message in HandlerRegistry.table; both ids are one byte
+    """
+    return service_id << 8 | order_id
+
+
+class OffloadedHandler:
+    """
+    A handler to run in the server's executor; it's called with only the message
+    and whatever it returns is sent back, in the session's arrival order
+    """
+
+    __slots__ = ("function",)
+
+    def __init__(self, function: Callable[[Any], Any]):
+        self.function = function
+
+    def __repr__(self) -> str:
+        return f"<OffloadedHandler {self.function!r}>"
+
+
+class HandlerRegistry:
+    """
+    Maps messages to handlers by name or _MsgHandler; registrations are resolved
+    against the loaded protocols into a flat table keyed by dispatch_key, so
+    finding a message's handler is one lookup with no name comparisons
+
+    @processor.handlers.on("MSG_PERSON")
+    def person(session, message):
+        ...
+
+    @processor.handlers.on_msg_handler("crate::person_handler")
+    async def person(session, message):
+        ...
+
+    # runs in Server.executor; no session, the return value is the reply
+    @processor.handlers.on("MSG_PATHFIND", offload=True)
+    def pathfind(message):
+        return MessageData(...)
+    """
+
+    def __init__(self):
+        # message name: {service id or None for any: handler}
+        self._by_name: dict[str, dict[int | None, Handler | OffloadedHandler]] = {}
+        # _MsgHandler: handler
+        self._by_msg_handler: dict[str, Handler | OffloadedHandler] = {}
+        # service id: definition; every protocol resolved against
+        self._protocols: dict[int, ProtocolDefinition] = {}
+
+        # dispatch key: handler
+        self.table: dict[int, Handler | OffloadedHandler] = {}
+
+    def on(
+        self, name: str, *, service_id: int | None = None, offload: bool = False
+    ) -> Callable[[Handler], Handler]:
+        """
+        Decorator registering a handler for the message called name, in every
+        service or only service_id
+        """
+
+        def _register(handler: Handler) -> Handler:
+            self.add(handler, name=name, service_id=service_id, offload=offload)
+            return handler
+
+        return _register
+
+    def on_msg_handler(
+        self, msg_handler: str, *, offload: bool = False
+    ) -> Callable[[Handler], Handler]:
+        """
+        Decorator registering a handler for every message whose _MsgHandler is
+        msg_handler
+        """
+
+        def _register(handler: Handler) -> Handler:
+            self.add(handler, msg_handler=msg_handler, offload=offload)
+            return handler
+
+        return _register
+
+    def add(
+        self,
+        handler: Handler,
+        *,
+        name: str | None = None,
+        msg_handler: str | None = None,
+        service_id: int | None = None,
+        offload: bool = False,
+    ):
+        """
+        Register handler by message name or _MsgHandler; a name registered for
+        a service wins over one for any service, which wins over _MsgHandler
+
+        offload: run handler in the server's executor, see OffloadedHandler; it
+        has to be picklable for process pools
+        """
+        if (name is None) == (msg_handler is None):
+            raise ValueError("Pass exactly one of name or msg_handler")
+
+        if offload:
+            handler = OffloadedHandler(handler)
+
+        if name is not None:
+            self._by_name.setdefault(name, {})[service_id] = handler
+        else:
+            if service_id is not None:
+                raise ValueError("_MsgHandler registrations apply to every service")
+
+            self._by_msg_handler[msg_handler] = handler
+
+        for protocol_definition in self._protocols.values():
+            self._resolve(protocol_definition)
+
+    def protocol_added(self, protocol_definition: ProtocolDefinition):
+        """
+        Resolve registrations against a newly loaded protocol
+        """
+        self._protocols[protocol_definition.service_id] = protocol_definition
+        self._resolve(protocol_definition)
+
+    def _resolve(self, protocol_definition: ProtocolDefinition):
+        service_id = protocol_definition.service_id
+
+        for key, message in protocol_definition.messages.items():
+            # messages are also keyed by name
+            if not isinstance(key, int):
+                continue
+
+            handler = None
+
+            by_service = self._by_name.get(message.name)
+            if by_service is not None:
+                handler = by_service.get(service_id, by_service.get(None))
+
+            if handler is None and message.handler is not None:
+                handler = self._by_msg_handler.get(message.handler)
+
+            table_key = dispatch_key(service_id, key)
+            if handler is None:
+                self.table.pop(table_key, None)
+            else:
+                self.table[table_key] = handler
+
+    def get(self, service_id: int, order_id: int) -> Handler | OffloadedHandler | None:
+        return self.table.get(service_id << 8 | order_id)
+
+    def lookup(
+        self, message: MessageData | MessageRecord
+    ) -> Handler | OffloadedHandler | None:
+        """
+        The handler for message or None
+        """
+        if type(message) is MessageData:
+            return self.table.get(message.service_id << 8 | message.order_id)
+
+        return self.table.get(message._service_id << 8 | message._order_id)
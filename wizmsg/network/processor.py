@@ -1,10 +1,23 @@
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from io import StringIO
+from itertools import repeat
+from mmap import mmap
 from pathlib import Path
+from time import perf_counter
 from typing import TYPE_CHECKING, Optional, Union
 
 from loguru import logger
 
-from wizmsg import DATA_START_MAGIC, LARGE_DATA_MAGIC, ByteInterface, ProtocolDefinition
+from wizmsg import (
+    DATA_START_MAGIC,
+    LARGE_DATA_MAGIC,
+    ByteInterface,
+    ByteView,
+    Metrics,
+    ProtocolCache,
+    ProtocolDefinition,
+)
 from wizmsg.network.controls import (
     Control,
     KeepAlive,
@@ -12,32 +25,101 @@ from wizmsg.network.controls import (
     SessionAccept,
     SessionOffer,
 )
-from wizmsg.network.protocol import MessageData, Protocol
+from wizmsg.network.framing import (
+    FRAME_FLAGS,
+    FRAME_HEADER,
+    LARGE_FRAME_SIZE,
+    frame_bounds,
+)
+from wizmsg.network.handlers import HandlerRegistry
+from wizmsg.network.protocol import (
+    MESSAGE_HEADER,
+    MessageData,
+    MessageRecord,
+    Protocol,
+)
+from wizmsg.network.trace import TraceHook
+from wizmsg.protocol_definition import read_service_id
 
 if TYPE_CHECKING:
     from wizmsg import Session
 
 
+Frame = Union[Control, MessageData, MessageRecord]
+
+
+# opcode: control type
+CONTROL_TYPES: dict[int, type[Control]] = {
+    control_type.opcode: control_type
+    for control_type in (SessionOffer, SessionAccept, KeepAlive, KeepAliveResponse)
+}
+
+
 class ValeError(ValueError):
     pass
 
 
+def _message_info(frame: MessageData | MessageRecord) -> tuple[int, int, str]:
+    """
+    service id, order id and name of a decoded message
+    """
+    if isinstance(frame, MessageRecord):
+        return frame._service_id, frame._order_id, frame._name
+
+    return frame.service_id, frame.order_id, frame.name
+
+
+def _read_protocol_definition(
+    protocol_path: Path | StringIO, protocol_cache: ProtocolCache | None = None
+) -> ProtocolDefinition:
+    if protocol_cache is not None and isinstance(protocol_path, Path):
+        return protocol_cache.load(protocol_path)
+
+    return ProtocolDefinition.from_xml_file(protocol_path)
+
+
 class Processor:
-    def __init__(self):
+    def __init__(
+        self,
+        *,
+        protocol_cache: ProtocolCache | None = None,
+        metrics: Metrics | None = None,
+    ):
         # service id: definition
         self.protocols: dict[int, Protocol] = {}
-
-    def load_protocol(self, protocol_path: str | Path | StringIO) -> Protocol:
-        if isinstance(protocol_path, str):
-            protocol_path = Path(protocol_path)
-
-        protocol_definition = ProtocolDefinition.from_xml_file(protocol_path)
+        self.protocol_cache = protocol_cache
+        # service id: file; indexed protocols that haven't been loaded yet
+        self.protocol_index: dict[int, Path] = {}
+        # frames decoded in a thread pool can ask for the same indexed protocol
+        self._load_lock = threading.Lock()
+        # frames aren't counted or timed without this
+        self.metrics = metrics
+        self.trace_hooks: list[TraceHook] = []
+        # resolved against every protocol as it's added
+        self.handlers = HandlerRegistry()
+
+    def add_trace_hook(self, hook: TraceHook):
+        self.trace_hooks.append(hook)
+
+    def remove_trace_hook(self, hook: TraceHook):
+        self.trace_hooks.remove(hook)
+
+    def add_protocol(self, protocol_definition: ProtocolDefinition) -> Protocol:
         protocol = Protocol(protocol_definition)
 
         self.protocols[protocol_definition.service_id] = protocol
+        self.handlers.protocol_added(protocol_definition)
 
         return protocol
 
+    def load_protocol(self, protocol_path: str | Path | StringIO) -> Protocol:
+        if isinstance(protocol_path, str):
+            protocol_path = Path(protocol_path)
+
+        return self.add_protocol(
+            _read_protocol_definition(protocol_path, self.protocol_cache)
+        )
+
     # this is because we already accept strings as paths
     def load_protocol_from_string(self, protocol_string: str | StringIO) -> Protocol:
         if isinstance(protocol_string, str):
@@ -50,102 +132,497 @@ class Processor:
         protocol_directory: str | Path,
         *,
         allowed_glob: str = "*.xml",
+        workers: int | None = None,
     ) -> list[Protocol]:
         """
         server.load_protocols_from_directory("messages", allowed_glob="*Messages.xml")
+
+        workers: parse the files in a process pool of this size
+        """
+        if isinstance(protocol_directory, str):
+            protocol_directory = Path(protocol_directory)
+
+        # sorted so errors and results don't depend on directory order
+        protocol_files = sorted(protocol_directory.glob(allowed_glob))
+
+        if workers is None:
+            protocol_definitions = [
+                _read_protocol_definition(protocol_file, self.protocol_cache)
+                for protocol_file in protocol_files
+            ]
+        else:
+            with ProcessPoolExecutor(workers) as executor:
+                protocol_definitions = list(
+                    executor.map(
+                        _read_protocol_definition,
+                        protocol_files,
+                        repeat(self.protocol_cache),
+                    )
+                )
+
+        # service id: file
+        seen_service_ids: dict[int, Path] = {}
+        for protocol_file, protocol_definition in zip(
+            protocol_files, protocol_definitions
+        ):
+            service_id = protocol_definition.service_id
+            if service_id in seen_service_ids:
+                raise ValueError(
+                    f"{protocol_file} and {seen_service_ids[service_id]} both define service id {service_id}"
+                )
+
+            seen_service_ids[service_id] = protocol_file
+
+        return [
+            self.add_protocol(protocol_definition)
+            for protocol_definition in protocol_definitions
+        ]
+
+    def index_protocols_from_directory(
+        self,
+        protocol_directory: str | Path,
+        *,
+        allowed_glob: str = "*.xml",
+    ) -> dict[int, Path]:
+        """
+        Only reads the service id of each file; a protocol is fully loaded the
+        first time its service id is seen
+
+        server.index_protocols_from_directory("messages", allowed_glob="*Messages.xml")
         """
         if isinstance(protocol_directory, str):
             protocol_directory = Path(protocol_directory)
 
-        protocols = []
-        for protocol_file in protocol_directory.glob(allowed_glob):
-            protocols.append(self.load_protocol(protocol_file))
+        # service id: file
+        protocol_index: dict[int, Path] = {}
+        for protocol_file in sorted(protocol_directory.glob(allowed_glob)):
+            service_id = read_service_id(protocol_file)
+            if service_id in protocol_index:
+                raise ValueError(
+                    f"{protocol_file} and {protocol_index[service_id]} both define service id {service_id}"
+                )
+
+            protocol_index[service_id] = protocol_file
+
+        self.protocol_index.update(protocol_index)
+
+        return protocol_index
+
+    def get_protocol(self, service_id: int) -> Protocol | None:
+        """
+        Returns the protocol for service_id, loading it if it was indexed
+        """
+        protocol = self.protocols.get(service_id)
+
+        if protocol is None and service_id in self.protocol_index:
+            with self._load_lock:
+                # another thread may have loaded it while this one waited
+                protocol = self.protocols.get(service_id)
+                protocol_path = self.protocol_index.get(service_id)
 
-        return protocols
+                if protocol is None and protocol_path is not None:
+                    logger.debug(f"loading indexed protocol {protocol_path}")
+                    protocol = self.load_protocol(protocol_path)
+                    # only forgotten once loaded, a failed parse can be retried
+                    self.protocol_index.pop(service_id, None)
+
+        return protocol
 
     def process_message_data(
-        self, data: ByteInterface, *, session: Optional["Session"] = None
+        self,
+        data: ByteInterface | ByteView,
+        *,
+        session: Optional["Session"] = None,
+        lazy: bool = False,
+        as_record: bool = False,
     ):
         """
         Processes a data message
         """
         service_id = data.unsigned1()
 
-        protocol = self.protocols.get(service_id)
+        protocol = self.get_protocol(service_id)
 
         if protocol is None:
             raise ValeError(f"Unexpected service id {service_id}")
-            #raise RuntimeError(f"Unexpected service id {service_id}")
+            # raise RuntimeError(f"Unexpected service id {service_id}")
 
-        return protocol.process_protocol_data(data)
+        return protocol.process_protocol_data(data, lazy=lazy, as_record=as_record)
 
-    def process_control_data(self, data: ByteInterface, opcode: int):
+    def process_control_data(self, data: ByteInterface | ByteView, opcode: int):
         """
         Processes a control message
         """
+        control_type = CONTROL_TYPES.get(opcode)
 
-        for control_type in (SessionOffer, SessionAccept, KeepAlive, KeepAliveResponse):
-            if control_type.opcode == opcode:
-                return control_type.from_data(data)
+        if control_type is None:
+            raise ValueError(f"{opcode} is not a registered opcode")
 
-        raise ValueError(f"{opcode} is not a registered opcode")
+        return control_type.from_data(data)
 
-    def process_frame(self, raw: bytes) -> Union[Control, MessageData]:
-        raw_interface = ByteInterface(raw)
+    def _record_received(self, frame: Frame, size: int, seconds: float):
+        if isinstance(frame, Control):
+            self.metrics.control_received(frame.opcode)
+        else:
+            service_id, _, name = _message_info(frame)
+            self.metrics.message_received(service_id, name, size, seconds)
+
+    def _trace(self, received: bool, raw: memoryview, frame: Frame):
+        for hook in self.trace_hooks:
+            if received:
+                hook.frame_received(raw, frame)
+            else:
+                hook.frame_sent(raw, frame)
+
+        if isinstance(frame, Control):
+            return
+
+        parameter_hooks = [hook for hook in self.trace_hooks if hook.trace_parameters]
+        if not parameter_hooks:
+            return
+
+        header_end, _ = frame_bounds(raw, 0)
+        message_start = header_end + FRAME_FLAGS.size
+        _, _, length = MESSAGE_HEADER.unpack_from(raw, message_start)
+
+        body_start = message_start + MESSAGE_HEADER.size
+        body = raw[body_start : body_start + length]
+
+        service_id, order_id, _ = _message_info(frame)
+        codec = self.get_protocol(service_id).messages[order_id].codec
+
+        if isinstance(frame, MessageRecord):
+            values = frame
+        else:
+            values = [frame.parameters[name] for name in codec.names]
+
+        for (name, start, end), value in zip(codec.field_spans(body), values):
+            for hook in parameter_hooks:
+                hook.parameter(frame, name, value, body[start:end], body_start + start)
+
+    def process_frame(
+        self,
+        raw: bytes | bytearray | memoryview,
+        *,
+        lazy: bool = False,
+        as_record: bool = False,
+    ) -> Frame:
+        """
+        lazy: leave message parameters undecoded until they're accessed, for when
+        only a few fields are needed i.e. routing on GlobalID
+        as_record: return messages as their generated MessageRecord tuple class,
+        which is much smaller than MessageData; can't be used with lazy
+        """
+        metrics = self.metrics
+        if metrics is None and not self.trace_hooks:
+            return self._process_frame(raw, lazy, as_record)
 
-        magic = raw_interface.unsigned2()
+        try:
+            frame, seconds = self.decode_frame(raw, lazy=lazy, as_record=as_record)
+        except Exception as exc:
+            if metrics is not None:
+                metrics.error("decode", exc)
+            raise
+
+        self.frame_decoded(raw, frame, seconds)
+
+        return frame
+
+    def decode_frame(
+        self,
+        raw: bytes | bytearray | memoryview,
+        *,
+        lazy: bool = False,
+        as_record: bool = False,
+    ) -> tuple[Frame, float]:
+        """
+        process_frame without metrics or trace hooks, so it's safe to run off the
+        event loop; returns the frame and the seconds decoding took, to pass
+        frame_decoded back on the loop
+        """
+        start = perf_counter()
+        frame = self._process_frame(raw, lazy, as_record)
+
+        return frame, perf_counter() - start
+
+    def frame_decoded(
+        self, raw: bytes | bytearray | memoryview, frame: Frame, seconds: float
+    ):
+        """
+        Count and trace a frame decoded by decode_frame
+        """
+        if self.metrics is not None:
+            self._record_received(frame, len(raw), seconds)
+
+        if self.trace_hooks:
+            with memoryview(raw) as raw_view:
+                self._trace(True, raw_view, frame)
+
+    def _process_frame(
+        self, raw: bytes | bytearray | memoryview, lazy: bool, as_record: bool
+    ) -> Frame:
+        raw_interface = ByteView(raw)
+
+        # I don't really need size or large size
+        magic, size = raw_interface.read_struct(FRAME_HEADER)
         if magic != DATA_START_MAGIC:
             raise ValueError(
                 f"Magic mismatch, expected: {DATA_START_MAGIC} got: {magic}"
             )
 
-        # I don't really need size or large size
-        size = raw_interface.unsigned2()
         if size >= LARGE_DATA_MAGIC:
-            size = raw_interface.unsigned4()
+            raw_interface.read_struct(LARGE_FRAME_SIZE)
 
-        is_control = raw_interface.bool()
-        control_opcode = raw_interface.unsigned1()
-        raw_interface.unsigned2()
+        is_control, control_opcode, _ = raw_interface.read_struct(FRAME_FLAGS)
 
         if is_control:
             return self.process_control_data(raw_interface, control_opcode)
 
         else:
-            return self.process_message_data(raw_interface)
+            return self.process_message_data(
+                raw_interface, lazy=lazy, as_record=as_record
+            )
+
+    def process_frames(
+        self,
+        buffer: bytes | bytearray | memoryview | mmap,
+        *,
+        lazy: bool = False,
+        as_record: bool = False,
+    ) -> tuple[list[Frame], int]:
+        """
+        Processes every complete frame at the start of buffer; returns the processed
+        frames and the number of bytes they took up, anything after that is an
+        incomplete frame for the caller to carry over
+
+        with open("capture", "rb") as fp, mmap(fp.fileno(), 0, access=ACCESS_READ) as data:
+            frames, consumed = processor.process_frames(data)
+
+        lazy frames keep views into the buffer they were decoded from, so unless
+        buffer is immutable bytes each lazy frame's bytes are copied out; otherwise
+        a bytearray couldn't be resized to drop the consumed frames, or an mmap
+        closed, while the frames are alive
+        """
+        frames = []
+        offset = 0
+        copy_frames = lazy and not isinstance(buffer, bytes)
+
+        metrics = self.metrics
+        trace_hooks = self.trace_hooks
+        get_protocol = self.get_protocol
+        process_control_data = self.process_control_data
+        last_service_id = None
+        protocol = None
+
+        view = memoryview(buffer)
+        view_length = len(view)
+
+        while (bounds := frame_bounds(view, offset)) is not None:
+            header_end, frame_end = bounds
+            if frame_end > view_length:
+                break
+
+            if metrics is not None:
+                start = perf_counter()
+
+            is_control, control_opcode, _ = FRAME_FLAGS.unpack_from(view, header_end)
+            if copy_frames:
+                data = ByteView(
+                    view[offset:frame_end].tobytes(),
+                    header_end - offset + FRAME_FLAGS.size,
+                )
+            else:
+                data = ByteView(view[:frame_end], header_end + FRAME_FLAGS.size)
+
+            try:
+                if is_control:
+                    frame = process_control_data(data, control_opcode)
+
+                else:
+                    service_id = data.unsigned1()
+
+                    # frames in a buffer tend to come from the same service
+                    if service_id != last_service_id:
+                        protocol = get_protocol(service_id)
+
+                        if protocol is None:
+                            raise ValeError(f"Unexpected service id {service_id}")
+
+                        last_service_id = service_id
+
+                    frame = protocol.process_protocol_data(
+                        data, lazy=lazy, as_record=as_record
+                    )
+
+            except Exception as exc:
+                if metrics is not None:
+                    metrics.error("decode", exc)
+                raise
+
+            if metrics is not None:
+                self._record_received(frame, frame_end - offset, perf_counter() - start)
+
+            if trace_hooks:
+                self._trace(True, view[offset:frame_end], frame)
 
-    def prepare_frame(self, frame: Union[Control, MessageData]) -> bytes:
-        buffer = ByteInterface()
+            frames.append(frame)
+            offset = frame_end
 
-        buffer.write_unsigned2(DATA_START_MAGIC)
+        return frames, offset
 
-        frame_data = ByteInterface()
+    def prepare_frame(self, frame: Frame) -> bytes:
+        buffer = bytearray()
+        self.prepare_frame_into(frame, buffer)
+        return bytes(buffer)
+
+    def encode_frame(self, frame: Frame) -> tuple[bytes, float]:
+        """
+        prepare_frame without counting or tracing the frame, for frames written
+        more than once; returns the frame and the seconds encoding took, to pass
+        frame_encoded once it's known how many times it was written
+        """
+        buffer = bytearray()
+
+        start = perf_counter()
+        try:
+            self._prepare_frame_into(frame, buffer, 0)
+        except Exception as exc:
+            if self.metrics is not None:
+                self.metrics.error("encode", exc)
+            raise
+
+        return bytes(buffer), perf_counter() - start
+
+    def frame_encoded(self, raw: bytes, frame: Frame, seconds: float, copies: int):
+        """
+        Count a frame encoded by encode_frame once for every copy written, and
+        trace it once if it was written at all
+        """
+        metrics = self.metrics
+        if metrics is not None:
+            if isinstance(frame, Control):
+                metrics.control_sent(frame.opcode, copies)
+            else:
+                service_id, _, name = _message_info(frame)
+                metrics.message_sent(service_id, name, len(raw), seconds, copies)
+
+        if copies and self.trace_hooks:
+            with memoryview(raw) as raw_view:
+                self._trace(False, raw_view, frame)
+
+    def prepare_frame_into(
+        self, frame: Frame, buffer: bytearray, offset: int = 0
+    ) -> int:
+        """
+        Writes frame into buffer at offset in a single pass, growing buffer if
+        it's too small; returns the number of bytes written
+
+        buffer = bytearray(4096)
+        written = processor.prepare_frame_into(message, buffer)
+        transport.write(bytes(buffer[:written]))
+
+        transports can hold on to what they're given until it's sent, so hand them
+        a copy rather than a view of a buffer that's about to be reused
+        """
+        metrics = self.metrics
+        if metrics is None and not self.trace_hooks:
+            return self._prepare_frame_into(frame, buffer, offset)
+
+        start = perf_counter()
+        try:
+            written = self._prepare_frame_into(frame, buffer, offset)
+        except Exception as exc:
+            if metrics is not None:
+                metrics.error("encode", exc)
+            raise
+
+        if metrics is not None:
+            if isinstance(frame, Control):
+                metrics.control_sent(frame.opcode)
+            else:
+                service_id, _, name = _message_info(frame)
+                metrics.message_sent(service_id, name, written, perf_counter() - start)
+
+        if self.trace_hooks:
+            # released afterwards so the buffer can be resized again
+            with memoryview(buffer) as buffer_view:
+                with buffer_view[offset : offset + written] as raw:
+                    self._trace(False, raw, frame)
+
+        return written
+
+    def _prepare_frame_into(self, frame: Frame, buffer: bytearray, offset: int) -> int:
         if isinstance(frame, Control):
-            body_size = frame.to_data(frame_data) + 4
-            if body_size >= LARGE_DATA_MAGIC:
-                buffer.write_unsigned2(LARGE_DATA_MAGIC)
-                buffer.write_unsigned4(body_size)
+            # controls are small and rare so they still go through ByteInterface
+            frame_data = ByteInterface()
+            frame.to_data(frame_data)
+            control_body = frame_data.getbuffer()
+
+            body_size = FRAME_FLAGS.size + len(control_body)
+
+        else:
+            service_id, order_id, _ = _message_info(frame)
+
+            protocol = self.get_protocol(service_id)
+            if protocol is None:
+                raise ValeError(f"Unexpected service id {service_id}")
+
+            message = protocol.messages.get(order_id)
+            if message is None:
+                raise RuntimeError(f"Got invalid message order {order_id}")
+
+            if isinstance(frame, MessageRecord):
+                record_class = message.record_class
+                if (
+                    type(frame) is not record_class
+                    and frame._parameters != record_class._parameters
+                ):
+                    raise ValueError(
+                        f"{frame._name} record doesn't match the loaded definition"
+                    )
+
+                message_size, pieces = message.codec.encode_values(frame)
             else:
-                buffer.write_unsigned2(body_size)
+                message_size, pieces = message.codec.encode_pieces(frame.parameters)
 
-            buffer.write_bool(True)
-            buffer.write_unsigned1(frame.opcode)
-            buffer.write_unsigned2(0)
-            buffer.write(frame_data.getvalue())
+            # trailing null byte
+            body_size = FRAME_FLAGS.size + MESSAGE_HEADER.size + message_size + 1
 
+        if body_size >= LARGE_DATA_MAGIC:
+            header_size = FRAME_HEADER.size + LARGE_FRAME_SIZE.size
         else:
-            protocol = self.protocols[frame.service_id]
+            header_size = FRAME_HEADER.size
 
-            body_size = protocol.prepare_protocol_data(frame_data, frame) + 4
-            if body_size >= LARGE_DATA_MAGIC:
-                buffer.write_unsigned2(LARGE_DATA_MAGIC)
-                buffer.write_unsigned4(body_size)
-            else:
-                buffer.write_unsigned2(body_size)
+        frame_size = header_size + body_size
+
+        missing = offset + frame_size - len(buffer)
+        if missing > 0:
+            buffer.extend(bytes(missing))
+
+        if body_size >= LARGE_DATA_MAGIC:
+            FRAME_HEADER.pack_into(buffer, offset, DATA_START_MAGIC, LARGE_DATA_MAGIC)
+            LARGE_FRAME_SIZE.pack_into(buffer, offset + FRAME_HEADER.size, body_size)
+        else:
+            FRAME_HEADER.pack_into(buffer, offset, DATA_START_MAGIC, body_size)
+
+        position = offset + header_size
+
+        if isinstance(frame, Control):
+            FRAME_FLAGS.pack_into(buffer, position, True, frame.opcode, 0)
+            position += FRAME_FLAGS.size
+
+            buffer[position : position + len(control_body)] = control_body
+
+        else:
+            FRAME_FLAGS.pack_into(buffer, position, False, 0, 0)
+            position += FRAME_FLAGS.size
+
+            MESSAGE_HEADER.pack_into(
+                buffer, position, service_id, order_id, message_size
+            )
+            position += MESSAGE_HEADER.size
 
-            buffer.write_bool(False)
-            buffer.write_unsigned1(0)
-            buffer.write_unsigned2(0)
-            buffer.write(frame_data.getvalue())
+            message.codec.pack_pieces_into(buffer, position, pieces)
+            buffer[position + message_size] = 0
 
-        return buffer.getvalue()
+        return frame_size
@@ -1,12 +1,23 @@
+import struct
+from collections import namedtuple
 from dataclasses import dataclass
-from typing import TYPE_CHECKING, Any
-
-from loguru import logger
+from functools import cached_property
+from typing import TYPE_CHECKING, Any, Iterator, Mapping
 
 from wizmsg import WIZ_TYPE_CONVERSION_TABLE
+from wizmsg.network.codec import FIXED_WIDTH_FORMATS, MessageCodec
 
 if TYPE_CHECKING:
-    from wizmsg import ByteInterface, MessageDefinition, ProtocolDefinition
+    from wizmsg import (
+        ByteInterface,
+        ByteView,
+        MessageDefinition,
+        ProtocolDefinition,
+    )
+
+
+# service id, order id, dml length
+MESSAGE_HEADER = struct.Struct("<BBH")
 
 
 @dataclass
@@ -15,45 +26,212 @@ class MessageData:
     order_id: int
 
     name: str
-    # param name: value
+    # param name: value; LazyParameters when processed with lazy=True
     parameters: dict[str, Any]
 
 
+# read method: python type of the decoded value, for record annotations
+_RECORD_TYPES = {
+    "bool": bool,
+    "float": float,
+    "double": float,
+    "string": str | bytes,
+    "wide_string": str,
+}
+
+
+class MessageRecord:
+    """
+    Base of the tuple records generated for each message definition; the fields
+    are the message's parameters in definition order
+
+    record = processor.process_frame(raw, as_record=True)
+    record.GlobalID, record._name
+    """
+
+    __slots__ = ()
+
+    _service_id: int
+    _order_id: int
+    _name: str
+    # (parameter name, type); fields are renamed if a parameter isn't a valid one
+    _parameters: tuple[tuple[str, str], ...]
+
+    def _message_data(self) -> MessageData:
+        return MessageData(
+            self._service_id,
+            self._order_id,
+            self._name,
+            {name: value for (name, _), value in zip(self._parameters, self)},
+        )
+
+    def __reduce__(self):
+        # generated classes can't be found by name so they're rebuilt on unpickle
+        return _rebuild_record, (
+            self._service_id,
+            self._order_id,
+            self._name,
+            self._parameters,
+            tuple(self),
+        )
+
+
+# (service id, order id, name, parameters): record class
+_record_classes: dict[tuple, type[MessageRecord]] = {}
+
+
+def record_class(
+    service_id: int,
+    order_id: int,
+    name: str,
+    parameters: tuple[tuple[str, str], ...],
+) -> type[MessageRecord]:
+    """
+    The record class for a message; one class per distinct definition
+    """
+    key = (service_id, order_id, name, parameters)
+
+    cls = _record_classes.get(key)
+    if cls is not None:
+        return cls
+
+    base = namedtuple(name, [name for name, _ in parameters], rename=True)
+
+    annotations = {}
+    for field_name, (_, parameter_type) in zip(base._fields, parameters):
+        read_method = WIZ_TYPE_CONVERSION_TABLE.get(parameter_type)
+        if read_method in _RECORD_TYPES:
+            annotations[field_name] = _RECORD_TYPES[read_method]
+        elif read_method in FIXED_WIDTH_FORMATS:
+            annotations[field_name] = int
+        else:
+            annotations[field_name] = Any
+
+    cls = _record_classes[key] = type(
+        name,
+        (MessageRecord, base),
+        {
+            "__slots__": (),
+            "__annotations__": annotations,
+            "__module__": __name__,
+            "_service_id": service_id,
+            "_order_id": order_id,
+            "_name": name,
+            "_parameters": parameters,
+        },
+    )
+    return cls
+
+
+def _rebuild_record(
+    service_id: int,
+    order_id: int,
+    name: str,
+    parameters: tuple[tuple[str, str], ...],
+    values: tuple,
+) -> MessageRecord:
+    return record_class(service_id, order_id, name, parameters)._make(values)
+
+
+class LazyParameters(Mapping[str, Any]):
+    """
+    Read only parameter mapping over the raw message body that decodes each
+    parameter the first time it's accessed; the buffer must not be modified
+    while this is alive
+    """
+
+    __slots__ = ("_codec", "_view", "_step_offsets", "_values")
+
+    def __init__(self, codec: MessageCodec, view: memoryview):
+        self._codec = codec
+        self._view = view
+        # start offset of each step located so far
+        self._step_offsets = [0]
+        # param name: value
+        self._values: dict[str, Any] = {}
+
+    def _step_offset(self, step_index: int) -> int:
+        step_offsets = self._step_offsets
+
+        while len(step_offsets) <= step_index:
+            located = len(step_offsets) - 1
+            step_offsets.append(
+                self._codec.skip_step(self._view, step_offsets[located], located)
+            )
+
+        return step_offsets[step_index]
+
+    def __getitem__(self, name: str) -> Any:
+        try:
+            return self._values[name]
+        except KeyError:
+            pass
+
+        step_index = self._codec.fields[name][0]
+        value = self._codec.decode_field(
+            self._view, self._step_offset(step_index), name
+        )
+        self._values[name] = value
+        return value
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._codec.names)
+
+    def __len__(self) -> int:
+        return len(self._codec.names)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({dict(self)!r})"
+
+
 class Message:
-    def __init__(self, definition: "MessageDefinition"):
+    def __init__(self, definition: "MessageDefinition", service_id: int = 0):
         self.definition = definition
+        # only used to tag records
+        self.service_id = service_id
+        self.codec = MessageCodec(definition.parameters.values())
+
+    # generated on first use; most messages in a protocol never are
+    @cached_property
+    def record_class(self) -> type[MessageRecord]:
+        return record_class(
+            self.service_id,
+            self.definition.order,
+            self.definition.name,
+            tuple(
+                (parameter.name, parameter.type)
+                for parameter in self.definition.parameters.values()
+            ),
+        )
 
     def process_message_data(
-        self, service_id: int, data: "ByteInterface"
-    ) -> MessageData:
+        self,
+        service_id: int,
+        data: "ByteInterface | ByteView",
+        *,
+        lazy: bool = False,
+        length: int | None = None,
+        as_record: bool = False,
+    ) -> MessageData | MessageRecord:
         """Only gets the arg data"""
-        parameters = {}
-        for parameter_definition in self.definition.parameters.values():
-            name = parameter_definition.name
-            param_type = parameter_definition.type
-            read_method = WIZ_TYPE_CONVERSION_TABLE.get(param_type)
-
-            if read_method is None:
-                raise RuntimeError(f"Missing read method for type {param_type}")
-
-            # TODO: wide_string
-            if read_method == "string":
-                value = getattr(data, read_method)()
-                try:
-                    value = value.decode()
-                except UnicodeDecodeError:
-                    # TODO: return this as byte or something
-                    logger.warning(
-                        "ignoring string decoding failure; likely class data"
-                    )
-            else:
-                value = getattr(data, read_method)()
-
-            logger.debug(
-                f"{name=} {value=} {param_type=} rest={data.getbuffer()[data.tell():].hex(' ')}"
-            )
+        if as_record:
+            if lazy:
+                raise ValueError("lazy and as_record can't be used together")
+
+            # skips _make's length check; decode always returns every field
+            return tuple.__new__(self.record_class, self.codec.decode(data))
 
-            parameters[name] = value
+        if lazy:
+            start = data.tell()
+            body = data.getbuffer()[start:]
+            if length is not None:
+                body = body[:length]
+
+            parameters = LazyParameters(self.codec, body)
+            data.seek(start + len(body))
+
+        else:
+            parameters = dict(zip(self.codec.names, self.codec.decode(data)))
 
         return MessageData(
             service_id, self.definition.order, self.definition.name, parameters
@@ -62,34 +240,35 @@ class Message:
     def prepare_message_data(
         self, data: "ByteInterface", message_data: MessageData
     ) -> int:
-        written = 0
-
-        for name, value in message_data.parameters.items():
-            parameter_definition = self.definition.parameters[name]
-            write_method = (
-                "write_" + WIZ_TYPE_CONVERSION_TABLE[parameter_definition.type]
-            )
-
-            if write_method == "write_string" and isinstance(value, str):
-                value = value.encode()
-
-            written += getattr(data, write_method)(value)
-
-        return written
+        return self.codec.encode(data, message_data.parameters)
 
 
 class Protocol:
     def __init__(self, definition: "ProtocolDefinition"):
         self.definition = definition
 
+        # definitions are keyed by both order and name; compile each only once
+        compiled = {}
         messages = {}
         for order, message_definition in self.definition.messages.items():
-            messages[order] = Message(message_definition)
+            message = compiled.get(id(message_definition))
+            if message is None:
+                message = compiled[id(message_definition)] = Message(
+                    message_definition, self.definition.service_id
+                )
+
+            messages[order] = message
 
         # order: Message
         self.messages: dict[int, Message] = messages
 
-    def process_protocol_data(self, data: "ByteInterface") -> MessageData:
+    def process_protocol_data(
+        self,
+        data: "ByteInterface | ByteView",
+        *,
+        lazy: bool = False,
+        as_record: bool = False,
+    ) -> MessageData | MessageRecord:
         """Gets data after service id"""
         order_id = data.unsigned1()
         length = data.unsigned2()
@@ -98,46 +277,34 @@ class Protocol:
         if message is None:
             raise RuntimeError(f"Got invalid message order {order_id}")
 
-        logger.debug(
-            f"{order_id=} {length=} {message.definition.name=} rest={data.getbuffer()[data.tell():].hex(' ')}"
+        # the trailing null byte is left unread
+        return message.process_message_data(
+            self.definition.service_id,
+            data,
+            lazy=lazy,
+            length=length,
+            as_record=as_record,
         )
 
-        message_data = message.process_message_data(self.definition.service_id, data)
-
-        # there should be a single null byte left in the buffer at this point
-        data.seek(1)
-
-        return message_data
-
     def prepare_protocol_data(
         self, buffer: "ByteInterface", message_data: MessageData
     ) -> int:
-        written = 0
-
-        service_id = message_data.service_id
         order_id = message_data.order_id
 
         message = self.messages.get(order_id)
         if message is None:
             raise RuntimeError(f"Got invalid message order {order_id}")
 
-        written += buffer.write_unsigned1(service_id)
-        written += buffer.write_unsigned1(order_id)
-
-        dml_length_pos = buffer.tell()
-        written += buffer.write_unsigned2(0)
-
-        message_bytes = message.prepare_message_data(buffer, message_data)
-
-        current_pos = buffer.tell()
-        buffer.seek(dml_length_pos)
-        buffer.write_unsigned2(message_bytes)
-        buffer.seek(current_pos)
+        message_size, pieces = message.codec.encode_pieces(message_data.parameters)
 
         # trailing null byte
-        written += buffer.write_unsigned1(0)
+        data = bytearray(MESSAGE_HEADER.size + message_size + 1)
+        MESSAGE_HEADER.pack_into(
+            data, 0, message_data.service_id, order_id, message_size
+        )
+        message.codec.pack_pieces_into(data, MESSAGE_HEADER.size, pieces)
 
-        return written + message_bytes
+        return buffer.write(data)
 
     # TODO: what was this supposed to do
     # def prepare_message(self, message: Message) -> bytes:
@@ -0,0 +1,81 @@
+from typing import Any, Union
+
+from loguru import logger
+
+from wizmsg.network.controls import Control
+from wizmsg.network.protocol import MessageData, MessageRecord
+
+
+class TraceHook:
+    """
+    Subclass and override the events you need then install with
+    Processor.add_trace_hook; nothing is traced while no hooks are installed
+
+    raw views are only valid for the duration of the call, copy them to keep them
+    """
+
+    # parameter events are only worked out when a hook sets this
+    trace_parameters: bool = False
+
+    def frame_received(
+        self, raw: memoryview, frame: Union[Control, MessageData, MessageRecord]
+    ):
+        pass
+
+    def frame_sent(
+        self, raw: memoryview, frame: Union[Control, MessageData, MessageRecord]
+    ):
+        pass
+
+    def parameter(
+        self,
+        message: MessageData | MessageRecord,
+        name: str,
+        value: Any,
+        raw: memoryview,
+        offset: int,
+    ):
+        """
+        Called for each parameter of a message after frame_received or frame_sent
+
+        offset: where raw starts in the frame
+        """
+        pass
+
+
+class HexDumpHook(TraceHook):
+    """
+    Logs every frame and parameter with a hex dump of its bytes
+
+    processor.add_trace_hook(HexDumpHook())
+    """
+
+    trace_parameters = True
+
+    def __init__(self, level: str = "DEBUG"):
+        self.level = level
+
+    def _frame(self, direction: str, raw: memoryview, frame):
+        # records and controls are named after what they are
+        name = frame.name if isinstance(frame, MessageData) else type(frame).__name__
+        logger.log(self.level, f"{direction} {name} ({len(raw)} bytes) {raw.hex(' ')}")
+
+    def frame_received(
+        self, raw: memoryview, frame: Union[Control, MessageData, MessageRecord]
+    ):
+        self._frame("received", raw, frame)
+
+    def frame_sent(
+        self, raw: memoryview, frame: Union[Control, MessageData, MessageRecord]
+    ):
+        self._frame("sent", raw, frame)
+
+    def parameter(
+        self,
+        message: MessageData | MessageRecord,
+        name: str,
+        value: Any,
+        raw: memoryview,
+        offset: int,
+    ):
+        logger.log(self.level, f"  {name}@{offset}={value!r} {raw.hex(' ')}")
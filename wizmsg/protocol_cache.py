@@ -0,0 +1,88 @@
+import hashlib
+import os
+import pickle
+from io import BytesIO
+from pathlib import Path
+
+from loguru import logger
+
+from wizmsg import ProtocolDefinition, __version__
+
+# bump when the pickled layout of protocol definitions changes
+CACHE_FORMAT_VERSION = 2
+
+
+class ProtocolCache:
+    """
+    On disk cache of parsed protocol definitions keyed by the xml content hash
+    and wizmsg version, so changed files are reparsed automatically
+
+    entries are pickles; only point this at a directory you trust
+    """
+
+    def __init__(self, directory: str | Path):
+        if isinstance(directory, str):
+            directory = Path(directory)
+
+        self.directory = directory
+
+    def _entry_prefix(self, protocol_path: Path) -> str:
+        # files with the same name in different directories can share a cache
+        source_key = hashlib.blake2b(
+            str(protocol_path.resolve()).encode(), digest_size=4
+        ).hexdigest()
+
+        return f"{protocol_path.stem}-{source_key}-"
+
+    def _entry_path(self, protocol_path: Path, source: bytes) -> Path:
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(f"{__version__}:{CACHE_FORMAT_VERSION}:".encode())
+        digest.update(source)
+
+        return (
+            self.directory
+            / f"{self._entry_prefix(protocol_path)}{digest.hexdigest()}.pickle"
+        )
+
+    def load(self, protocol_path: str | Path) -> ProtocolDefinition:
+        if isinstance(protocol_path, str):
+            protocol_path = Path(protocol_path)
+
+        source = protocol_path.read_bytes()
+        entry_path = self._entry_path(protocol_path, source)
+
+        try:
+            with open(entry_path, "rb") as fp:
+                return pickle.load(fp)
+        except FileNotFoundError:
+            pass
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError) as exc:
+            logger.warning(
+                f"ignoring unreadable protocol cache entry {entry_path}: {exc}"
+            )
+
+        protocol_definition = ProtocolDefinition.from_xml_file(BytesIO(source))
+        self._store(protocol_path, entry_path, protocol_definition)
+
+        return protocol_definition
+
+    def _store(
+        self,
+        protocol_path: Path,
+        entry_path: Path,
+        protocol_definition: ProtocolDefinition,
+    ):
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        # entries for older versions of this file are dead now
+        prefix = self._entry_prefix(protocol_path)
+        for stale_entry in self.directory.glob("*.pickle"):
+            if stale_entry.name.startswith(prefix) and stale_entry != entry_path:
+                stale_entry.unlink(missing_ok=True)
+
+        # write then rename so concurrent loaders never see a partial entry
+        temp_path = entry_path.with_suffix(f".{os.getpid()}.tmp")
+        with open(temp_path, "wb") as fp:
+            pickle.dump(protocol_definition, fp, protocol=pickle.HIGHEST_PROTOCOL)
+
+        os.replace(temp_path, entry_path)
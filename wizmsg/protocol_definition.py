@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from io import StringIO
+from io import BytesIO, StringIO
 from pathlib import Path
 from typing import Union
 from xml.etree import ElementTree
@@ -19,85 +19,82 @@ class MessageDefinition:
     name: str
     description: str
     parameters: dict[str, MessageDefinitionParameter]
+    # _MsgHandler; names the function the game dispatches this message to
+    handler: str | None = None
 
 
-def _get_messages_from_xml(
-    root_element: ElementTree.Element,
-) -> dict[Union[int, str], MessageDefinition]:
-    messages = {}
-    for message_element in root_element:
-        if message_element.tag == "_ProtocolInfo":
-            continue
+def _get_message_from_xml(message_element: ElementTree.Element) -> MessageDefinition:
+    record = message_element[0]
 
-        record = message_element[0]
+    def _get_record_value(
+        sub_element_name, *, allow_missing: bool = False, as_int: bool = False
+    ) -> int | str | None:
+        element = record.find(sub_element_name)
 
-        def _get_record_value(
-            sub_element_name, *, allow_missing: bool = False, as_int: bool = False
-        ) -> int | str | None:
-            element = record.find(sub_element_name)
+        if element is None:
+            if allow_missing:
+                return None
 
-            if element is None:
-                if allow_missing:
-                    return None
+            raise ValueError(f"{sub_element_name} missing from message entry")
 
-                raise ValueError(f"{sub_element_name} missing from message entry")
+        if as_int:
+            # TODO: what should happen here if element.text is None
+            return int(element.text)
 
-            if as_int:
-                # TODO: what should happen here if element.text is None
-                return int(element.text)
+        return element.text
 
-            return element.text
+    # this MsgName is actually incorrect; doesn't match the tag name which is used for sorting
+    # message_name = _get_record_value("_MsgName")
+    message_name = message_element.tag
 
-        # this MsgName is actually incorrect; doesn't match the tag name which is used for sorting
-        # message_name = _get_record_value("_MsgName")
-        message_name = message_element.tag
+    message_description = _get_record_value("_MsgDescription")
+    message_order = _get_record_value("_MsgOrder", allow_missing=True, as_int=True)
+    message_handler = _get_record_value("_MsgHandler", allow_missing=True)
 
-        # ignore duplicates
-        if messages.get(message_name):
-            logger.debug(f"ignoring duplicate message {message_name}")
+    parameters = {}
+    for parameter_element in record:
+        parameter_name = parameter_element.tag
+        if parameter_name.startswith("_"):
             continue
 
-        message_description = _get_record_value("_MsgDescription")
-        message_order = _get_record_value("_MsgOrder", allow_missing=True, as_int=True)
-
-        parameters = {}
-        for parameter_element in record:
-            parameter_name = parameter_element.tag
-            if parameter_name.startswith("_"):
-                continue
-
-            def _try_either(target: dict, keys: list[str]):
-                for key in keys:
-                    try:
-                        return target[key]
-                    except KeyError:
-                        continue
-                raise KeyError(f"Couldn't find {keys} in dict")
-
-            # TODO: sometimes this isn't provided, mainly to troll
-            try:
-                #parameter_type = parameter_element.attrib["TYPE"]
-                parameter_type = _try_either(parameter_element.attrib, ["TYPE", "TYP", "TPYE"])
-            except KeyError:
-                if parameter_name == "GlobalID":
-                    logger.debug(
-                        f"Missing TYPE for param {parameter_name} on message {message_name}"
-                    )
-                    parameter_type = "GID"
-
-                else:
-                    raise RuntimeError(
-                        f"Unhandled TYPE for param {parameter_name} of message {message_name}"
-                    )
-
-            parameters[parameter_name] = MessageDefinitionParameter(
-                parameter_name, parameter_type
+        def _try_either(target: dict, keys: list[str]):
+            for key in keys:
+                try:
+                    return target[key]
+                except KeyError:
+                    continue
+            raise KeyError(f"Couldn't find {keys} in dict")
+
+        # TODO: sometimes this isn't provided, mainly to troll
+        try:
+            # parameter_type = parameter_element.attrib["TYPE"]
+            parameter_type = _try_either(
+                parameter_element.attrib, ["TYPE", "TYP", "TPYE"]
             )
-
-        messages[message_name] = MessageDefinition(
-            message_order, message_name, message_description, parameters
+        except KeyError:
+            if parameter_name == "GlobalID":
+                logger.debug(
+                    f"Missing TYPE for param {parameter_name} on message {message_name}"
+                )
+                parameter_type = "GID"
+
+            else:
+                raise RuntimeError(
+                    f"Unhandled TYPE for param {parameter_name} of message {message_name}"
+                )
+
+        parameters[parameter_name] = MessageDefinitionParameter(
+            parameter_name, parameter_type
         )
 
+    return MessageDefinition(
+        message_order, message_name, message_description, parameters, message_handler
+    )
+
+
+def _sort_messages(
+    messages: dict[str, MessageDefinition],
+) -> dict[Union[int, str], MessageDefinition]:
     message_defs = list(messages.values())
 
     # order: message
@@ -134,6 +131,48 @@ def _get_messages_from_xml(
     return sorted_messages
 
 
+def _get_protocol_info_from_xml(
+    protocol_info: ElementTree.Element,
+) -> tuple[int, str, int, str]:
+    protocol_info_record = protocol_info[0]
+
+    def _get_record_value(name) -> str:
+        element = protocol_info_record.find(name)
+
+        if element is None:
+            raise ValueError(f"{name} missing from protocol info entry")
+
+        return element.text
+
+    service_id = int(_get_record_value("ServiceID"))
+    protocol_type = _get_record_value("ProtocolType")
+    protocol_version = int(_get_record_value("ProtocolVersion"))
+    protocol_description = _get_record_value("ProtocolDescription")
+
+    return service_id, protocol_type, protocol_version, protocol_description
+
+
+def read_service_id(file_path: str | Path) -> int:
+    """
+    Reads only the ServiceID from a protocol file's _ProtocolInfo, parsing stops
+    as soon as it's found
+    """
+    in_protocol_info = False
+
+    with open(file_path, "rb") as fp:
+        for event, element in ElementTree.iterparse(fp, events=("start", "end")):
+            if element.tag == "_ProtocolInfo":
+                if event == "end":
+                    break
+
+                in_protocol_info = True
+
+            elif in_protocol_info and event == "end" and element.tag == "ServiceID":
+                return int(element.text)
+
+    raise ValueError(f"Invalid protocol definition in xml file {file_path}")
+
+
 @dataclass
 class ProtocolDefinition:
     service_id: int
@@ -151,38 +190,47 @@ class ProtocolDefinition:
         return cls.from_xml_file(protocol_string)
 
     @classmethod
-    def from_xml_file(cls, file_path: str | Path | StringIO):
+    def from_xml_file(cls, file_path: str | Path | StringIO | BytesIO):
         if isinstance(file_path, str):
             file_path = Path(file_path)
 
-        tree = ElementTree.parse(file_path)
-        root_element = tree.getroot()
+        protocol_info = None
+        # message name: definition
+        messages: dict[str, MessageDefinition] = {}
 
-        protocol_info = root_element.find("_ProtocolInfo")
+        # stream the file so only one message element is alive at a time
+        root_element = None
+        depth = 0
+        for event, element in ElementTree.iterparse(file_path, events=("start", "end")):
+            if event == "start":
+                if root_element is None:
+                    root_element = element
 
-        if protocol_info is None:
-            raise ValueError(f"Invalid protocol definition in xml file {file_path}")
+                depth += 1
+                continue
+
+            depth -= 1
 
-        protocol_info_record = protocol_info[0]
+            # only direct children of the root are complete entries
+            if depth != 1:
+                continue
 
-        def _get_record_value(name) -> str:
-            element = protocol_info_record.find(name)
+            if element.tag == "_ProtocolInfo":
+                protocol_info = _get_protocol_info_from_xml(element)
 
-            if element is None:
-                raise ValueError(f"{name} missing from protocol info entry")
+            # ignore duplicates
+            elif messages.get(element.tag):
+                logger.debug(f"ignoring duplicate message {element.tag}")
 
-            return element.text
+            else:
+                messages[element.tag] = _get_message_from_xml(element)
 
-        service_id = int(_get_record_value("ServiceID"))
-        protocol_type = _get_record_value("ProtocolType")
-        protocol_version = int(_get_record_value("ProtocolVersion"))
-        protocol_description = _get_record_value("ProtocolDescription")
+            root_element.clear()
 
-        messages = _get_messages_from_xml(root_element)
+        if protocol_info is None:
+            raise ValueError(f"Invalid protocol definition in xml file {file_path}")
 
-        return cls(
-            service_id, protocol_type, protocol_version, protocol_description, messages
-        )
+        return cls(*protocol_info, _sort_messages(messages))
 
 
 if __name__ == "__main__":
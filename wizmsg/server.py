@@ -1,29 +1,499 @@
 import asyncio
+import multiprocessing
+import multiprocessing.connection
+import signal
+import socket
+import time
+import weakref
+from concurrent.futures import Executor, ProcessPoolExecutor
+from functools import partial
+from typing import Any, Callable, Iterable, Union
 
-from wizmsg import network
+from loguru import logger
+
+from wizmsg import event_loop, network
+from wizmsg.capture import CaptureWriter
+from wizmsg.heartbeat import HeartbeatScheduler
+from wizmsg.metrics import Metrics
+from wizmsg.network.controls import Control
+from wizmsg.network.handlers import OffloadedHandler
+from wizmsg.network.protocol import MessageData, MessageRecord
+from wizmsg.protocol_definition import ProtocolDefinition
+from wizmsg.session import Session
+
+# session ids are sent as unsigned2
+MAX_SESSION_ID = 0xFFFF
+
+# what broadcast does with a session whose write buffer is over its high water mark
+# leave it out of this broadcast
+SKIP_PAUSED = "skip"
+# write anyway; the transport buffers it
+SEND_PAUSED = "send"
+# drop the session, it isn't keeping up
+CLOSE_PAUSED = "close"
 
 
 class Server:
-    def __init__(self, address: str, port: int = 8000):
+    """
+    server = Server("0.0.0.0", 12000)
+
+    @server.handlers.on("MSG_PERSON")
+    async def person(session, message):
+        session.send(message)
+
+    or override handle_message to see every message
+
+    class EchoServer(Server):
+        def handle_message(self, session, message):
+            session.send(message)
+
+    server = EchoServer("0.0.0.0", 12000)
+    server.message_processor.load_protocols_from_directory("messages")
+    wizmsg.run(server.run())
+    """
+
+    def __init__(
+        self,
+        address: str,
+        port: int = 8000,
+        *,
+        heartbeat_interval: float = 60,
+        heartbeat_timeout: float = 60,
+        max_frame_size: int | None = None,
+        metrics: Metrics | None = None,
+        capture: CaptureWriter | None = None,
+        message_records: bool = False,
+        executor: Executor | None = None,
+        max_in_flight: int = 64,
+        offload_frame_size: int | None = None,
+    ):
+        """
+        metrics: count and time every frame sessions send and receive
+        capture: record every frame sessions send and receive
+        message_records: pass handle_message MessageRecord tuples instead of
+        MessageData
+        executor: runs offloaded handlers and decodes, the loop's default thread
+        pool when None; see process_pool for processes
+        max_in_flight: offloaded work queued for a session before reading from
+        it pauses
+        offload_frame_size: decode frames of at least this many bytes in executor;
+        a process pool has to come from process_pool
+        """
         self.address = address
         self.port = port
 
-        self.server = None
-        self.message_processor = network.Processor()
-        self.sessions = []
+        self.max_frame_size = max_frame_size
+        # new sessions record to this
+        self.capture = capture
+        self.message_records = message_records
 
-    async def _client_connection(
-        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
-    ):
-        data = await reader.read()
-        message = self.message_processor.process_frame(data)
+        if offload_frame_size is not None:
+            _check_decode_executor(executor)
+
+        self.executor = executor
+        self.max_in_flight = max_in_flight
+        self.offload_frame_size = offload_frame_size
+
+        # one timer for every session's keep alives
+        self.heartbeat = HeartbeatScheduler(
+            heartbeat_interval,
+            heartbeat_timeout,
+            tick=min(1, heartbeat_interval, heartbeat_timeout),
+        )
+
+        self.server: asyncio.AbstractServer | None = None
+        self.message_processor = network.Processor(metrics=metrics)
+        # handlers handle_message dispatches to
+        self.handlers = self.message_processor.handlers
+        # async handlers still running
+        self._handler_tasks: set[asyncio.Task] = set()
+        # session id: session
+        self.sessions: dict[int, Session] = {}
+        # group name: sessions in it
+        self.groups: dict[str, set[Session]] = {}
+        self._last_session_id = 0
+
+        self.metrics = metrics
+        self.metrics_server: asyncio.AbstractServer | None = None
+        if metrics is not None:
+            metrics.gauge("wizmsg_sessions", lambda: len(self.sessions))
+
+    def add_session(self, session: Session) -> int:
+        """
+        Registers session and returns its id
+        """
+        if len(self.sessions) >= MAX_SESSION_ID:
+            raise RuntimeError("Out of session ids")
+
+        session_id = self._last_session_id
+        while True:
+            session_id = session_id % MAX_SESSION_ID + 1
+            if session_id not in self.sessions:
+                break
+
+        self._last_session_id = session_id
+        self.sessions[session_id] = session
+
+        logger.debug(f"session {session_id} started")
+        return session_id
+
+    def remove_session(self, session: Session):
+        for group in list(session.groups):
+            self.leave(group, session)
+
+        if self.sessions.get(session.id) is session:
+            del self.sessions[session.id]
+            logger.debug(f"session {session.id} ended")
+
+    def join(self, group: str, session: Session):
+        """
+        Add session to a named group for broadcast; sessions leave every group
+        when they end
+        """
+        self.groups.setdefault(group, set()).add(session)
+        session.groups.add(group)
+
+    def leave(self, group: str, session: Session):
+        members = self.groups.get(group)
+        if members is not None:
+            members.discard(session)
+            if not members:
+                del self.groups[group]
+
+        session.groups.discard(group)
+
+    def broadcast(
+        self,
+        frame: Union[Control, MessageData, MessageRecord],
+        recipients: str | Iterable[Session] | None = None,
+        *,
+        exclude: Session | None = None,
+        paused: str = SKIP_PAUSED,
+    ) -> int:
+        """
+        Encode frame once and write the same bytes to every recipient; returns
+        how many sessions it was written to. Closed sessions are skipped
+
+        recipients: a group name, sessions, or None for every session
+        exclude: i.e. the session a chat message came from
+        paused: SKIP_PAUSED, SEND_PAUSED or CLOSE_PAUSED; what to do with
+        sessions whose writes are backed up
+
+        server.broadcast(chat_message, "zone:WizardCity/WC_Hub", exclude=session)
+        """
+        if paused not in (SKIP_PAUSED, SEND_PAUSED, CLOSE_PAUSED):
+            raise ValueError(f"Unknown paused policy {paused!r}")
+
+        if recipients is None:
+            recipients = self.sessions.values()
+        elif isinstance(recipients, str):
+            recipients = self.groups.get(recipients, ())
+
+        raw, seconds = self.message_processor.encode_frame(frame)
+
+        sent = 0
+        # copied; closing a session changes the groups
+        for session in list(recipients):
+            if not session.alive or session is exclude:
+                continue
+
+            if session.writing_paused and paused != SEND_PAUSED:
+                if paused == CLOSE_PAUSED:
+                    logger.warning(f"closing {session}: not keeping up with writes")
+                    session.close()
+
+                continue
+
+            session.send_raw(raw)
+            sent += 1
+
+        # counted per frame written, the same as Session.send
+        self.message_processor.frame_encoded(raw, frame, seconds, sent)
+
+        return sent
+
+    def handle_message(self, session: Session, message: MessageData | MessageRecord):
+        """
+        Called on the event loop for every message a session receives; runs the
+        handler registered for it, async handlers as a task and offloaded ones
+        in executor
+        """
+        handler = self.handlers.lookup(message)
+        if handler is None:
+            return
+
+        if type(handler) is OffloadedHandler:
+            session.offload(handler.function, message)
+            return
+
+        result = handler(session, message)
+        if result is not None and asyncio.iscoroutine(result):
+            task = asyncio.get_running_loop().create_task(result)
+            self._handler_tasks.add(task)
+            task.add_done_callback(
+                lambda finished: self._handler_task_done(session, finished)
+            )
+
+    def _handler_task_done(self, session: Session, task: asyncio.Task):
+        self._handler_tasks.discard(task)
+
+        if not task.cancelled() and task.exception() is not None:
+            logger.opt(exception=task.exception()).error(
+                f"message handler failed for {session}"
+            )
+
+    def handle_control(self, session: Session, control: Control):
+        """
+        Called on the event loop for every control a session receives, after the
+        session has handled it itself
+        """
+        pass
+
+    def run_in_executor(self, function: Callable[..., Any], *args) -> asyncio.Future:
+        return asyncio.get_running_loop().run_in_executor(
+            self.executor, function, *args
+        )
+
+    def decode_in_executor(self, raw: bytes) -> asyncio.Future:
+        """
+        Processor.decode_frame run in executor; the result goes through
+        Processor.frame_decoded back on the loop so metrics and trace hooks are
+        only touched there
+        """
+        if isinstance(self.executor, ProcessPoolExecutor):
+            _check_decode_executor(self.executor)
+            return self.run_in_executor(_decode_in_pool, raw, self.message_records)
+
+        return self.run_in_executor(
+            partial(
+                self.message_processor.decode_frame,
+                raw,
+                as_record=self.message_records,
+            )
+        )
+
+    def process_pool(self, workers: int | None = None) -> ProcessPoolExecutor:
+        """
+        A process pool whose workers have this server's protocols, so frames can
+        be decoded in it; load protocols first
+
+        server.message_processor.load_protocols_from_directory("messages")
+        server.executor = server.process_pool(4)
+        """
+        processor = self.message_processor
+
+        # indexed protocols are loaded up front so every worker has them
+        for service_id in list(processor.protocol_index):
+            processor.get_protocol(service_id)
+
+        executor = ProcessPoolExecutor(
+            workers,
+            initializer=_init_pool_worker,
+            initargs=(
+                [protocol.definition for protocol in processor.protocols.values()],
+            ),
+        )
+        _decode_pools.add(executor)
 
-    async def run(self):
-        self.server = await asyncio.start_server(
-            self._client_connection,
+        return executor
+
+    def _create_session(self) -> Session:
+        return Session(self)
+
+    async def start(self, *, reuse_port: bool = False):
+        """
+        reuse_port: bind with SO_REUSEPORT so several processes can share the address
+        """
+        self.heartbeat.start()
+        self.server = await asyncio.get_running_loop().create_server(
+            self._create_session,
             host=self.address,
             port=self.port,
+            reuse_port=reuse_port or None,
+        )
+
+    async def serve_metrics(self, host: str = "127.0.0.1", port: int = 9100):
+        """
+        Serve metrics in the prometheus text format; stopped by close
+        """
+        if self.metrics is None:
+            raise RuntimeError("Server was created without metrics")
+
+        self.metrics_server = await self.metrics.serve(host, port)
+
+    async def close(self):
+        """
+        Stop accepting connections and close every session
+        """
+        if self.server is not None:
+            self.server.close()
+
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+            await self.metrics_server.wait_closed()
+            self.metrics_server = None
+
+        self.heartbeat.stop()
+
+        for session in list(self.sessions.values()):
+            session.close()
+
+        for task in list(self._handler_tasks):
+            task.cancel()
+
+        if self.server is not None:
+            await self.server.wait_closed()
+
+    async def run(self, *, reuse_port: bool = False):
+        await self.start(reuse_port=reuse_port)
+
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        finally:
+            await self.close()
+
+    async def _run_worker(self):
+        loop = asyncio.get_running_loop()
+
+        stopping = asyncio.Event()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signal_number, stopping.set)
+
+        await self.start(reuse_port=True)
+
+        try:
+            await stopping.wait()
+        finally:
+            await self.close()
+
+    def run_workers(
+        self,
+        workers: int,
+        *,
+        restart_delay: float = 1,
+        shutdown_timeout: float = 10,
+        use_uvloop: bool | None = None,
+    ):
+        """
+        Fork workers processes that each bind the address with SO_REUSEPORT and
+        run their own event loop, so the kernel spreads connections across them;
+        blocks until SIGINT or SIGTERM then shuts the workers down, or until every
+        worker has exited cleanly. Workers that crash or are killed are restarted
+
+        Load protocols before calling this so the workers inherit them copy on write
+
+        use_uvloop: see wizmsg.new_event_loop
+
+        server = Server("0.0.0.0", 12000)
+        server.message_processor.load_protocols_from_directory("messages")
+        server.run_workers(os.cpu_count())
+        """
+        if not hasattr(socket, "SO_REUSEPORT"):
+            raise RuntimeError("SO_REUSEPORT isn't supported on this platform")
+
+        context = multiprocessing.get_context("fork")
+
+        # worker index: process
+        processes: dict[int, multiprocessing.Process] = {}
+        stopping = False
+
+        def _stop(signal_number, frame):
+            nonlocal stopping
+            stopping = True
+
+        def _spawn(index: int):
+            process = context.Process(
+                target=_worker_main,
+                args=(self, use_uvloop),
+                name=f"wizmsg-worker-{index}",
+            )
+            process.start()
+            processes[index] = process
+
+        previous_handlers = {
+            signal_number: signal.signal(signal_number, _stop)
+            for signal_number in (signal.SIGINT, signal.SIGTERM)
+        }
+
+        try:
+            for index in range(workers):
+                _spawn(index)
+
+            logger.info(f"started {workers} workers on {self.address}:{self.port}")
+
+            while not stopping:
+                multiprocessing.connection.wait(
+                    [process.sentinel for process in processes.values()], timeout=0.5
+                )
+
+                for index, process in list(processes.items()):
+                    if process.exitcode is None or stopping:
+                        continue
+
+                    if process.exitcode == 0:
+                        # shut itself down; only crashes and signals are restarted
+                        logger.info(f"worker {index} exited")
+                        del processes[index]
+                        continue
+
+                    logger.warning(
+                        f"worker {index} exited with {process.exitcode}; restarting"
+                    )
+                    # don't spin if the worker dies on startup
+                    time.sleep(restart_delay)
+                    _spawn(index)
+
+                if not processes:
+                    break
+
+        finally:
+            for process in processes.values():
+                if process.exitcode is None:
+                    process.terminate()
+
+            deadline = time.monotonic() + shutdown_timeout
+            for index, process in processes.items():
+                process.join(max(0.0, deadline - time.monotonic()))
+
+                if process.exitcode is None:
+                    logger.warning(f"worker {index} didn't stop in time; killing")
+                    process.kill()
+                    process.join()
+
+            for signal_number, handler in previous_handlers.items():
+                signal.signal(signal_number, handler)
+
+
+# process pools made by Server.process_pool; only their workers can decode
+_decode_pools: "weakref.WeakSet[ProcessPoolExecutor]" = weakref.WeakSet()
+
+_pool_processor: network.Processor | None = None
+
+
+def _check_decode_executor(executor: Executor | None):
+    if isinstance(executor, ProcessPoolExecutor) and executor not in _decode_pools:
+        raise ValueError(
+            "Frames can only be decoded in process pools from Server.process_pool,"
+            " other pools' workers don't have the protocols"
         )
 
-        async with self.server:
-            await self.server.serve_forever()
+
+def _init_pool_worker(protocol_definitions: list[ProtocolDefinition]):
+    global _pool_processor
+
+    _pool_processor = network.Processor()
+    for protocol_definition in protocol_definitions:
+        _pool_processor.add_protocol(protocol_definition)
+
+
+def _decode_in_pool(raw: bytes, as_record: bool):
+    return _pool_processor.decode_frame(raw, as_record=as_record)
+
+
+def _worker_main(server: Server, use_uvloop: bool | None):
+    # the supervisor's handlers were inherited through the fork
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    event_loop.run(server._run_worker(), use_uvloop=use_uvloop)
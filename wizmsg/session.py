@@ -1,71 +1,403 @@
 import asyncio
-import struct
+import time
+from collections import deque
 from datetime import datetime
+from typing import TYPE_CHECKING, Any, Callable, Union
 
-from wizmsg import DATA_START_MAGIC, LARGE_DATA_MAGIC, ByteInterface, Server
+from loguru import logger
 
+from wizmsg.capture import INVALID, RECEIVED, SENT
+from wizmsg.network.controls import (
+    Control,
+    KeepAlive,
+    KeepAliveResponse,
+    SessionOffer,
+)
+from wizmsg.network.framing import FrameDecoder
+from wizmsg.network.protocol import MessageData, MessageRecord
 
-class Session:
-    def __init__(
-        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, server: Server
-    ):
-        self.reader = reader
-        self.writer = writer
+if TYPE_CHECKING:
+    from wizmsg import Server
+
+# kinds of ordered work
+# a message or control that arrived while earlier work was in flight
+_DISPATCH = 0
+# an offloaded handler; its result is sent back
+_REPLY = 1
+# a frame decoded off the loop; its result is dispatched, the payload is the raw frame
+_DECODED = 2
+
+
+class Session(asyncio.Protocol):
+    """
+    One client connection; created by the server's transport for every
+    accepted socket, frames are decoded as data arrives
+    """
+
+    def __init__(self, server: "Server"):
         self.server = server
+        self.processor = server.message_processor
+
+        self.transport: asyncio.Transport | None = None
+        self.decoder = FrameDecoder(max_frame_size=server.max_frame_size)
+        # CaptureWriter recording this session's frames
+        self.capture = server.capture
 
         self.start_time = datetime.now()
-        self.id: int
+        self._start_monotonic = time.monotonic()
+        self.id: int = 0
+
+        self.alive: bool = False
+        # loop time the last frame was received
+        self.last_seen: float = 0.0
+        # set while the transport's write buffer is over its high water mark
+        self.writing_paused: bool = False
+
+        # names of the server groups this session is in
+        self.groups: set[str] = set()
+
+        # set while reading is paused for too much offloaded work
+        self.reading_paused: bool = False
+
+        # control name: futures waiting on it
+        self._control_waiters: dict[str, list[asyncio.Future]] = {}
+
+        # (executor future or None, kind, payload) applied in arrival order
+        self._ordered: deque[tuple[asyncio.Future | None, int, Any]] = deque()
+        # work queued while applying the head of _ordered; goes in front of the rest
+        self._collecting: list[tuple[asyncio.Future | None, int, Any]] | None = None
+        # raw frames already read but not processed while _ordered is full
+        self._held: deque[bytes] = deque()
+
+    def __repr__(self) -> str:
+        return f"<Session id={self.id} alive={self.alive}>"
+
+    # asyncio.Protocol callbacks
+
+    def connection_made(self, transport: asyncio.Transport):
+        self.transport = transport
+
+        try:
+            self.id = self.server.add_session(self)
+        except RuntimeError as exc:
+            logger.warning(f"refusing connection: {exc}")
+            transport.close()
+            return
+
+        self.alive = True
+
+        self.start()
+
+    def data_received(self, data: bytes):
+        self.server.heartbeat.touch(self)
+
+        try:
+            frames = self.decoder.feed(data)
+        except ValueError as exc:
+            # stream is out of sync; nothing after this can be trusted
+            logger.warning(f"closing {self}: {exc}")
+
+            if self.processor.metrics is not None:
+                self.processor.metrics.error("decode", exc)
+
+            if self.capture is not None:
+                self.capture.write(data, session_id=self.id, direction=INVALID)
+
+            self.close()
+            return
+
+        if self.capture is not None:
+            received_at = time.time()
+            for raw in frames:
+                self.capture.write(
+                    raw, session_id=self.id, direction=RECEIVED, timestamp=received_at
+                )
+
+        if self._held:
+            # behind frames already waiting for offloaded work
+            self._held.extend(frames)
+            return
+
+        self._process_frames(deque(frames))
+
+    def _process_frames(self, frames: deque[bytes]):
+        offload_frame_size = self.server.offload_frame_size
+        max_in_flight = self.server.max_in_flight
+
+        while frames:
+            if not self.alive:
+                return
+
+            if len(self._ordered) >= max_in_flight:
+                # pausing reading doesn't stop what's already been read
+                self._held.extend(frames)
+                self._pause_reading()
+                return
+
+            raw = frames.popleft()
+
+            if offload_frame_size is not None and len(raw) >= offload_frame_size:
+                self._enqueue(self.server.decode_in_executor(raw), _DECODED, raw)
+                continue
+
+            try:
+                frame = self.processor.process_frame(
+                    raw, as_record=self.server.message_records
+                )
+            except Exception:
+                logger.exception(f"failed to process frame from {self}")
+                continue
+
+            if self._ordered:
+                # earlier frames are still being handled off the loop
+                self._enqueue(None, _DISPATCH, frame)
+            elif isinstance(frame, Control):
+                self.dispatch_control(frame)
+            else:
+                self._handle_message(frame)
+
+    def eof_received(self):
+        # let the transport close itself
+        return None
+
+    def pause_writing(self):
+        self.writing_paused = True
+
+    def resume_writing(self):
+        self.writing_paused = False
+
+    def connection_lost(self, exc: Exception | None):
+        self.alive = False
+        self.server.remove_session(self)
+        self.server.heartbeat.remove(self)
+
+        for waiters in self._control_waiters.values():
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.cancel()
+
+        self._control_waiters.clear()
+
+        for future, _, _ in self._ordered:
+            if future is not None:
+                future.cancel()
 
-        self.alive: bool = True
+        self._ordered.clear()
+        self._held.clear()
 
-        self.heartbeat_task: asyncio.Task | None = None
-        self.process_loop_task: asyncio.Task | None = None
+    # session
 
-    async def start(self):
+    def start(self):
         """
-        accept session, start heartbeat, start process loop
+        accept session, start heartbeat
         """
-        await self.accept_session()
-        self.heartbeat_task = asyncio.create_task(self.heartbeat())
-        self.process_loop_task = asyncio.create_task(self.process_loop())
+        self.accept_session()
+        self.server.heartbeat.add(self)
 
-    async def stop(self):
+    def close(self):
         """
-        stop session and tasks
+        stop session; connection_lost finishes the teardown
         """
         self.alive = False
-        self.heartbeat_task.cancel()
-        self.process_loop_task.cancel()
 
-    async def accept_session(self):
-        pass
+        if self.transport is not None:
+            self.transport.close()
 
-    # https://kronos-project.github.io/grimoire/internals/protocol/sessions.html#heartbeat
-    async def heartbeat(self):
+    def send(self, frame: Union[Control, MessageData, MessageRecord]):
+        if not self.alive:
+            raise ConnectionError(f"{self} is closed")
+
+        self.send_raw(self.processor.prepare_frame(frame))
+
+    def send_raw(self, raw: bytes):
+        """
+        Send an already prepared frame
+        """
+        if not self.alive:
+            raise ConnectionError(f"{self} is closed")
+
+        if self.capture is not None:
+            self.capture.write(raw, session_id=self.id, direction=SENT)
+
+        self.transport.write(raw)
+
+    def elapsed_milliseconds(self) -> int:
+        return int((time.monotonic() - self._start_monotonic) * 1000)
+
+    # https://kronos-project.github.io/grimoire/internals/protocol/sessions.html#session-offer
+    def accept_session(self):
+        now = time.time()
+
+        self.send(
+            SessionOffer(
+                session_id=self.id,
+                timestamp=int(now),
+                milliseconds=int(now * 1000) % 1000,
+                crypto_flags=0,
+                crypto_key_slot=0,
+                crypto_key_mask=0,
+                crypto_challenge=b"",
+                crypto_nonce=0,
+                crypto_signature=bytes(256),
+                opcode=SessionOffer.opcode,
+            )
+        )
+
+    def make_keep_alive(self, control_type: type[KeepAlive] = KeepAlive) -> KeepAlive:
+        elapsed = self.elapsed_milliseconds()
+
+        return control_type(
+            session_id=self.id,
+            milliseconds=elapsed & 0xFFFF,
+            session_minutes=(elapsed // 60_000) & 0xFFFF,
+            opcode=control_type.opcode,
+        )
+
+    def dispatch_control(self, control: Control):
+        # clients may send their own keep alive; KeepAliveResponse subclasses it
+        if type(control) is KeepAlive:
+            self.send(self.make_keep_alive(KeepAliveResponse))
+
+        elif type(control) is KeepAliveResponse:
+            self.server.heartbeat.response_received(self)
+
+        waiters = self._control_waiters.pop(type(control).__name__, None)
+        if waiters is not None:
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(control)
+
+        try:
+            self.server.handle_control(self, control)
+        except Exception:
+            logger.exception(f"control handler failed for {self}")
+
+    def dispatch_message(self, message: MessageData | MessageRecord):
+        if self._ordered:
+            # earlier messages are still being handled off the loop
+            self._enqueue(None, _DISPATCH, message)
+            return
+
+        self._handle_message(message)
+
+    def _handle_message(self, message: MessageData | MessageRecord):
+        try:
+            self.server.handle_message(self, message)
+        except Exception:
+            logger.exception(f"message handler failed for {self}")
+
+    def offload(
+        self, function: Callable[[Any], Any], message: MessageData | MessageRecord
+    ):
         """
-        Send Keep alive every 60 seconds, wait for response, close if none after 60 seconds
+        Run function(message) in the server's executor and send back what it
+        returns, if anything; replies and later messages keep arrival order
         """
-        pass
+        self._enqueue(self.server.run_in_executor(function, message), _REPLY)
 
-    async def process_loop(self):
-        while self.alive:
-            magic_and_size = await self.reader.read(4)
+    def _enqueue(self, future: asyncio.Future | None, kind: int, payload: Any = None):
+        entry = (future, kind, payload)
 
-            magic, size = struct.unpack("<HH", magic_and_size)
+        if future is not None:
+            future.add_done_callback(self._ordered_done)
 
-            assert (
-                magic == DATA_START_MAGIC
-            ), f"Magic mismatch, {magic=} {DATA_START_MAGIC=}"
+        if self._collecting is not None:
+            self._collecting.append(entry)
+            return
 
-            if size >= LARGE_DATA_MAGIC:
-                large_size_data = await self.reader.read(4)
+        self._ordered.append(entry)
 
-                size = struct.unpack("<I", large_size_data)
+        if len(self._ordered) >= self.server.max_in_flight:
+            self._pause_reading()
 
-            data = ByteInterface(await self.reader.read(size + 1))
+    def _pause_reading(self):
+        if not self.reading_paused and self.transport is not None:
+            self.transport.pause_reading()
+            self.reading_paused = True
 
-    async def dispatch_control(self):
-        pass
+    def _ordered_done(self, _: asyncio.Future):
+        ordered = self._ordered
+
+        while ordered:
+            future, kind, payload = ordered[0]
+            if future is not None and not future.done():
+                break
+
+            ordered.popleft()
+
+            if not self.alive:
+                continue
+
+            self._collecting = []
+            try:
+                self._apply(future, kind, payload)
+            except Exception:
+                logger.exception(f"offloaded work failed for {self}")
+            finally:
+                collected, self._collecting = self._collecting, None
+
+            ordered.extendleft(reversed(collected))
+
+        if self._held and self.alive and len(ordered) < self.server.max_in_flight:
+            held, self._held = self._held, deque()
+            self._process_frames(held)
+
+        if (
+            self.reading_paused
+            and self.alive
+            and not self._held
+            and len(ordered) <= self.server.max_in_flight // 2
+        ):
+            self.transport.resume_reading()
+            self.reading_paused = False
+
+    def _apply(self, future: asyncio.Future | None, kind: int, payload: Any):
+        if kind == _DISPATCH:
+            if isinstance(payload, Control):
+                self.dispatch_control(payload)
+            else:
+                self._handle_message(payload)
+
+            return
+
+        if future.cancelled():
+            return
+
+        exc = future.exception()
+        if exc is not None:
+            if kind == _DECODED and self.processor.metrics is not None:
+                self.processor.metrics.error("decode", exc)
+
+            logger.opt(exception=exc).error(f"offloaded work failed for {self}")
+            return
+
+        if kind == _REPLY:
+            result = future.result()
+            if result is not None:
+                self.send(result)
+
+            return
+
+        # counted and traced here, on the loop
+        result, seconds = future.result()
+        self.processor.frame_decoded(payload, result, seconds)
+
+        if isinstance(result, Control):
+            self.dispatch_control(result)
+
+        else:
+            self._handle_message(result)
+
+    async def wait_for_control(self, name: str, *, timeout: float | None = None):
+        """
+        Wait for the next control of type name i.e. "KeepAliveResponse"
+        """
+        waiter = asyncio.get_running_loop().create_future()
+        self._control_waiters.setdefault(name, []).append(waiter)
 
-    async def wait_for_control(self, name: str):
-        pass
+        try:
+            return await asyncio.wait_for(waiter, timeout)
+        finally:
+            waiters = self._control_waiters.get(name)
+            if waiters is not None and waiter in waiters:
+                waiters.remove(waiter)